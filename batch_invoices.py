@@ -0,0 +1,312 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import invoice_renderer
+import invoice_bundle
+import invoice_numbers
+import invoice_store
+import products_db
+import render_cache
+import schema
+
+# Headless month-end renderer: python batch_invoices.py invoices.jsonl --workers 8
+#
+# JSONL input: one invoice per line,
+#   {"customer": {"name": ..., "email": ..., "address": ...},
+#    "items": [{"name": ..., "price": ..., "quantity": ...}, ...],
+#    "invoice_number": optional}
+# CSV input: one line item per row with the columns customer_name,
+#   customer_email, customer_address, item_name, price, quantity and an
+#   optional invoice_id; consecutive rows with the same invoice_id (or the
+#   same customer when there is no invoice_id) form one invoice.
+#
+# Invoices without an invoice_number get the next number from the shared
+# sequence in the product database. Each worker reserves numbers in blocks,
+# so numbers are unique across workers, runs and the GUI, but a batch is not
+# guaranteed to be numbered in input order.
+#
+# Every rendered invoice is recorded in the invoice history with its PDF, as
+# the GUI does. An invoice_number that is already in the history (a re-run
+# of the same input) is rendered again over its PDF but not recorded twice.
+# Numbers that map to the same file name (A/1 and A_1) never overwrite each
+# other: the second gets invoice_A_1_1.pdf.
+#
+# With --cache-dir, invoices identical to ones rendered before (same number,
+# customer, lines and company settings) are copied from the render cache, so
+# re-running a batch that failed part way only renders what is missing.
+# Invoices numbered from the sequence get new numbers on every run and so
+# only repeat when the input carries its own invoice_number.
+#
+# With --bundle the invoices are written in input order into one PDF (split
+# into parts of about --max-pages pages if given) by a single process, with
+# an outline entry per invoice; see invoice_bundle.
+
+CSV_CUSTOMER_FIELDS = ('customer_name', 'customer_email', 'customer_address')
+
+_worker_settings = {}
+_worker_output_dir = None
+_worker_numbers = None
+_worker_cache = None
+
+def load_settings(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _item_tuple(item):
+    if isinstance(item, dict):
+        return (item.get('name'), item.get('price'), item.get('quantity', item.get('qty')))
+    return tuple(item)
+
+def make_record(data):
+    # One decoded JSON invoice in the shape the renderers take
+    return {
+        'customer': data.get('customer') or {},
+        'items': [_item_tuple(i) for i in data.get('items', [])],
+        'invoice_number': data.get('invoice_number'),
+    }
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            yield make_record(json.loads(line))
+
+def read_csv(path):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        current_key = None
+        current = None
+        for row in csv.DictReader(f):
+            key = row.get('invoice_id') or tuple(row.get(k, '') for k in CSV_CUSTOMER_FIELDS)
+            if key != current_key:
+                if current is not None:
+                    yield current
+                current_key = key
+                current = {
+                    'customer': {
+                        'name': row.get('customer_name', ''),
+                        'email': row.get('customer_email', ''),
+                        'address': row.get('customer_address', ''),
+                    },
+                    'items': [],
+                    'invoice_number': row.get('invoice_number') or None,
+                }
+            current['items'].append((row.get('item_name'), row.get('price'), row.get('quantity')))
+        if current is not None:
+            yield current
+
+def read_jobs(path):
+    if path.lower().endswith('.csv'):
+        return read_csv(path)
+    return read_jsonl(path)
+
+def _init_worker(settings, output_dir, db_path, number_format, block_size, cache_dir=None,
+                 cache_size=render_cache.DEFAULT_MAX_BYTES):
+    global _worker_settings, _worker_output_dir, _worker_numbers, _worker_cache
+    _worker_settings = settings
+    _worker_output_dir = output_dir
+    if db_path != products_db.get_db_path():
+        products_db.set_db_path(db_path)
+    _worker_numbers = invoice_numbers.NumberAllocator(block_size, number_format)
+    _worker_cache = render_cache.RenderCache(cache_dir, cache_size) if cache_dir else None
+
+def render_job(job):
+    index, record = job
+    start = time.perf_counter()
+    filename = None
+    try:
+        issued = datetime.now()
+        invoice_number = record.get('invoice_number') or _worker_numbers.next_number(issued)
+        filename = _recorded_pdf(invoice_number, record)
+        if filename:
+            total = invoice_renderer.render_invoice(
+                filename, _worker_settings, record['customer'], record['items'],
+                invoice_number=invoice_number, issued=issued, cache=_worker_cache)
+        else:
+            pdf, total = invoice_renderer.render_invoice_bytes(
+                _worker_settings, record['customer'], record['items'],
+                invoice_number=invoice_number, issued=issued, cache=_worker_cache)
+            filename = _save_new(invoice_number, issued, record, total, pdf)
+    except Exception as e:
+        return index, filename, None, time.perf_counter() - start, str(e)
+    return index, filename, total, time.perf_counter() - start, None
+
+def _recorded_pdf(invoice_number, record):
+    # A re-run renders an invoice already in the history over its own PDF;
+    # anything else gets a new file (see _save_new)
+    if record.get('invoice_number'):
+        for row in invoice_store.find_by_number(invoice_number):
+            if row[7] and os.path.dirname(row[7]) == _worker_output_dir:
+                return row[7]
+    return None
+
+def _save_new(invoice_number, issued, record, total, pdf):
+    # Writes the PDF to a file no other invoice is using and records it. A
+    # number already in the history (recorded with a PDF elsewhere, or by
+    # another worker just now) only gets the file.
+    filename = invoice_renderer.invoice_filename(_worker_output_dir, invoice_number)
+    try:
+        return invoice_store.record_new_invoice(
+            invoice_number, issued, record['customer'], record['items'], total,
+            write_pdf=lambda: invoice_renderer.write_new_file(filename, pdf))[1]
+    except invoice_store.DuplicateInvoice:
+        return invoice_renderer.write_new_file(filename, pdf)
+
+def _record_saved(unsaved, open_part=None):
+    # Records the bundled invoices whose part has been saved, oldest first;
+    # rows of the part still being drawn (open_part) stay in unsaved
+    while unsaved and unsaved[0][4] != open_part:
+        invoice_number, issued, record, total, part = unsaved.pop(0)
+        try:
+            invoice_store.record_new_invoice(invoice_number, issued, record['customer'], record['items'],
+                                             total, pdf_path=part)
+        except invoice_store.DuplicateInvoice:
+            pass
+
+def run_batch(records, output_dir, settings, workers=None, chunksize=16,
+              number_format=None, block_size=None, cache_dir=None,
+              cache_size=render_cache.DEFAULT_MAX_BYTES):
+    os.makedirs(output_dir, exist_ok=True)
+    schema.ensure_schema()
+    number_format = number_format or settings.get('invoice_number_format') or invoice_numbers.DEFAULT_FORMAT
+    initargs = (settings, output_dir, products_db.get_db_path(), number_format, block_size or chunksize,
+                cache_dir, cache_size)
+    jobs = enumerate(records)
+    results = []
+    start = time.perf_counter()
+    if workers == 1:
+        _init_worker(*initargs)
+        results = [render_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=initargs) as pool:
+            results = list(pool.map(render_job, jobs, chunksize=chunksize))
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+def run_bundle(records, filename, settings, max_pages=None, number_format=None, block_size=16):
+    # Same result tuples as run_batch, with each invoice's part as its file.
+    # Invoices are recorded in the history once their part is saved. A
+    # failing invoice stops the bundle: its part is dropped (see
+    # BundleWriter), and it and the invoices before it in that part are
+    # returned as failures.
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    schema.ensure_schema()
+    number_format = number_format or settings.get('invoice_number_format') or invoice_numbers.DEFAULT_FORMAT
+    numbers = invoice_numbers.NumberAllocator(block_size, number_format)
+    results = []
+    unsaved = []
+    start = time.perf_counter()
+    writer = invoice_bundle.BundleWriter(filename, settings, max_pages)
+    try:
+        with writer:
+            for index, record in enumerate(records):
+                invoice_start = time.perf_counter()
+                try:
+                    issued = datetime.now()
+                    invoice_number = record.get('invoice_number') or numbers.next_number(issued)
+                    total = writer.add(record['customer'], record['items'], invoice_number, issued)
+                except Exception as e:
+                    results.append((index, writer.parts[-1] if writer.parts else filename, None,
+                                    time.perf_counter() - invoice_start, str(e)))
+                    raise
+                part = writer.parts[-1]
+                _record_saved(unsaved, part)
+                unsaved.append((invoice_number, issued, record, total, part))
+                results.append((index, part, total, time.perf_counter() - invoice_start, None))
+    except Exception as e:
+        if not results or results[-1][4] is None:
+            # Reading the next record failed
+            results.append((len(results), filename, None, 0.0, str(e)))
+        saved = set(writer.parts)
+        results = [r if r[1] in saved or r[4] else (r[0], r[1], None, r[3], "not saved: its bundle part failed")
+                   for r in results]
+        _record_saved([row for row in unsaved if row[4] in saved])
+    else:
+        _record_saved(unsaved)
+    return results, time.perf_counter() - start
+
+def summarize(results, elapsed):
+    rendered = [r for r in results if r[4] is None]
+    failed = [r for r in results if r[4] is not None]
+    render_times = sorted(r[3] for r in rendered)
+    stats = {
+        'invoices': len(results),
+        'rendered': len(rendered),
+        'failed': len(failed),
+        'elapsed_s': elapsed,
+        'invoices_per_s': len(rendered) / elapsed if elapsed > 0 else 0.0,
+        'mean_render_ms': 1000 * sum(render_times) / len(render_times) if render_times else 0.0,
+        'p95_render_ms': 1000 * render_times[int(0.95 * (len(render_times) - 1))] if render_times else 0.0,
+    }
+    return stats, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render invoices from a JSONL or CSV file without the GUI.")
+    parser.add_argument('input', help="JSONL or CSV file of invoices")
+    parser.add_argument('-o', '--output-dir', default=invoice_renderer.default_output_dir())
+    parser.add_argument('-s', '--settings', default='company_settings.json',
+                        help="company settings JSON (default: company_settings.json)")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help="worker processes (default: CPU count)")
+    parser.add_argument('--chunksize', type=int, default=16,
+                        help="invoices handed to a worker at a time")
+    parser.add_argument('--db', help="database holding the invoice number sequence "
+                                     "(default: ~/Documents/invoices/products.db)")
+    parser.add_argument('--number-format',
+                        help="invoice number format (default: from the settings, else "
+                             + invoice_numbers.DEFAULT_FORMAT.replace('%', '%%') + ")")
+    parser.add_argument('--block-size', type=int,
+                        help="invoice numbers a worker reserves at a time (default: chunksize)")
+    parser.add_argument('--cache-dir', nargs='?', const=render_cache.default_cache_dir(),
+                        help="reuse invoices rendered before from a render cache in this directory "
+                             "(default with no value: " + render_cache.default_cache_dir() + ")")
+    parser.add_argument('--cache-size', type=int, default=render_cache.DEFAULT_MAX_BYTES // 2**20,
+                        help="render cache size limit in MB (default: %(default)s)")
+    parser.add_argument('--bundle', metavar='PDF',
+                        help="write all invoices into this one PDF instead of a file each")
+    parser.add_argument('--max-pages', type=int,
+                        help="with --bundle, start a new part file after about this many pages")
+    args = parser.parse_args(argv)
+
+    if args.number_format and not invoice_numbers.check_format(args.number_format):
+        parser.error("--number-format must contain {seq}")
+    if args.db:
+        products_db.set_db_path(args.db)
+    if args.max_pages is not None and (not args.bundle or args.max_pages < 1):
+        parser.error("--max-pages needs --bundle and must be at least 1")
+    settings = load_settings(args.settings)
+    if args.bundle:
+        results, elapsed = run_bundle(read_jobs(args.input), args.bundle, settings,
+                                      max_pages=args.max_pages, number_format=args.number_format,
+                                      block_size=args.block_size or args.chunksize)
+        workers = 1
+    else:
+        results, elapsed = run_batch(read_jobs(args.input), args.output_dir, settings,
+                                     workers=args.workers, chunksize=args.chunksize,
+                                     number_format=args.number_format, block_size=args.block_size,
+                                     cache_dir=args.cache_dir, cache_size=args.cache_size * 2**20)
+        workers = args.workers
+    stats, failed = summarize(results, elapsed)
+    for index, filename, _, _, error in failed:
+        print(f"Invoice {index} failed ({filename}): {error}", file=sys.stderr)
+    print(f"Rendered {stats['rendered']}/{stats['invoices']} invoices in {stats['elapsed_s']:.2f}s "
+          f"with {workers} worker{'s' if workers > 1 else ''}")
+    if args.bundle:
+        parts = sorted({r[1] for r in results if r[4] is None})
+        print(f"Bundle: {', '.join(parts)}")
+    print(f"Throughput: {stats['invoices_per_s']:.1f} invoices/s, "
+          f"mean {stats['mean_render_ms']:.1f} ms, p95 {stats['p95_render_ms']:.1f} ms per invoice")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import random
+from datetime import datetime, timedelta
+from PIL import Image as PILImage
+
+# Deterministic synthetic data for the benchmarks: the same seed always gives
+# the same catalog, invoices and logo, so runs on different machines or
+# commits measure the same work.
+
+WORDS = ("Widget", "Gadget", "Bracket", "Cable", "Sensor", "Panel", "Valve", "Hinge",
+         "Module", "Adapter", "Bolt", "Gear", "Filter", "Pump", "Switch", "Relay")
+GRADES = ("Basic", "Standard", "Pro", "Max", "Mini", "XL", "Heavy Duty", "Compact")
+
+def product_name(rng, i):
+    return f"{rng.choice(GRADES)} {rng.choice(WORDS)} {i:06d}"
+
+def make_catalog(count, seed=0):
+    # Rows in the shape products_db.import_products() accepts
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {
+            'sku': f"SKU-{i:07d}",
+            'name': product_name(rng, i),
+            'description': f"{rng.choice(WORDS)} for {rng.choice(WORDS).lower()} assemblies",
+            'price': f"{rng.randint(50, 500000) / 100:.2f}",
+        }
+
+def make_line_items(count, seed=0):
+    # (name, price, quantity) as text, like the GUI fields
+    rng = random.Random(seed)
+    return [(product_name(rng, i), f"{rng.randint(1, 100000) / 100:.2f}", str(rng.randint(1, 20)))
+            for i in range(count)]
+
+def make_customer(rng, i):
+    return {
+        'name': f"Customer {i:05d}",
+        'email': f"billing{i}@example.com",
+        'address': f"{rng.randint(1, 999)} {rng.choice(WORDS)} Street",
+    }
+
+def make_customers(count, seed=0):
+    # Rows in the shape customers_db.import_customers() accepts
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {
+            'name': f"{rng.choice(WORDS)} {rng.choice(GRADES)} {i:06d}",
+            'email': f"accounts{i}@{rng.choice(WORDS).lower()}.example.com",
+            'address': f"{rng.randint(1, 999)} {rng.choice(WORDS)} Street",
+        }
+
+def make_batch(invoices, lines_per_invoice, seed=0):
+    # Records in the shape batch_invoices.run_batch() accepts
+    rng = random.Random(seed)
+    return [{
+        'customer': make_customer(rng, i),
+        'items': make_line_items(lines_per_invoice, seed + i),
+    } for i in range(invoices)]
+
+def make_history(invoices, lines_per_invoice, products=500, customers=2000, seed=0,
+                 start=datetime(2024, 1, 1), days=730):
+    # (invoice_number, issued, customer_info, items) for
+    # invoice_store.save_invoice(), spread evenly over the period, with a
+    # small catalog so products repeat across invoices like real sales
+    rng = random.Random(seed)
+    names = [product_name(rng, i) for i in range(products)]
+    buyers = [make_customer(rng, i) for i in range(customers)]
+    step = days * 86400 / invoices
+    for i in range(invoices):
+        items = [(rng.choice(names), f"{rng.randint(1, 100000) / 100:.2f}", str(rng.randint(1, 20)))
+                 for _ in range(lines_per_invoice)]
+        yield (f"HIST-{i:07d}", start + timedelta(seconds=int(i * step)), rng.choice(buyers), items)
+
+def make_logo(path, size=(1200, 600)):
+    # A large gradient logo, the case logo_cache has to downsample
+    across = PILImage.linear_gradient("L").resize(size)
+    down = PILImage.linear_gradient("L").rotate(90).resize(size)
+    PILImage.merge("RGB", (across, down, across.rotate(180))).save(path)
+    return path
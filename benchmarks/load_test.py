@@ -0,0 +1,185 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Load test for render_service against localhost.
+#
+#   python benchmarks/load_test.py --requests 500 --concurrency 16
+#   python benchmarks/load_test.py --url http://127.0.0.1:8765 --requests 1000
+#   python benchmarks/load_test.py --unix /tmp/invoices.sock
+#
+# Without --url/--unix a service is started on a free port with a temporary
+# database and stopped afterwards. Each client thread keeps one connection
+# open and posts datagen invoices back to back; 503 answers (backpressure)
+# are counted, not retried. Prints throughput, latency percentiles and the
+# service's own /metrics, and with -o writes the summary as JSON.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import datagen
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+def connection_factory(url=None, unix_path=None, timeout=120):
+    if unix_path:
+        return lambda: UnixHTTPConnection(unix_path, timeout=timeout)
+    host, _, port = url.split('://', 1)[-1].rstrip('/').partition(':')
+    return lambda: http.client.HTTPConnection(host, int(port or 80), timeout=timeout)
+
+def request(conn, method, path, body=None):
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_service(workdir, workers, queue_size):
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'render_service.py'), '--port', str(port),
+         '--workers', str(workers), '--queue-size', str(queue_size),
+         '--db', os.path.join(workdir, 'load.db'), '--output-dir', os.path.join(workdir, 'out'),
+         '--settings', os.path.join(workdir, 'settings.json')],
+        cwd=workdir, stdout=subprocess.PIPE, text=True)
+    # The service prints one line once it is listening
+    line = proc.stdout.readline()
+    if not line:
+        raise RuntimeError("render service failed to start")
+    return proc, f"http://127.0.0.1:{port}"
+
+def run_load(connect, bodies, concurrency, path):
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(len(bodies)))
+
+    def client():
+        conn = connect()
+        try:
+            while True:
+                with lock:
+                    index = next(counter, None)
+                if index is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    status, _ = request(conn, 'POST', path, bodies[index])
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    conn = connect()
+                    status = 'error'
+                elapsed = time.perf_counter() - start
+                with lock:
+                    statuses[status] = statuses.get(status, 0) + 1
+                    if status == 200:
+                        latencies.append(elapsed)
+        finally:
+            conn.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(client) for _ in range(concurrency)]:
+            future.result()
+    return latencies, statuses, time.perf_counter() - start
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the local invoice render service.")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', help="running service to test, e.g. http://127.0.0.1:8765")
+    target.add_argument('--unix', metavar='PATH', help="running service on a Unix socket")
+    parser.add_argument('-n', '--requests', type=int, default=200)
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('--lines', type=int, default=10, help="line items per invoice")
+    parser.add_argument('--output', choices=('pdf', 'path'), default='pdf',
+                        help="ask for PDF bytes or a stored path")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="render processes when starting a service")
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help="queue size when starting a service")
+    parser.add_argument('-o', '--json', help="write the summary to this JSON file")
+    args = parser.parse_args(argv)
+
+    bodies = [json.dumps(record).encode('utf-8')
+              for record in datagen.make_batch(args.requests, args.lines)]
+    path = '/invoices' + ('?output=path' if args.output == 'path' else '')
+    proc = None
+    with tempfile.TemporaryDirectory(prefix='invoice-load-') as workdir:
+        try:
+            if args.url or args.unix:
+                url = args.url
+            else:
+                with open(os.path.join(workdir, 'settings.json'), 'w') as f:
+                    json.dump({'company_name': 'Load Test Ltd',
+                               'logo_path': datagen.make_logo(os.path.join(workdir, 'logo.png'))}, f)
+                proc, url = start_service(workdir, args.workers, args.queue_size)
+            connect = connection_factory(url, args.unix)
+            # One request first, so process start-up is not counted
+            conn = connect()
+            request(conn, 'POST', path, bodies[0])
+            latencies, statuses, elapsed = run_load(connect, bodies, args.concurrency, path)
+            _, metrics = request(conn, 'GET', '/metrics')
+            conn.close()
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait(timeout=30)
+
+    latencies.sort()
+    ok = statuses.get(200, 0)
+    summary = {
+        'requests': len(bodies),
+        'concurrency': args.concurrency,
+        'lines': args.lines,
+        'statuses': {str(k): v for k, v in statuses.items()},
+        'elapsed_s': elapsed,
+        'invoices_per_s': ok / elapsed if elapsed > 0 else 0.0,
+    }
+    if latencies:
+        summary.update({
+            'mean_ms': 1000 * statistics.fmean(latencies),
+            'p50_ms': 1000 * percentile(latencies, 0.50),
+            'p95_ms': 1000 * percentile(latencies, 0.95),
+            'p99_ms': 1000 * percentile(latencies, 0.99),
+            'max_ms': 1000 * latencies[-1],
+        })
+    print(metrics.decode('utf-8'))
+    print(f"{ok}/{len(bodies)} rendered in {elapsed:.2f}s with {args.concurrency} clients: "
+          f"{summary['invoices_per_s']:.1f} invoices/s")
+    if latencies:
+        print(f"latency mean {summary['mean_ms']:.1f} ms, p50 {summary['p50_ms']:.1f} ms, "
+              f"p95 {summary['p95_ms']:.1f} ms, p99 {summary['p99_ms']:.1f} ms")
+    rejected = statuses.get(503, 0)
+    if rejected:
+        print(f"{rejected} rejected with 503 (queue full)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,392 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from unittest.mock import patch
+
+# Benchmarks for the rendering, catalog and UI hot paths, and app startup.
+#
+#   python benchmarks/run_benchmarks.py --scale medium -o before.json
+#   python benchmarks/run_benchmarks.py --scale medium --baseline before.json
+#
+# Every run uses a fresh temporary database and output directory filled from
+# datagen with fixed seeds, so results are comparable between commits and
+# machines of the same kind. With --baseline the median of each benchmark is
+# compared against the saved run; anything slower by more than --threshold
+# is reported as a regression and the exit status is 1.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import datagen
+import products_db
+import product_search
+import customers_db
+import invoice_store
+import reports
+import invoice_archive
+import invoice_renderer
+import render_cache
+import invoice_bundle
+import batch_invoices
+
+SCALES = {
+    'small': {'catalog': 1000, 'lines': (10, 200), 'batch': (20,), 'rows': 20, 'history': 2000},
+    'medium': {'catalog': 20000, 'lines': (10, 1000, 5000), 'batch': (100,), 'rows': 100, 'history': 20000},
+    'large': {'catalog': 100000, 'lines': (10, 5000, 20000), 'batch': (500,), 'rows': 300, 'history': 200000},
+}
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.25
+
+def measure(fn, repeat, setup=None, number=1):
+    # Wall time per call: fn runs number times per sample, setup (untimed)
+    # before each sample.
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return summarize([1000 * t for t in times], number)
+
+def summarize(times_ms, number=1):
+    return {
+        'median_ms': statistics.median(times_ms),
+        'min_ms': min(times_ms),
+        'mean_ms': statistics.fmean(times_ms),
+        'repeat': len(times_ms),
+        'number': number,
+    }
+
+class Suite:
+    def __init__(self, scale, repeat, only, workdir):
+        self.scale = scale
+        self.params = SCALES[scale]
+        self.repeat = repeat
+        self.only = only
+        self.workdir = workdir
+        self.results = {}
+        self.settings = {
+            'company_name': 'Benchmark Ltd', 'company_email': 'bench@example.com',
+            'company_address': '1 Bench Road',
+            'logo_path': datagen.make_logo(os.path.join(workdir, 'logo.png')),
+        }
+        self.app = None
+
+    def wanted(self, name):
+        return not self.only or any(o in name for o in self.only)
+
+    def bench(self, name, fn, setup=None, number=1, repeat=None, **extra):
+        if not self.wanted(name):
+            return
+        self.record(name, measure(fn, repeat or self.repeat, setup, number), **extra)
+
+    def record(self, name, result, **extra):
+        if not self.wanted(name):
+            return
+        result.update(extra)
+        self.results[name] = result
+        print(f"{name:<48} {result['median_ms']:>11.3f} ms  (min {result['min_ms']:.3f})", flush=True)
+
+def bench_products_db(suite):
+    rng = random.Random(1)
+    catalog_size = suite.params['catalog']
+
+    start = time.perf_counter()
+    stats = products_db.import_products(datagen.make_catalog(catalog_size))
+    elapsed = time.perf_counter() - start
+    suite.record(f'products_db.import_products[n={catalog_size}]', summarize([1000 * elapsed]),
+                 rows_per_s=stats['imported'] / elapsed)
+    product_search.ensure_index()
+
+    suite.bench('products_db.add_product', lambda: products_db.add_product(
+        f"Bench {rng.random()}", "benchmark product", 9.99), number=200)
+    ids = [row[0] for row in products_db.get_products_page(0, 1000)]
+    suite.bench('products_db.get_product', lambda: products_db.get_product(rng.choice(ids)), number=1000)
+    suite.bench('products_db.update_product', lambda: products_db.update_product(
+        rng.choice(ids), "Updated", "benchmark update", rng.randint(1, 999) / 100), number=200)
+    suite.bench(f'products_db.get_products[cold,n={catalog_size}]', products_db.get_products,
+                setup=products_db.catalog.invalidate)
+    suite.bench(f'products_db.get_products[warm,n={catalog_size}]', products_db.get_products, number=100)
+    suite.bench('products_db.get_products_page', lambda: products_db.get_products_page(
+        rng.randint(0, catalog_size), 200), number=200)
+    suite.bench('product_search.search', lambda: product_search.search(
+        rng.choice(datagen.WORDS)[:4].lower()), number=50)
+
+    customers_db.init_customers()
+    start = time.perf_counter()
+    stats = customers_db.import_customers(datagen.make_customers(catalog_size))
+    elapsed = time.perf_counter() - start
+    suite.record(f'customers_db.import_customers[n={catalog_size}]', summarize([1000 * elapsed]),
+                 rows_per_s=stats['imported'] / elapsed)
+    suite.bench('customers_db.save_customer', lambda: customers_db.save_customer(
+        datagen.make_customer(rng, rng.randint(0, 99999))), number=200)
+    # Prefix (name start), substring (inside an email) and miss lookups
+    suite.bench(f'customers_db.search[prefix,n={catalog_size}]', lambda: customers_db.search(
+        rng.choice(datagen.WORDS)[:3]), number=50)
+    suite.bench(f'customers_db.search[substring,n={catalog_size}]', lambda: customers_db.search(
+        f"accounts{rng.randint(0, catalog_size)}"), number=50)
+    suite.bench(f'customers_db.search[miss,n={catalog_size}]', lambda: customers_db.search(
+        "zzq"), number=50)
+
+    # Reports over an invoice history of 10-line invoices spread over 2024-25
+    history = suite.params['history']
+    invoice_store.init_store()
+    reports.init_reports()
+    with products_db.transaction():
+        for invoice_number, issued, customer, items in datagen.make_history(history, 10):
+            invoice_store.save_invoice(invoice_number, issued, customer, items, 0)
+    periods = {'all': (None, None), 'quarter': reports.parse_period('2025Q2'),
+               'partial': ('2025-02-10', '2025-05-20')}
+    # Top 20 products and customers; every month
+    for report, limit in (('products', 20), ('customers', 20), ('months', None)):
+        query = reports.REPORTS[report][0]
+        for label, (date_from, date_to) in periods.items():
+            suite.bench(f'reports.{report}[{label},invoices={history}]',
+                        lambda: query(date_from, date_to, limit))
+
+    # The same history packed into the archive, 4 KB of stand-in PDF each,
+    # in 1 MB segments so compaction has sealed ones to rewrite
+    invoice_archive.init_archive()
+    invoice_archive.SEGMENT_MAX_BYTES = 1024 * 1024
+    archive_dir = os.path.join(suite.workdir, 'archive')
+    payload = rng.randbytes(4096)
+    records = [(number.encode() + payload, number, issued, customer['name'], None)
+               for number, issued, customer, _ in datagen.make_history(history, 0)]
+    start = time.perf_counter()
+    ids = invoice_archive.archive_pdfs(records, archive_dir)
+    elapsed = time.perf_counter() - start
+    suite.record(f'invoice_archive.archive_pdfs[n={history}]', summarize([1000 * elapsed]),
+                 rows_per_s=history / elapsed)
+    suite.bench(f'invoice_archive.find_by_number[n={history}]', lambda: invoice_archive.find_by_number(
+        rng.choice(records)[1]), number=200)
+    suite.bench(f'invoice_archive.find_by_customer[n={history}]', lambda: invoice_archive.find_by_customer(
+        rng.choice(records)[3], limit=20), number=200)
+    suite.bench(f'invoice_archive.read_pdf[n={history}]', lambda: invoice_archive.read_pdf(
+        rng.choice(ids), archive_dir), number=200)
+    invoice_archive.remove(ids[::2])
+    start = time.perf_counter()
+    invoice_archive.compact(archive_dir)
+    suite.record(f'invoice_archive.compact[n={history}]', summarize([1000 * (time.perf_counter() - start)]))
+    invoice_archive.close_maps()
+
+def bench_rendering(suite):
+    settings = suite.settings
+    customer = datagen.make_customer(random.Random(2), 1)
+    filename = os.path.join(suite.workdir, 'render.pdf')
+    for lines in suite.params['lines']:
+        items = datagen.make_line_items(lines)
+        name = f'invoice_renderer.render_invoice[lines={lines}]'
+        repeat = suite.repeat if lines <= 1000 else max(1, suite.repeat // 2)
+        suite.bench(name, lambda: invoice_renderer.render_invoice(filename, settings, customer, items),
+                    repeat=repeat)
+        if name in suite.results:
+            suite.results[name]['pdf_bytes'] = os.path.getsize(filename)
+        suite.bench(f'invoice_renderer.render_invoice_bytes[lines={lines}]',
+                    lambda: invoice_renderer.render_invoice_bytes(settings, customer, items), repeat=repeat)
+        # A repeat of an invoice already in the render cache
+        cache = render_cache.RenderCache(os.path.join(suite.workdir, 'render_cache'))
+        issued = datetime(2026, 1, 1)
+        invoice_renderer.render_invoice(filename, settings, customer, items, "CACHED-1", issued, cache=cache)
+        suite.bench(f'invoice_renderer.render_invoice[lines={lines},cached]', lambda: invoice_renderer.render_invoice(
+            filename, settings, customer, items, "CACHED-1", issued, cache=cache), repeat=repeat)
+
+    workers = os.cpu_count()
+    for invoices in suite.params['batch']:
+        records = datagen.make_batch(invoices, 10)
+        out_dir = os.path.join(suite.workdir, f'batch{invoices}')
+        name = f'batch_invoices.run_batch[invoices={invoices},workers={workers}]'
+        suite.bench(name, lambda: batch_invoices.run_batch(records, out_dir, settings, workers=workers))
+        if name in suite.results:
+            suite.results[name]['invoices_per_s'] = 1000 * invoices / suite.results[name]['median_ms']
+
+        bundle = os.path.join(suite.workdir, f'bundle{invoices}.pdf')
+        name = f'invoice_bundle.render_bundle[invoices={invoices}]'
+        suite.bench(name, lambda: invoice_bundle.render_bundle(bundle, settings, records))
+        if name in suite.results:
+            suite.results[name]['invoices_per_s'] = 1000 * invoices / suite.results[name]['median_ms']
+            suite.results[name]['pdf_bytes'] = os.path.getsize(bundle)
+
+def bench_ui(suite):
+    from PyQt6.QtCore import QCoreApplication, QEvent
+    from PyQt6.QtWidgets import QApplication
+    import invoice_app
+
+    # Kept on the suite: the shared product models must outlive this function
+    app = suite.app = QApplication.instance() or QApplication([])
+    # new_invoice() discards the draft; keep it away from the user's own
+    invoice_app.DRAFT_FILE = os.path.join(suite.workdir, 'invoice_draft.json')
+    window = invoice_app.InvoiceApp()
+    window.company_settings = dict(suite.settings)
+    rows = suite.params['rows']
+    catalog_size = suite.params['catalog']
+
+    def reset():
+        window.new_invoice()
+        QCoreApplication.sendPostedEvents(None, QEvent.Type.DeferredDelete.value)
+
+    def add_rows():
+        for _ in range(rows):
+            window.add_item_row()
+
+    suite.bench(f'InvoiceApp.add_item_row[rows={rows},catalog={catalog_size}]', add_rows, setup=reset)
+
+    reset()
+    add_rows()
+    for i, (name, price, qty) in enumerate(window.items):
+        price.setText(f"{i + 1}.25")
+        qty.setText("3")
+    suite.bench(f'InvoiceApp.update_total[rows={len(window.items)}]', window.update_total, number=100)
+
+    dialog = invoice_app.ProductDialog(window)
+    suite.bench(f'ProductDialog.refresh_products[catalog={catalog_size}]', dialog.refresh_products)
+    dialog.deleteLater()
+
+    window.customer_info = {'name': 'Bench', 'email': 'bench@example.com', 'address': '1 Road'}
+    def generate():
+        window.generate_invoice()
+        window.render_pool.waitForDone()
+        app.processEvents()
+    # Modal message boxes and the PDF viewer are stubbed out; everything else,
+    # including the worker thread and the invoice store, runs for real
+    with patch('invoice_app.QMessageBox'), patch('invoice_app.QDesktopServices'), \
+            patch('invoice_renderer.default_output_dir', lambda: suite.workdir):
+        suite.bench(f'InvoiceApp.generate_invoice[rows={len(window.items)}]', generate)
+    window.close()
+
+STARTUP_PROBE = os.path.join(ROOT, 'benchmarks', 'startup_probe.py')
+
+def run_startup_probe(db_path, workdir):
+    # Each sample is a new interpreter, so imports are really cold
+    proc = subprocess.run([sys.executable, STARTUP_PROBE, db_path, workdir],
+                          capture_output=True, text=True, check=True, timeout=120)
+    return json.loads(proc.stdout.splitlines()[-1])
+
+def bench_startup(suite):
+    catalog_size = suite.params['catalog']
+    probe_dir = os.path.join(suite.workdir, 'startup')
+    os.makedirs(probe_dir, exist_ok=True)
+
+    # First launch against a new database creates the schema
+    name = 'startup.ready[new database]'
+    if suite.wanted(name):
+        samples = [run_startup_probe(os.path.join(probe_dir, f'new{i}.db'), probe_dir)
+                   for i in range(suite.repeat)]
+        suite.record(name, summarize([s['ready'] for s in samples]))
+
+    # Later launches find the schema version current and skip the DDL
+    db_path = products_db.get_db_path()
+    run_startup_probe(db_path, probe_dir)
+    samples = [run_startup_probe(db_path, probe_dir) for _ in range(suite.repeat)]
+    for mark in ('imported', 'constructed', 'first_paint', 'ready'):
+        extra = {}
+        if mark == 'first_paint':
+            extra['loaded_at_paint'] = sorted({m for s in samples for m in s['loaded_at_paint']})
+        suite.record(f'startup.{mark}[catalog={catalog_size}]',
+                     summarize([s[mark] for s in samples]), **extra)
+
+def environment(scale):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    import reportlab
+    from PyQt6.QtCore import PYQT_VERSION_STR, QT_VERSION_STR
+    return {
+        'scale': scale,
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'sqlite': sqlite3.sqlite_version,
+        'reportlab': reportlab.Version,
+        'pyqt': PYQT_VERSION_STR,
+        'qt': QT_VERSION_STR,
+    }
+
+def compare(results, baseline, threshold):
+    # Returns the names that got slower than baseline by more than threshold.
+    regressions = []
+    print(f"\n{'benchmark':<48} {'baseline':>11} {'current':>11} {'change':>8}")
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base or not base['median_ms']:
+            print(f"{name:<48} {'-':>11} {result['median_ms']:>11.3f} {'new':>8}")
+            continue
+        change = result['median_ms'] / base['median_ms'] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<48} {base['median_ms']:>11.3f} {result['median_ms']:>11.3f} {change:>+8.1%}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark rendering, catalog and UI hot paths.")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="samples per benchmark")
+    parser.add_argument('--only', action='append', default=[],
+                        help="run only benchmarks whose name contains this (repeatable)")
+    parser.add_argument('--groups', default='db,render,ui,startup',
+                        help="comma-separated groups to run: db, render, ui, startup")
+    parser.add_argument('-o', '--output', default=os.path.join(ROOT, 'benchmarks', 'results.json'))
+    parser.add_argument('--baseline', help="earlier results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown before a benchmark counts as a regression "
+                             "(default: %(default)s = 25%%)")
+    args = parser.parse_args(argv)
+
+    groups = set(args.groups.split(','))
+    with tempfile.TemporaryDirectory(prefix='invoice-bench-') as workdir:
+        products_db.set_db_path(os.path.join(workdir, 'bench.db'))
+        products_db.init_db()
+        suite = Suite(args.scale, args.repeat, args.only, workdir)
+        try:
+            # The UI and render groups run against the catalog the db group
+            # imports, so it is always loaded
+            if 'db' in groups:
+                bench_products_db(suite)
+            else:
+                products_db.import_products(datagen.make_catalog(suite.params['catalog']))
+                product_search.ensure_index()
+            if 'render' in groups:
+                bench_rendering(suite)
+            if 'ui' in groups:
+                bench_ui(suite)
+            if 'startup' in groups:
+                bench_startup(suite)
+        finally:
+            products_db.set_db_path(None)
+
+    report = {'environment': environment(args.scale), 'results': suite.results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {len(suite.results)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('environment', {}).get('scale') != args.scale:
+            print(f"warning: baseline was run at scale {baseline.get('environment', {}).get('scale')!r}",
+                  file=sys.stderr)
+        regressions = compare(suite.results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
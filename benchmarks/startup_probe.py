@@ -0,0 +1,67 @@
+import json
+import os
+import sys
+import time
+
+# One cold start of the app, run in a fresh process by run_benchmarks.py:
+#
+#   python benchmarks/startup_probe.py <database> <workdir>
+#
+# Prints a JSON object of milliseconds since the probe started: 'imported'
+# (invoice_app imported), 'constructed' (InvoiceApp() returned),
+# 'first_paint' (first paint event of the window) and 'ready' (deferred
+# startup done, first item row usable), plus 'schema_created' and which
+# heavy modules had been loaded by the time the window painted.
+
+START = time.perf_counter()
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+def elapsed_ms():
+    return 1000 * (time.perf_counter() - START)
+
+def main(db_path, workdir):
+    # company_settings.json is read from the working directory
+    os.chdir(workdir)
+    import invoice_app
+    import products_db
+    import schema
+    from PyQt6.QtCore import QObject, QEvent, QTimer
+    from PyQt6.QtWidgets import QApplication
+    marks = {'imported': elapsed_ms()}
+    products_db.set_db_path(db_path)
+    # Restoring the user's own draft would skew (and touch) every run
+    invoice_app.DRAFT_FILE = os.path.join(workdir, 'invoice_draft.json')
+    schema_created = schema.schema_version() < schema.SCHEMA_VERSION
+
+    app = QApplication([])
+    window = invoice_app.InvoiceApp()
+    marks['constructed'] = elapsed_ms()
+
+    class PaintWatcher(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Type.Paint and 'first_paint' not in marks:
+                marks['first_paint'] = elapsed_ms()
+                marks['loaded_at_paint'] = [m for m in ('reportlab', 'PIL') if m in sys.modules]
+            return False
+
+    watcher = PaintWatcher()
+    window.installEventFilter(watcher)
+    finish_startup = window.finish_startup
+
+    def ready():
+        finish_startup()
+        marks['ready'] = elapsed_ms()
+        QTimer.singleShot(0, app.quit)
+
+    # Looked up when the first paint schedules it
+    window.finish_startup = ready
+    window.show()
+    app.exec()
+    marks['schema_created'] = schema_created
+    marks.setdefault('first_paint', None)
+    print(json.dumps(marks))
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
@@ -0,0 +1,77 @@
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex
+import customers_db
+import tracing
+
+NAME_ROLE = Qt.ItemDataRole.UserRole + 1
+EMAIL_ROLE = Qt.ItemDataRole.UserRole + 2
+CUSTOMER_ID_ROLE = Qt.ItemDataRole.UserRole + 3
+
+class CustomerSuggestionModel(QAbstractListModel):
+    # Ranked customers_db.search() results for the text typed in the customer
+    # dialog. A query loads one page; scrolling the completer popup to the end
+    # asks for more (canFetchMore/fetchMore), so only the rows on screen are
+    # ever read, however many customers match.
+    PAGE_SIZE = customers_db.SEARCH_LIMIT
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._query = ""
+        self._rows = []
+        self._exhausted = True
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        customer_id, name, email, address = self._rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"{name} <{email}>" if email else name
+        if role in (NAME_ROLE, Qt.ItemDataRole.EditRole):
+            return name
+        if role == EMAIL_ROLE:
+            return email
+        if role == CUSTOMER_ID_ROLE:
+            return customer_id
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return address
+        return None
+
+    def customer_at(self, row):
+        if 0 <= row < len(self._rows):
+            return self._rows[row]
+        return None
+
+    @tracing.traced('ui.customer_suggestions.set_query')
+    def set_query(self, text):
+        text = text.strip()
+        if text == self._query:
+            return
+        rows = customers_db.search(text, self.PAGE_SIZE) if text else []
+        self.beginResetModel()
+        self._query = text
+        self._rows = rows
+        self._exhausted = len(rows) < self.PAGE_SIZE
+        self.endResetModel()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    @tracing.traced('ui.customer_suggestions.fetch_more')
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted:
+            return
+        # The ranking is stable as the limit grows, so the next page is the
+        # tail of a longer search
+        rows = customers_db.search(self._query, len(self._rows) + self.PAGE_SIZE)
+        seen = {row[0] for row in self._rows}
+        page = [row for row in rows[len(self._rows):] if row[0] not in seen]
+        if len(rows) < len(self._rows) + self.PAGE_SIZE:
+            self._exhausted = True
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(page) - 1)
+            self._rows.extend(page)
+            self.endInsertRows()
+        else:
+            self._exhausted = True
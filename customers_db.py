@@ -0,0 +1,170 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from contextlib import nullcontext as _no_transaction
+import products_db
+from products_db import transaction
+import text_search
+import tracing
+
+# Customer directory in the shared SQLite database, so repeat customers are
+# picked instead of retyped. A customer is identified by name and email
+# (case-insensitively); saving one again updates the address.
+#
+# Lookups for the customer dialog match a name prefix or a substring of the
+# name, email or address, through a text_search.TextIndex as product_search
+# does for products.
+
+SEARCH_LIMIT = 20
+IMPORT_BATCH_SIZE = 1000
+FIELDS = ('name', 'email', 'address')
+
+_index = text_search.TextIndex(
+    'customers', 'customer_id', ('customer_id', 'name', 'email', 'address'),
+    ('name', 'email', 'address'), order='name COLLATE NOCASE, email COLLATE NOCASE')
+
+_UPSERT = '''
+    INSERT INTO customers (name, email, address) VALUES (?, ?, ?)
+    ON CONFLICT(name COLLATE NOCASE, email COLLATE NOCASE) DO UPDATE SET
+        address=excluded.address
+'''
+
+@tracing.traced('customers_db.init_customers')
+def init_customers():
+    # Returns the full-text mode, as product_search.ensure_index() does.
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS customers (
+                customer_id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                email TEXT NOT NULL DEFAULT '',
+                address TEXT NOT NULL DEFAULT ''
+            )
+        ''')
+        conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_customers_identity "
+            "ON customers(name COLLATE NOCASE, email COLLATE NOCASE)")
+    return _index.ensure()
+
+def _clean(info):
+    # Values from JSONL imports may be numbers (or anything else); they are
+    # stored as text. A row that is not an object has no name and is skipped.
+    if not isinstance(info, dict):
+        return ('',) * len(FIELDS)
+    return tuple('' if info.get(field) is None else str(info[field]).strip() for field in FIELDS)
+
+@tracing.traced('customers_db.save_customer')
+def save_customer(info):
+    # Upserts a customer_info dict; returns its customer_id, or None when it
+    # has no name.
+    name, email, address = _clean(info)
+    if not name:
+        return None
+    with transaction() as conn:
+        conn.execute(_UPSERT, (name, email, address))
+        return conn.execute(
+            "SELECT customer_id FROM customers WHERE name=? COLLATE NOCASE AND email=? COLLATE NOCASE",
+            (name, email)).fetchone()[0]
+
+def get_customer(customer_id):
+    row = products_db.get_connection().execute(
+        "SELECT customer_id, name, email, address FROM customers WHERE customer_id=?",
+        (customer_id,)).fetchone()
+    return tuple(row) if row else None
+
+def as_info(customer):
+    # (customer_id, name, email, address) -> the dict the app passes around
+    return dict(zip(FIELDS, customer[1:]))
+
+@tracing.traced('customers_db.search')
+def search(text, limit=SEARCH_LIMIT):
+    # Ranked like product_search.search(): exact name, name prefix, then
+    # substring matches anywhere; each step is an index probe bounded by
+    # ``limit``.
+    text = text.strip()
+    if not text:
+        return []
+    if _index.db != products_db.get_db_path():
+        init_customers()
+    return _index.search(text, limit)
+
+def read_customer_file(path):
+    if path.lower().endswith('.csv'):
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+@tracing.traced('customers_db.flush_import')
+def _flush_import(rows):
+    with transaction() as conn:
+        conn.executemany(_UPSERT, rows)
+
+@tracing.traced('customers_db.import_customers')
+def import_customers(rows, batch_size=IMPORT_BATCH_SIZE, rebuild_index=None):
+    # rows: dicts with name, email and address (extra keys are ignored),
+    # upserted batch by batch. Keeping the trigram index current row by row
+    # costs most of an import, so with rebuild_index the index triggers are
+    # dropped and the index is rebuilt once at the end, all in one
+    # transaction. That is the default for an empty directory; for a small
+    # import into a large one the rebuild would cost more than it saves.
+    if _index.db != products_db.get_db_path():
+        init_customers()
+    conn = products_db.get_connection()
+    if rebuild_index is None:
+        rebuild_index = conn.execute("SELECT 1 FROM customers LIMIT 1").fetchone() is None
+    rebuild_index = rebuild_index and _index.mode is not None
+    start = time.perf_counter()
+    imported = skipped = 0
+    batch = []
+    with transaction() if rebuild_index else _no_transaction():
+        if rebuild_index:
+            _index.drop_triggers(conn)
+        for row in rows:
+            customer = _clean(row)
+            if not customer[0]:
+                skipped += 1
+                continue
+            batch.append(customer)
+            imported += 1
+            if len(batch) >= batch_size:
+                _flush_import(batch)
+                batch = []
+        if batch:
+            _flush_import(batch)
+        if rebuild_index:
+            _index.restore(conn)
+    elapsed = time.perf_counter() - start
+    return {
+        'imported': imported,
+        'skipped': skipped,
+        'elapsed_s': elapsed,
+        'rows_per_s': imported / elapsed if elapsed > 0 else 0.0,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import customers into the customer directory.")
+    parser.add_argument('--db', help="database file (default: ~/Documents/invoices/products.db)")
+    parser.add_argument('path', help="CSV (name,email,address columns) or JSONL file")
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument('--rebuild-index', action='store_true', default=None,
+                        help="rebuild the search index once instead of row by row "
+                             "(default only when the directory is empty)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        products_db.set_db_path(args.db)
+    init_customers()
+    stats = import_customers(read_customer_file(args.path), batch_size=args.batch_size,
+                             rebuild_index=args.rebuild_index)
+    print(f"Imported {stats['imported']} customers ({stats['skipped']} skipped) in "
+          f"{stats['elapsed_s']:.2f}s, {stats['rows_per_s']:.0f} rows/s", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
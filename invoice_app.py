@@ -1,20 +1,61 @@
 import sys
 import os
 import json
+import logging
+from datetime import datetime
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                            QHBoxLayout, QLabel, QLineEdit, QPushButton,
                            QFrame, QMessageBox, QScrollArea, QFileDialog,
-                           QDialog, QDialogButtonBox, QMenuBar, QMenu, QComboBox, QCompleter, QGroupBox, QSizePolicy)
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QPixmap, QAction, QIcon
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import Paragraph, Table, TableStyle, Image
-from datetime import datetime
+                           QDialog, QDialogButtonBox, QMenuBar, QMenu, QComboBox, QCompleter, QGroupBox, QSizePolicy,
+                           QTableView, QHeaderView, QAbstractItemView)
+from PyQt6.QtCore import Qt, QModelIndex, QThreadPool, QTimer, QUrl
+from PyQt6.QtGui import QPixmap, QAction, QIcon, QDesktopServices
 import products_db
+import product_search
+import invoice_numbers
+import tracing
+import logo_cache
+import schema
+import customers_db
+from line_items import LineItems, format_cents
+from render_tasks import RenderTask
+from product_models import ProductTableModel, shared_product_model, shared_suggestion_model
+from customer_models import CustomerSuggestionModel, NAME_ROLE, EMAIL_ROLE
+
+RENDER_THREADS = 3
+# Unsaved invoice (customer and item rows), rewritten shortly after each edit
+# and restored on the next start. Kept with the database, not in the working
+# directory, which is / when the app is launched from its bundle
+DRAFT_FILE = os.path.join(os.path.expanduser("~/Documents/invoices"), "invoice_draft.json")
+DRAFT_DELAY_MS = 1000
+# Customer suggestions are looked up once typing pauses for this long
+CUSTOMER_LOOKUP_DELAY_MS = 150
+
+logger = logging.getLogger(__name__)
+
+def _text_cells(cells):
+    return all(cell is None or isinstance(cell, str) for cell in cells)
+
+def valid_draft(draft):
+    # What save_draft() writes: {'customer': dict of text or None, 'items':
+    # list of [name, price text, quantity text]}. Anything else, e.g. a file
+    # edited by hand, is not restored.
+    if not isinstance(draft, dict):
+        return False
+    customer = draft.get('customer')
+    if customer is not None and not (isinstance(customer, dict) and _text_cells(customer.values())):
+        return False
+    items = draft.get('items')
+    if items is None:
+        return True
+    return isinstance(items, list) and all(
+        isinstance(row, (list, tuple)) and len(row) == 3 and _text_cells(row) for row in items)
+
+def scaled_logo_pixmap(file_name, width, height):
+    pixmap = QPixmap(file_name)
+    if pixmap.isNull():
+        return None
+    return pixmap.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
 
 class CompanySettingsDialog(QDialog):
     def __init__(self, parent=None, settings=None):
@@ -46,6 +87,10 @@ class CompanySettingsDialog(QDialog):
         self.company_name = self._create_input_group("Company Name:", layout)
         self.company_email = self._create_input_group("Company Email:", layout)
         self.company_address = self._create_input_group("Company Address:", layout)
+        self.number_format = self._create_input_group("Invoice Number Format:", layout)
+        self.number_format.setToolTip("{seq} is the sequence number, {issued:%Y} the year, "
+                                      "e.g. INV-{issued:%Y}-{seq:05d}")
+        self.number_format.setText(invoice_numbers.DEFAULT_FORMAT)
         self.logo_path = None
 
         # If settings provided, pre-fill fields and preview
@@ -53,6 +98,7 @@ class CompanySettingsDialog(QDialog):
             self.company_name.setText(settings.get('company_name', ''))
             self.company_email.setText(settings.get('company_email', ''))
             self.company_address.setText(settings.get('company_address', ''))
+            self.number_format.setText(settings.get('invoice_number_format') or invoice_numbers.DEFAULT_FORMAT)
             if settings.get('logo_path'):
                 self.load_logo(settings['logo_path'])
             # Set info summary if any info exists
@@ -92,6 +138,7 @@ class CompanySettingsDialog(QDialog):
         if file_name:
             self.load_logo(file_name)
     
+    @tracing.traced('ui.company_settings.load_logo')
     def load_logo(self, file_name):
         # Enhanced error handling for logo loading
         import os
@@ -101,13 +148,12 @@ class CompanySettingsDialog(QDialog):
             self.logo_preview.setPixmap(QPixmap())
             self.logo_preview.setStyleSheet("border: 1px solid red;")
             return
-        pixmap = QPixmap(file_name)
-        if pixmap.isNull():
+        scaled_pixmap = logo_cache.get_preview(file_name, 100, 50, scaled_logo_pixmap)
+        if scaled_pixmap is None:
             self.logo_preview.setText("Unsupported image")
             self.logo_preview.setPixmap(QPixmap())
             self.logo_preview.setStyleSheet("border: 1px solid red;")
             return
-        scaled_pixmap = pixmap.scaled(100, 50, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
         self.logo_preview.setPixmap(scaled_pixmap)
         self.logo_preview.setText("")
         self.logo_preview.setStyleSheet("")
@@ -126,11 +172,12 @@ class CompanySettingsDialog(QDialog):
             'company_name': self.company_name.text(),
             'company_email': self.company_email.text(),
             'company_address': self.company_address.text(),
-            'logo_path': self.logo_path
+            'logo_path': self.logo_path,
+            'invoice_number_format': self.number_format.text().strip()
         }
 
 class CustomerDialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, customer_info=None):
         super().__init__(parent)
         self.setWindowTitle("Customer Information")
         self.setModal(True)
@@ -139,6 +186,21 @@ class CustomerDialog(QDialog):
         self.customer_name = self._create_input_group("Customer Name:", layout)
         self.customer_email = self._create_input_group("Customer Email:", layout)
         self.customer_address = self._create_input_group("Customer Address:", layout)
+        if customer_info:
+            self.set_customer_info(customer_info)
+
+        # Name and email autocomplete from the customer directory; both
+        # completers share one suggestion model, queried by whichever field
+        # is being typed in once the typing pauses
+        self.suggestions = CustomerSuggestionModel(self)
+        self.lookup_timer = QTimer(self)
+        self.lookup_timer.setSingleShot(True)
+        self.lookup_timer.setInterval(CUSTOMER_LOOKUP_DELAY_MS)
+        self.lookup_timer.timeout.connect(self.lookup_customers)
+        self.lookup_field = None
+        self.completers = {}
+        for field, role in ((self.customer_name, NAME_ROLE), (self.customer_email, EMAIL_ROLE)):
+            self._attach_completer(field, role)
         
         buttons = QDialogButtonBox(
             QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
@@ -156,6 +218,37 @@ class CustomerDialog(QDialog):
         parent_layout.addWidget(widget)
         return line_edit
     
+    def _attach_completer(self, field, role):
+        completer = QCompleter(self.suggestions, self)
+        completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        completer.setCompletionRole(role)
+        completer.activated[QModelIndex].connect(
+            lambda index: self.fill_from_suggestion(completer.completionModel().mapToSource(index)))
+        field.setCompleter(completer)
+        self.completers[field] = completer
+        def edited(text):
+            self.lookup_field = field
+            self.lookup_timer.start()
+        field.textEdited.connect(edited)
+
+    def lookup_customers(self):
+        field = self.lookup_field
+        if field is None:
+            return
+        self.suggestions.set_query(field.text())
+        if self.suggestions.rowCount():
+            self.completers[field].complete()
+
+    def fill_from_suggestion(self, index):
+        customer = self.suggestions.customer_at(index.row())
+        if customer:
+            self.set_customer_info(customers_db.as_info(customer))
+
+    def set_customer_info(self, info):
+        self.customer_name.setText(info.get('name') or '')
+        self.customer_email.setText(info.get('email') or '')
+        self.customer_address.setText(info.get('address') or '')
+
     def get_customer_info(self):
         return {
             'name': self.customer_name.text(),
@@ -219,12 +312,27 @@ class ProductDialog(QDialog):
         self.products_label = QLabel("Saved Products:")
         self.products_label.setStyleSheet("font-weight: bold;margin-top:10px;")
         layout.addWidget(self.products_label)
-        self.products_area = QScrollArea()
-        self.products_area.setWidgetResizable(True)
-        self.products_widget = QWidget()
-        self.products_layout = QVBoxLayout(self.products_widget)
-        self.products_area.setWidget(self.products_widget)
-        layout.addWidget(self.products_area)
+        self.empty_label = QLabel("No products saved.")
+        layout.addWidget(self.empty_label)
+        self.products_model = ProductTableModel(self)
+        self.products_model.editRejected.connect(
+            lambda message: QMessageBox.warning(self, "Input Error", message))
+        self.products_view = QTableView()
+        self.products_view.setModel(self.products_model)
+        self.products_view.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.products_view.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.products_view.setEditTriggers(QAbstractItemView.EditTrigger.DoubleClicked |
+                                           QAbstractItemView.EditTrigger.EditKeyPressed)
+        self.products_view.verticalHeader().setVisible(False)
+        # Fixed row heights let the view skip measuring every row
+        self.products_view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.products_view.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.products_view)
+
+        edit_btn = QPushButton("Edit Selected")
+        edit_btn.setStyleSheet("padding:2px 10px;")
+        edit_btn.clicked.connect(self.edit_selected)
+        layout.addWidget(edit_btn, alignment=Qt.AlignmentFlag.AlignRight)
 
         self.refresh_products()
 
@@ -246,44 +354,30 @@ class ProductDialog(QDialog):
         self.price_input.clear()
         self.refresh_products()
 
+    def edit_selected(self):
+        rows = self.products_view.selectionModel().selectedRows()
+        if not rows:
+            return
+        row = rows[0].row()
+        pid, name, desc, price = self.products_model.product_at(row)
+        dialog = EditProductDialog(pid, name, desc, price, self)
+        if dialog.exec():
+            _, new_name, new_desc, new_price = dialog.get_data()
+            try:
+                new_price = float(new_price)
+            except ValueError:
+                QMessageBox.warning(self, "Input Error", "Please enter a valid price.")
+                return
+            if not new_name:
+                QMessageBox.warning(self, "Input Error", "Product name is required.")
+                return
+            products_db.update_product(pid, new_name, new_desc, new_price)
+            self.products_model.update_row(row, (pid, new_name, new_desc, new_price))
+
+    @tracing.traced('ui.product_dialog.refresh_products')
     def refresh_products(self):
-        # Clear layout
-        for i in reversed(range(self.products_layout.count())):
-            widget = self.products_layout.itemAt(i).widget()
-            if widget:
-                widget.setParent(None)
-        # Add products
-        products = products_db.get_products()
-        if not products:
-            self.products_layout.addWidget(QLabel("No products saved."))
-        else:
-            for pid, name, desc, price in products:
-                row = QWidget()
-                row_layout = QHBoxLayout(row)
-                lbl = QLabel(f"#{pid}: {name} - {desc} (${price:.2f})")
-                row_layout.addWidget(lbl)
-                edit_btn = QPushButton("Edit")
-                edit_btn.setStyleSheet("padding:2px 10px;")
-                def make_edit(pid=pid, name=name, desc=desc, price=price):
-                    def edit():
-                        dialog = EditProductDialog(pid, name, desc, price, self)
-                        if dialog.exec():
-                            _, new_name, new_desc, new_price = dialog.get_data()
-                            try:
-                                new_price = float(new_price)
-                            except ValueError:
-                                QMessageBox.warning(self, "Input Error", "Please enter a valid price.")
-                                return
-                            if not new_name:
-                                QMessageBox.warning(self, "Input Error", "Product name is required.")
-                                return
-                            products_db.update_product(pid, new_name, new_desc, new_price)
-                            self.refresh_products()
-                    return edit
-                edit_btn.clicked.connect(make_edit())
-                row_layout.addWidget(edit_btn)
-                self.products_layout.addWidget(row)
-        self.products_widget.setLayout(self.products_layout)
+        self.products_model.refresh()
+        self.empty_label.setVisible(self.products_model.rowCount() == 0)
 
 class InvoiceApp(QMainWindow):
     def __init__(self):
@@ -292,10 +386,77 @@ class InvoiceApp(QMainWindow):
         self.setMinimumSize(800, 600)
         self.company_settings = self.load_settings()
         self.customer_info = None
-        
-        products_db.init_db()
+        # Invoices render on worker threads; a few can run at once
+        self.render_pool = QThreadPool(self)
+        self.render_pool.setMaxThreadCount(RENDER_THREADS)
+        self.render_jobs = {}
+        self.next_render_job = 0
+
+        # DDL only runs when the stored schema version is out of date
+        schema.ensure_schema()
+        self.number_allocator = None
+        # Edits restart this timer, so a burst of typing is one draft write
+        self.draft_timer = QTimer(self)
+        self.draft_timer.setSingleShot(True)
+        self.draft_timer.setInterval(DRAFT_DELAY_MS)
+        self.draft_timer.timeout.connect(self.save_draft)
         self.setup_menu()
         self.setup_ui()
+        self.startup_pending = True
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        # The first item row loads the product catalog; that waits until the
+        # window has painted once, so it appears straight away
+        if self.startup_pending:
+            self.startup_pending = False
+            QTimer.singleShot(0, self.finish_startup)
+
+    @tracing.traced('ui.finish_startup')
+    def finish_startup(self):
+        if not self.items:
+            self.restore_draft()
+        if not self.items:
+            self.add_item_row()
+
+    def restore_draft(self):
+        draft = self.load_draft()
+        if not draft:
+            return
+        if not valid_draft(draft):
+            logger.warning("Ignoring unreadable invoice draft %s", DRAFT_FILE)
+            return
+        self.customer_info = draft.get('customer') or None
+        self.show_customer_info()
+        self.line_items = LineItems.from_rows(draft.get('items') or [])
+        for line_key in self.line_items.keys():
+            self._build_item_row(line_key)
+        self.update_total()
+
+    def load_draft(self):
+        try:
+            with open(DRAFT_FILE, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_draft(self):
+        # Plain data only: the rows come from the line model, not the widgets
+        draft = {'customer': self.customer_info, 'items': self.line_items.rows()}
+        try:
+            os.makedirs(os.path.dirname(DRAFT_FILE), exist_ok=True)
+            with open(DRAFT_FILE + '.tmp', 'w') as f:
+                json.dump(draft, f)
+            os.replace(DRAFT_FILE + '.tmp', DRAFT_FILE)
+        except OSError:
+            pass
+
+    def discard_draft(self):
+        self.draft_timer.stop()
+        try:
+            os.remove(DRAFT_FILE)
+        except OSError:
+            pass
     
     def load_settings(self):
         try:
@@ -329,11 +490,40 @@ class InvoiceApp(QMainWindow):
         file_menu.addAction(product_action)
         
         file_menu.addSeparator()
-        
+
+        # Timing spans for the hot paths; switching off writes the trace
+        self.trace_action = QAction("Trace Performance", self)
+        self.trace_action.setCheckable(True)
+        self.trace_action.setChecked(tracing.enabled())
+        self.trace_action.toggled.connect(self.toggle_tracing)
+        file_menu.addAction(self.trace_action)
+
+        file_menu.addSeparator()
+
         exit_action = QAction("Exit", self)
         exit_action.triggered.connect(self.close)
         file_menu.addAction(exit_action)
     
+    def toggle_tracing(self, checked):
+        if checked:
+            tracing.reset()
+            tracing.enable()
+            self.statusBar().showMessage("Tracing enabled", 3000)
+            return
+        tracing.disable()
+        import invoice_renderer
+        out_dir = invoice_renderer.default_output_dir()
+        os.makedirs(out_dir, exist_ok=True)
+        path = os.path.join(out_dir, f"trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        try:
+            summary_path = tracing.dump(path)
+        except OSError as e:
+            QMessageBox.warning(self, "Trace Error", f"Could not write trace: {e}")
+            return
+        QMessageBox.information(self, "Trace Saved",
+                                f"Chrome trace saved as {path}\nHistograms saved as {summary_path}")
+
+    @tracing.traced('ui.setup_ui')
     def setup_ui(self):
         main_widget = QWidget()
         self.setCentralWidget(main_widget)
@@ -391,7 +581,8 @@ class InvoiceApp(QMainWindow):
         layout.addWidget(items_box)
 
         self.items = []
-        self.add_item_row()
+        # Exact-money line model behind the item rows; drives the total and the PDF
+        self.line_items = LineItems()
 
         # Bottom section (total and generate button)
         bottom_widget = QWidget()
@@ -423,18 +614,38 @@ class InvoiceApp(QMainWindow):
         dialog = CompanySettingsDialog(self, self.company_settings)
         if dialog.exec():
             self.company_settings = dialog.get_settings()
+            if not invoice_numbers.check_format(self.company_settings['invoice_number_format']):
+                QMessageBox.warning(self, "Invalid Format",
+                                    "The invoice number format must contain {seq}; using the default.")
+                self.company_settings['invoice_number_format'] = invoice_numbers.DEFAULT_FORMAT
             self.save_settings(self.company_settings)
+
+    def get_number_allocator(self):
+        # One allocator per number format; it reserves a single number at a
+        # time so invoices from the GUI are numbered without gaps
+        fmt = self.company_settings.get('invoice_number_format') or invoice_numbers.DEFAULT_FORMAT
+        if self.number_allocator is None or self.number_allocator.fmt != fmt:
+            self.number_allocator = invoice_numbers.NumberAllocator(fmt=fmt)
+        return self.number_allocator
     
     def show_customer_dialog(self):
-        dialog = CustomerDialog(self)
+        dialog = CustomerDialog(self, self.customer_info)
         if dialog.exec():
             self.customer_info = dialog.get_customer_info()
-            # Update summary label
-            info = self.customer_info
-            summary = f"<b>{info['name']}</b><br>{info['email']}<br>{info['address']}"
-            self.customer_info_label.setText(summary)
+            # Remembered for autocomplete next time
+            customers_db.save_customer(self.customer_info)
+            self.show_customer_info()
+            self.draft_timer.start()
             QMessageBox.information(self, "Customer Info Saved", "Customer information has been updated.")
     
+    def show_customer_info(self):
+        info = self.customer_info
+        if not info:
+            self.customer_info_label.setText("No customer info set.")
+            return
+        summary = f"<b>{info['name']}</b><br>{info['email']}<br>{info['address']}"
+        self.customer_info_label.setText(summary)
+
     def show_product_dialog(self):
         dialog = ProductDialog(self)
         dialog.exec()
@@ -446,16 +657,26 @@ class InvoiceApp(QMainWindow):
             price.deleteLater()
             qty.deleteLater()
         self.items.clear()
+        self.line_items.clear()
 
         # Reset customer info
         self.customer_info = None
-        
+        self.show_customer_info()
+        self.discard_draft()
+
         # Add one empty row
         self.add_item_row()
         # Only call update_total after items and UI are ready
         self.update_total()
 
     def add_item_row(self):
+        # Not a decorator: Qt would pass clicked()'s argument through a wrapper
+        with tracing.span('ui.add_item_row'):
+            self._build_item_row()
+
+    def _build_item_row(self, line_key=None):
+        # A row is a view of one line in self.line_items: edits write through
+        # to the model, and a row for an existing line_key shows its values
         # Only allow adding rows after total_label exists
         if not hasattr(self, 'total_label'):
             return
@@ -463,18 +684,20 @@ class InvoiceApp(QMainWindow):
         row_layout = QHBoxLayout(row)
         row_layout.setSpacing(8)
         row.setStyleSheet("background: #fbfbfb; border: 1px solid #e0e0e0; border-radius: 6px; padding: 4px 0;")
-
-        # Fetch products for dropdown/autocomplete
-        products = products_db.get_products()
-        product_names = [f"#{pid}: {name}" for pid, name, desc, price in products]
+        if line_key is None:
+            line_key = self.line_items.add()
+            cells = None
+        else:
+            cells = self.line_items.text(line_key)
 
         # Product ComboBox with autocomplete
         name_combo = QComboBox()
         name_combo.setEditable(True)
-        name_combo.addItems(product_names)
-        completer = QCompleter(product_names)
-        completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
-        name_combo.setCompleter(completer)
+        # Size from a fixed text length instead of measuring every catalog entry
+        name_combo.setSizeAdjustPolicy(QComboBox.SizeAdjustPolicy.AdjustToMinimumContentsLengthWithIcon)
+        name_combo.setMinimumContentsLength(20)
+        # Uniform item sizes stop the popup view measuring every item on layout
+        name_combo.view().setUniformItemSizes(True)
         name_combo.setInsertPolicy(QComboBox.InsertPolicy.NoInsert)
         name_combo.setPlaceholderText("Select or type product")
         name_combo.setMinimumWidth(180)
@@ -483,13 +706,19 @@ class InvoiceApp(QMainWindow):
         price = QLineEdit()
         price.setPlaceholderText("Price")
         price.setFixedWidth(80)
-        price.textChanged.connect(self.update_total)
+        def price_changed(text):
+            self.line_items.set_price(line_key, text)
+            self.update_total()
+        price.textChanged.connect(price_changed)
         row_layout.addWidget(price)
 
         qty = QLineEdit()
         qty.setPlaceholderText("Qty")
         qty.setFixedWidth(60)
-        qty.textChanged.connect(self.update_total)
+        def qty_changed(text):
+            self.line_items.set_quantity(line_key, text)
+            self.update_total()
+        qty.textChanged.connect(qty_changed)
         row_layout.addWidget(qty)
 
         # Delete row button
@@ -501,186 +730,123 @@ class InvoiceApp(QMainWindow):
         def remove_row():
             row.setParent(None)
             self.items = [t for t in self.items if t[0] is not name_combo]
+            self.line_items.remove(line_key)
             self.update_total()
         del_btn.clicked.connect(remove_row)
         row_layout.addWidget(del_btn)
 
+        # All rows share one catalog model; pick up any external catalog changes.
+        # The model is attached only once the row is styled and in the layout,
+        # since restyling a combo box re-lays out its popup over every item.
+        self.items_container.addWidget(row)
+        product_model = shared_product_model()
+        product_model.sync()
+        name_combo.setModel(product_model)
+        # Suggestions come ranked from the search index rather than from the
+        # completer filtering the whole catalog on every keystroke
+        suggestions = shared_suggestion_model()
+        completer = QCompleter(suggestions, name_combo)
+        completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        name_combo.setCompleter(completer)
+        if cells is not None:
+            name_combo.setCurrentText(cells[0])
+        def name_changed(text):
+            self.line_items.set_name(line_key, text)
+            self.draft_timer.start()
+        name_combo.currentTextChanged.connect(name_changed)
+        self.line_items.set_name(line_key, name_combo.currentText())
+
         # Auto-fill price when product is selected or typed
         def set_price_from_selection():
-            idx = name_combo.currentIndex()
-            if idx >= 0 and idx < len(products):
-                price.setText(str(products[idx][3]))
+            product = product_model.product_at(name_combo.currentIndex())
+            if product:
+                price.setText(str(product[3]))
             else:
                 price.clear()
         name_combo.currentIndexChanged.connect(set_price_from_selection)
 
         # Auto-fill price when typing matches a product
         def handle_edit_text(text):
-            text = text.strip().lower()
-            for i, (pid, name, desc, prc) in enumerate(products):
-                if text == f"#{pid}: {name}".lower() or text == name.lower():
-                    price.setText(str(prc))
-                    return
-            price.clear()
+            product = product_search.find_exact(text)
+            if product:
+                price.setText(str(product[3]))
+            else:
+                price.clear()
+            suggestions.set_query(text)
+            if suggestions.rowCount():
+                completer.complete()
         name_combo.lineEdit().textEdited.connect(handle_edit_text)
 
-        # Prepopulate price if first product exists
-        if products:
-            price.setText(str(products[0][3]))
+        if cells is not None:
+            price.setText(cells[1])
+            qty.setText(cells[2])
+        else:
+            # Prepopulate price if first product exists
+            first = product_model.product_at(0)
+            if first:
+                price.setText(str(first[3]))
 
         self.items.append((name_combo, price, qty))
-        self.items_container.addWidget(row)
         name_combo.setFocus()
     
+    @tracing.traced('ui.update_total')
     def update_total(self):
-        total = 0
-        for name_widget, price, qty in self.items:
-            # name_widget can be QLineEdit (old) or QComboBox (new)
-            try:
-                p = float(price.text() or 0)
-                q = float(qty.text() or 0)
-                total += p * q
-            except ValueError:
-                pass
-        self.total_label.setText(f"{total:.2f}")
+        # The running total is maintained by self.line_items as cells change
+        self.total_label.setText(format_cents(self.line_items.total_cents))
+        self.draft_timer.start()
     
     def generate_invoice(self):
+        with tracing.span('ui.generate_invoice'):
+            self._start_render()
+
+    def _start_render(self):
         if not self.customer_info:
             QMessageBox.warning(self, "Error", "Please enter customer information")
             return
             
-        # Ensure the invoices directory exists
-        invoices_dir = os.path.expanduser("~/Documents/invoices")
+        # Ensure the invoices directory exists; ReportLab itself is only
+        # loaded by the first render, on the worker thread
+        import invoice_renderer
+        invoices_dir = invoice_renderer.default_output_dir()
         os.makedirs(invoices_dir, exist_ok=True)
-        filename = os.path.join(
-            invoices_dir,
-            f"invoice_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        )
-        c = canvas.Canvas(filename, pagesize=letter)
-        width, height = letter
-        
-        # Add company logo
-        if self.company_settings.get('logo_path'):
-            try:
-                # Calculate aspect ratio to fit in 100x50 space
-                img = Image(self.company_settings['logo_path'])
-                aspect = img.imageWidth / img.imageHeight
-                if aspect > 2:  # wider than 2:1
-                    img.drawHeight = 50
-                    img.drawWidth = 100
-                else:
-                    img.drawHeight = 50
-                    img.drawWidth = int(50 * aspect)
-                img.wrapOn(c, width, height)
-                img.drawOn(c, 50, height - 120)
-            except Exception as e:
-                print(f"Error adding logo: {e}")
-                # If logo fails, draw placeholder
-                c.rect(50, height - 120, 100, 50)
-                c.setFont("Helvetica", 8)
-                c.drawString(70, height - 100, "Logo Error")
+        # Render on the pool from a snapshot; repeated clicks queue up
+        job_id = self.next_render_job
+        self.next_render_job += 1
+        task = RenderTask(job_id, invoices_dir, self.company_settings, self.customer_info,
+                          self.line_items, self.get_number_allocator())
+        task.signals.progress.connect(self.on_render_progress)
+        task.signals.finished.connect(self.on_render_finished)
+        task.signals.failed.connect(self.on_render_failed)
+        self.render_jobs[job_id] = task.signals
+        self.render_pool.start(task)
+        self.show_render_status()
+
+    def show_render_status(self, stage=None):
+        pending = len(self.render_jobs)
+        if pending:
+            message = f"Rendering {pending} invoice{'s' if pending > 1 else ''}..."
+            if stage:
+                message += f" ({stage})"
+            self.statusBar().showMessage(message)
         else:
-            # Draw placeholder if no logo
-            c.rect(50, height - 120, 100, 50)
-            c.setFont("Helvetica", 8)
-            c.drawString(70, height - 100, "No Logo")
-        
-        # Add company info
-        c.setFont("Helvetica-Bold", 12)
-        company_y = height - 120
-        c.drawString(200, company_y, self.company_settings.get('company_name', 'Your Company Name'))
-        c.setFont("Helvetica", 10)
-        c.drawString(200, company_y - 15, self.company_settings.get('company_email', 'company@example.com'))
-        c.drawString(200, company_y - 30, self.company_settings.get('company_address', 'Company Address'))
-        
-        # Add invoice title and number
-        c.setFont("Helvetica-Bold", 24)
-        c.drawString(50, height - 180, "INVOICE")
-        c.setFont("Helvetica", 12)
-        invoice_number = datetime.now().strftime("INV-%Y%m%d-%H%M")
-        c.drawString(50, height - 200, f"Invoice Number: {invoice_number}")
-        c.drawString(50, height - 220, f"Date: {datetime.now().strftime('%B %d, %Y')}")
-        
-        # Add customer info in a box
-        c.setStrokeColor(colors.lightgrey)
-        c.rect(50, height - 300, 250, 60)
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(60, height - 250, "Bill To:")
-        c.setFont("Helvetica", 10)
-        c.drawString(60, height - 265, self.customer_info['name'])
-        c.drawString(60, height - 280, self.customer_info['email'])
-        c.drawString(60, height - 295, self.customer_info['address'] or "")
-        
-        # Add items table
-        data = [["Item", "Quantity", "Price", "Total"]]
-        total = 0
-        
-        for name_widget, price, qty in self.items:
-            # name_widget can be QLineEdit or QComboBox
-            if hasattr(name_widget, 'currentText'):
-                item_name = name_widget.currentText()
-            else:
-                item_name = name_widget.text()
-            if item_name and price.text() and qty.text():
-                try:
-                    p = float(price.text())
-                    q = float(qty.text())
-                    item_total = p * q
-                    total += item_total
-                    data.append([
-                        item_name,
-                        str(q),
-                        f"${p:.2f}",
-                        f"${item_total:.2f}"
-                    ])
-                except ValueError:
-                    continue
-        
-        # Create table
-        table = Table(data, colWidths=[3*inch, 1.2*inch, 1.2*inch, 1.2*inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('TOPPADDING', (0, 1), (-1, -1), 12),
-        ]))
-        
-        table.wrapOn(c, width, height)
-        table.drawOn(c, 50, height - 500)
-        
-        # Add total
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(400, height - 520, "Total:")
-        c.drawString(500, height - 520, f"${total:.2f}")
-        
-        # Add footer
-        c.setFont("Helvetica", 8)
-        c.setFillColor(colors.grey)
-        footer_text = "Thank you for your business!"
-        c.drawString(width/2 - c.stringWidth(footer_text, "Helvetica", 8)/2, 30, footer_text)
-        
-        c.save()
+            self.statusBar().clearMessage()
+
+    def on_render_progress(self, job_id, stage):
+        self.show_render_status(stage)
+
+    def on_render_failed(self, job_id, message):
+        self.render_jobs.pop(job_id, None)
+        self.show_render_status()
+        QMessageBox.warning(self, "Error", f"Could not generate invoice: {message}")
+
+    def on_render_finished(self, job_id, filename, total_cents):
+        self.render_jobs.pop(job_id, None)
+        self.show_render_status()
         QMessageBox.information(self, "Success", f"Invoice saved as {filename}")
 
-        # Open the invoice PDF after saving
-        try:
-            if sys.platform == "darwin":
-                os.system(f"open '{filename}'")
-            elif sys.platform == "win32":
-                os.startfile(filename)
-            else:
-                os.system(f"xdg-open '{filename}'")
-        except Exception as e:
-            QMessageBox.warning(self, "Open File Error", f"Could not open invoice: {e}")
+        # Open the invoice PDF after saving, without waiting on the viewer
+        if not QDesktopServices.openUrl(QUrl.fromLocalFile(filename)):
+            QMessageBox.warning(self, "Open File Error", f"Could not open invoice: {filename}")
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
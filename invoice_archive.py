@@ -0,0 +1,457 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+import products_db
+from products_db import transaction
+import tracing
+
+# Archive for old invoice PDFs: instead of one loose file each, they are
+# appended to a few large segment files in the archive directory, and an
+# index in the shared database records where each one starts, so finding an
+# invoice by number or customer is an index probe and reading it back is a
+# slice of the memory-mapped segment.
+#
+# Segments are only ever appended to; a new one is started once the last
+# reaches SEGMENT_MAX_BYTES. Each record is a header, a JSON description of
+# the invoice and the PDF bytes. Removing an entry only drops its index row;
+# compact() copies the entries still listed out of mostly-dead sealed
+# segments and deletes those files.
+#
+# Bytes are written and synced before the index rows that point at them
+# commit, and loose files are deleted only after that, so a crash at any
+# point leaves, at worst, unreferenced bytes for the next compaction. The
+# invoice history rows of packed files are pointed at their archive entry
+# (archive_ref()) in that same commit, so they never name a deleted file.
+# There is one archive per database; back both up together.
+
+SEGMENT_MAX_BYTES = 128 * 1024 * 1024
+ARCHIVE_AFTER_DAYS = 90
+PACK_BATCH_SIZE = 500
+COMPACT_MIN_GARBAGE = 0.25
+PAGE_SIZE = 50
+
+_RECORD = struct.Struct('<4sII')  # magic, description length, PDF length
+_MAGIC = b'IVA1'
+_SEGMENT_NAME = re.compile(r'segment_(\d{6})\.pack$')
+_LOOSE_NAME = re.compile(r'invoice_(.+)\.pdf$')
+_LEGACY_NUMBER = re.compile(r'\d{8}_\d{6}$')
+
+# invoices.pdf_path of a packed invoice: ARCHIVE_REF_PREFIX + entry_id
+ARCHIVE_REF_PREFIX = 'archive:'
+
+ENTRY_FIELDS = ('entry_id', 'invoice_number', 'issued_at', 'customer_name', 'source_name',
+                'segment', 'data_offset', 'length', 'sha256')
+_SELECT_ENTRIES = f"SELECT {', '.join(ENTRY_FIELDS)} FROM archive_entries"
+
+def default_archive_dir():
+    return os.path.join(os.path.expanduser("~/Documents/invoices"), "archive")
+
+@tracing.traced('invoice_archive.init_archive')
+def init_archive():
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS archive_entries (
+                entry_id INTEGER PRIMARY KEY,
+                invoice_number TEXT NOT NULL,
+                issued_at TEXT NOT NULL,
+                customer_name TEXT NOT NULL DEFAULT '',
+                source_name TEXT NOT NULL,
+                segment INTEGER NOT NULL,
+                data_offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            )
+        ''')
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_archive_number ON archive_entries(invoice_number)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_archive_customer "
+            "ON archive_entries(customer_name COLLATE NOCASE, issued_at, entry_id)")
+        # Live bytes per segment, for compaction, without reading the table
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_archive_segment ON archive_entries(segment, data_offset, length)")
+
+def archive_ref(entry_id):
+    return f"{ARCHIVE_REF_PREFIX}{entry_id}"
+
+def archived_entry_id(pdf_path):
+    # The entry_id an invoice history pdf_path refers to, or None for a file
+    if pdf_path and pdf_path.startswith(ARCHIVE_REF_PREFIX):
+        return int(pdf_path[len(ARCHIVE_REF_PREFIX):])
+    return None
+
+def segment_path(directory, segment):
+    return os.path.join(directory, f"segment_{segment:06d}.pack")
+
+def list_segments(directory):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(int(m.group(1)) for m in map(_SEGMENT_NAME.match, names) if m)
+
+class _SegmentWriter:
+    # Appends records to the newest segment, starting another whenever it
+    # is full. Callers hold the database write lock, which keeps writers in
+    # other processes out; the newest segment is only looked up on the first
+    # append, once that lock is held.
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.segment = None
+        self._file = None
+
+    def _open(self):
+        if self.segment is None:
+            segments = list_segments(self.directory)
+            self.segment = segments[-1] if segments else 1
+        self._file = open(segment_path(self.directory, self.segment), 'ab')
+        self._file.seek(0, os.SEEK_END)
+
+    def append(self, description, data):
+        # Returns (segment, offset of the PDF bytes).
+        meta = json.dumps(description, separators=(',', ':')).encode('utf-8')
+        if self._file is None:
+            self._open()
+        if self._file.tell() and self._file.tell() + _RECORD.size + len(meta) + len(data) > SEGMENT_MAX_BYTES:
+            self.sync()
+            self.segment += 1
+            self._open()
+        self._file.write(_RECORD.pack(_MAGIC, len(meta), len(data)))
+        self._file.write(meta)
+        offset = self._file.tell()
+        self._file.write(data)
+        return self.segment, offset
+
+    def sync(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+# Read-only maps of segments, per path, shared by all threads. A map is
+# replaced when an entry lies past its end (the newest segment grows).
+_maps = {}
+_maps_lock = threading.Lock()
+
+def _read_slice(path, offset, length):
+    with _maps_lock:
+        mapped = _maps.get(path)
+        if mapped is None or len(mapped) < offset + length:
+            if mapped is not None:
+                mapped.close()
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            _maps[path] = mapped
+        return mapped[offset:offset + length]
+
+def _forget(path):
+    with _maps_lock:
+        mapped = _maps.pop(path, None)
+        if mapped is not None:
+            mapped.close()
+
+def close_maps():
+    # Unmaps every segment (Windows cannot delete a mapped file).
+    with _maps_lock:
+        maps = list(_maps.values())
+        _maps.clear()
+    for mapped in maps:
+        mapped.close()
+
+def _issued_text(issued):
+    return issued.isoformat(sep=' ', timespec='seconds') if isinstance(issued, datetime) else issued
+
+def _description(invoice_number, issued_at, customer_name, source_name, digest):
+    return {'invoice_number': invoice_number, 'issued_at': issued_at, 'customer_name': customer_name,
+            'source_name': source_name, 'sha256': digest}
+
+def _insert_entry(conn, description, segment, offset, length):
+    return conn.execute('''
+        INSERT INTO archive_entries (invoice_number, issued_at, customer_name, source_name,
+                                     segment, data_offset, length, sha256)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (description['invoice_number'], description['issued_at'], description['customer_name'],
+          description['source_name'], segment, offset, length, description['sha256'])).lastrowid
+
+@tracing.traced('invoice_archive.archive_pdfs')
+def archive_pdfs(records, directory=None):
+    # records: (pdf bytes, invoice_number, issued, customer_name, source_name)
+    # tuples, appended in one transaction. An invoice already archived with
+    # the same bytes (before, or earlier in records) is not stored twice.
+    # Returns the entry ids in order.
+    directory = directory or default_archive_dir()
+    writer = _SegmentWriter(directory)
+    entry_ids = []
+    try:
+        with transaction(immediate=True) as conn:
+            pending = []
+            # (invoice_number, digest) -> index of its first record, for
+            # repeats within this batch
+            seen = {}
+            repeats = []
+            for data, invoice_number, issued, customer_name, source_name in records:
+                digest = hashlib.sha256(data).hexdigest()
+                first = seen.get((invoice_number, digest))
+                if first is not None:
+                    repeats.append((len(entry_ids), first))
+                    entry_ids.append(None)
+                    continue
+                existing = conn.execute(
+                    "SELECT entry_id FROM archive_entries WHERE invoice_number = ? AND sha256 = ?",
+                    (invoice_number, digest)).fetchone()
+                seen[invoice_number, digest] = len(entry_ids)
+                if existing:
+                    entry_ids.append(existing[0])
+                    continue
+                description = _description(invoice_number, _issued_text(issued), customer_name or '',
+                                           source_name or f"invoice_{invoice_number}.pdf", digest)
+                segment, offset = writer.append(description, data)
+                pending.append((len(entry_ids), description, segment, offset, len(data)))
+                entry_ids.append(None)
+            # The bytes are on disk before any row points at them
+            writer.sync()
+            for i, description, segment, offset, length in pending:
+                entry_ids[i] = _insert_entry(conn, description, segment, offset, length)
+            for i, first in repeats:
+                entry_ids[i] = entry_ids[first]
+    finally:
+        writer.close()
+    return entry_ids
+
+def archive_pdf(data, invoice_number, issued, customer_name='', source_name=None, directory=None):
+    return archive_pdfs([(data, invoice_number, issued, customer_name, source_name)], directory)[0]
+
+def find_loose_invoices(source_dir, older_than=None):
+    # invoice_*.pdf files directly in source_dir, oldest first; with
+    # older_than (a datetime) only those last modified before it.
+    cutoff = older_than.timestamp() if older_than else None
+    found = []
+    with os.scandir(source_dir) as entries:
+        for entry in entries:
+            if not entry.is_file() or not _LOOSE_NAME.match(entry.name):
+                continue
+            mtime = entry.stat().st_mtime
+            if cutoff is None or mtime < cutoff:
+                found.append((mtime, entry.path))
+    return [path for _, path in sorted(found)]
+
+def _history_by_path(conn):
+    # absolute path -> (pdf_path as stored, invoice_number, issued_at,
+    # customer_name) for invoices recorded by invoice_store; read once per
+    # pack rather than per file
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='invoices'").fetchone():
+        return {}
+    return {os.path.abspath(row[0]): tuple(row) for row in conn.execute(
+        "SELECT pdf_path, invoice_number, issued_at, customer_name FROM invoices "
+        "WHERE pdf_path IS NOT NULL AND pdf_path NOT LIKE ?", (ARCHIVE_REF_PREFIX + '%',))}
+
+def _loose_details(path, history):
+    # Files older than the invoice history only have their name and mtime:
+    # invoice_<number>.pdf, or invoice_YYYYMMDD_HHMMSS.pdf before numbering
+    known = history.get(os.path.abspath(path))
+    if known:
+        return known[1:]
+    stem = _LOOSE_NAME.match(os.path.basename(path)).group(1)
+    if _LEGACY_NUMBER.match(stem):
+        issued = datetime.strptime(stem, "%Y%m%d_%H%M%S")
+    else:
+        issued = datetime.fromtimestamp(os.path.getmtime(path)).replace(microsecond=0)
+    return stem, _issued_text(issued), ''
+
+@tracing.traced('invoice_archive.pack_directory')
+def pack_directory(source_dir, directory=None, older_than_days=ARCHIVE_AFTER_DAYS, keep=False,
+                   batch_size=PACK_BATCH_SIZE):
+    # Moves loose invoice PDFs last modified more than older_than_days ago
+    # into the archive, batch_size files per transaction; the invoice
+    # history of a moved file then refers to its archive entry. With keep
+    # the files, and the history's paths to them, are left in place;
+    # packing them again later stores nothing new.
+    older_than = datetime.now() - timedelta(days=older_than_days) if older_than_days is not None else None
+    start = time.perf_counter()
+    paths = find_loose_invoices(source_dir, older_than)
+    history = _history_by_path(products_db.get_connection())
+    archived = removed = archived_bytes = 0
+    for i in range(0, len(paths), batch_size):
+        batch = paths[i:i + batch_size]
+        records = []
+        for path in batch:
+            with open(path, 'rb') as f:
+                data = f.read()
+            records.append((data, *_loose_details(path, history), os.path.basename(path)))
+            archived_bytes += len(data)
+        with transaction(immediate=True) as conn:
+            entry_ids = archive_pdfs(records, directory)
+            moved = [(archive_ref(entry_id), history[os.path.abspath(path)][0])
+                     for path, entry_id in zip(batch, entry_ids) if os.path.abspath(path) in history]
+            if moved and not keep:
+                conn.executemany("UPDATE invoices SET pdf_path = ? WHERE pdf_path = ?", moved)
+        archived += len(batch)
+        if keep:
+            continue
+        for path in batch:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                # Open in a viewer, say; it is archived and goes next time
+                pass
+    elapsed = time.perf_counter() - start
+    return {'archived': archived, 'removed': removed, 'bytes': archived_bytes, 'elapsed_s': elapsed}
+
+@tracing.traced('invoice_archive.find_by_number')
+def find_by_number(invoice_number):
+    return products_db.get_connection().execute(
+        _SELECT_ENTRIES + " WHERE invoice_number = ? ORDER BY entry_id", (invoice_number,)).fetchall()
+
+@tracing.traced('invoice_archive.find_by_customer')
+def find_by_customer(customer_name, before=None, limit=PAGE_SIZE):
+    # Newest first, keyset-paged like invoice_store.list_invoices(): pass
+    # page_cursor() of the last row as before= for the next page.
+    sql = _SELECT_ENTRIES + " WHERE customer_name = ? COLLATE NOCASE"
+    params = [customer_name]
+    if before is not None:
+        sql += " AND (issued_at, entry_id) < (?, ?)"
+        params.extend(before)
+    sql += " ORDER BY issued_at DESC, entry_id DESC LIMIT ?"
+    params.append(limit)
+    return products_db.get_connection().execute(sql, params).fetchall()
+
+def page_cursor(row):
+    return (row[2], row[0])
+
+def get_entry(entry_id):
+    return products_db.get_connection().execute(
+        _SELECT_ENTRIES + " WHERE entry_id = ?", (entry_id,)).fetchone()
+
+@tracing.traced('invoice_archive.read_pdf')
+def read_pdf(entry, directory=None, verify=False):
+    # entry: an entry row or its entry_id. Returns the PDF bytes.
+    if not isinstance(entry, tuple):
+        entry = get_entry(entry)
+        if entry is None:
+            raise KeyError("no such archive entry")
+    segment, offset, length, digest = entry[5:9]
+    data = _read_slice(segment_path(directory or default_archive_dir(), segment), offset, length)
+    if verify and hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"archive entry {entry[0]} is corrupt")
+    return data
+
+def extract(entry, filename, directory=None):
+    data = read_pdf(entry, directory, verify=True)
+    with open(filename, 'wb') as f:
+        f.write(data)
+    return filename
+
+@tracing.traced('invoice_archive.remove')
+def remove(entry_ids):
+    # The bytes stay in their segment until compact() reclaims them.
+    with transaction() as conn:
+        conn.executemany("DELETE FROM archive_entries WHERE entry_id = ?",
+                         ((entry_id,) for entry_id in entry_ids))
+
+@tracing.traced('invoice_archive.compact')
+def compact(directory=None, min_garbage=COMPACT_MIN_GARBAGE):
+    # Rewrites the live entries of every sealed segment (any but the newest)
+    # that is at least min_garbage unreferenced, then deletes it. Each
+    # segment is one transaction, so other writers wait for one segment's
+    # copy at most.
+    directory = directory or default_archive_dir()
+    start = time.perf_counter()
+    segments = list_segments(directory)
+    conn = products_db.get_connection()
+    live = dict(conn.execute("SELECT segment, SUM(length) FROM archive_entries GROUP BY segment"))
+    compacted = moved = reclaimed = 0
+    for segment in segments[:-1]:
+        path = segment_path(directory, segment)
+        size = os.path.getsize(path)
+        if size and live.get(segment, 0) > (1 - min_garbage) * size:
+            continue
+        writer = _SegmentWriter(directory)
+        try:
+            with transaction(immediate=True) as conn:
+                rows = conn.execute(_SELECT_ENTRIES + " WHERE segment = ? ORDER BY data_offset",
+                                    (segment,)).fetchall()
+                moves = []
+                for row in rows:
+                    data = _read_slice(path, row[6], row[7])
+                    moves.append((*writer.append(_description(*row[1:5], row[8]), data), row[0]))
+                writer.sync()
+                conn.executemany("UPDATE archive_entries SET segment = ?, data_offset = ? WHERE entry_id = ?",
+                                 moves)
+        finally:
+            writer.close()
+        _forget(path)
+        try:
+            os.remove(path)
+        except OSError:
+            # Still mapped by another process on Windows; it holds no live
+            # entries now, so a later compaction removes it
+            continue
+        compacted += 1
+        moved += len(rows)
+        reclaimed += size - sum(row[7] for row in rows)
+    return {'compacted': compacted, 'moved': moved, 'reclaimed_bytes': reclaimed,
+            'elapsed_s': time.perf_counter() - start}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack old invoice PDFs into the archive and read them back.")
+    parser.add_argument('--db', help="database file (default: ~/Documents/invoices/products.db)")
+    parser.add_argument('--archive-dir', default=default_archive_dir())
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack = commands.add_parser('pack', help="archive loose invoice_*.pdf files")
+    pack.add_argument('source', nargs='?', default=os.path.expanduser("~/Documents/invoices"))
+    pack.add_argument('--older-than', type=int, default=ARCHIVE_AFTER_DAYS, metavar='DAYS')
+    pack.add_argument('--keep', action='store_true', help="leave the loose files in place")
+    get = commands.add_parser('get', help="extract an invoice by number")
+    get.add_argument('invoice_number')
+    get.add_argument('-o', '--output', help="file to write (default: its original name)")
+    listing = commands.add_parser('list', help="list a customer's archived invoices")
+    listing.add_argument('customer')
+    listing.add_argument('-n', '--limit', type=int, default=PAGE_SIZE)
+    commands.add_parser('compact', help="reclaim space left by removed entries")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        products_db.set_db_path(args.db)
+    import schema
+    schema.ensure_schema()
+
+    if args.command == 'pack':
+        stats = pack_directory(args.source, args.archive_dir, args.older_than, args.keep)
+        print(f"Archived {stats['archived']} invoices ({stats['bytes'] / 1e6:.1f} MB, "
+              f"{stats['removed']} files removed) in {stats['elapsed_s']:.2f}s", file=sys.stderr)
+    elif args.command == 'get':
+        entries = find_by_number(args.invoice_number)
+        if not entries:
+            print(f"{args.invoice_number} is not in the archive", file=sys.stderr)
+            return 1
+        # The latest copy, if it was archived more than once
+        entry = entries[-1]
+        print(extract(entry, args.output or entry[4], args.archive_dir))
+    elif args.command == 'list':
+        for row in find_by_customer(args.customer, limit=args.limit):
+            print(f"{row[1]}\t{row[2]}\t{row[3]}\t{row[7]} bytes")
+    else:
+        stats = compact(args.archive_dir)
+        print(f"Compacted {stats['compacted']} segments, moved {stats['moved']} entries, "
+              f"reclaimed {stats['reclaimed_bytes'] / 1e6:.1f} MB in {stats['elapsed_s']:.2f}s",
+              file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import os
+from datetime import datetime
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+import invoice_renderer
+from invoice_template import get_template
+import tracing
+
+# Many invoices in one PDF for month-end statements. Every invoice in a
+# document shares a single copy of the template forms (company block,
+# labels, footer), the encoded logo and the font resources, and gets an
+# outline entry pointing at its first page.
+#
+# With max_pages set, the bundle is split into parts named <name>_001.pdf,
+# <name>_002.pdf, ...: a new part is started before any invoice that would
+# begin past the cap. An invoice is never split between parts, so a part can
+# run over the cap by the length of its last invoice.
+
+class BundleWriter:
+    def __init__(self, filename, company_settings, max_pages=None):
+        if max_pages is not None and max_pages < 1:
+            raise ValueError("max_pages must be at least 1")
+        self.filename = filename
+        self.template = get_template(company_settings)
+        self.max_pages = max_pages
+        # (part filename, invoice_number, first page in the part, total_cents)
+        self.entries = []
+        self.parts = []
+        self._canvas = None
+        self._part_invoices = 0
+
+    def part_filename(self, part):
+        if self.max_pages is None:
+            return self.filename
+        base, ext = os.path.splitext(self.filename)
+        return f"{base}_{part:03d}{ext or '.pdf'}"
+
+    def pages_in_part(self):
+        # Every invoice ends with showPage, so the open page is always blank
+        return self._canvas.getPageNumber() - 1 if self._canvas else 0
+
+    def _start_part(self):
+        filename = self.part_filename(len(self.parts) + 1)
+        self.parts.append(filename)
+        self._canvas = canvas.Canvas(filename, pagesize=letter)
+        self._canvas.setTitle(os.path.splitext(os.path.basename(filename))[0])
+        self._canvas.showOutline()
+        self._part_invoices = 0
+
+    def _finish_part(self):
+        with tracing.span('bundle.save'):
+            self._canvas.save()
+        self._canvas = None
+
+    @tracing.traced('bundle.add')
+    def add(self, customer_info, items, invoice_number=None, issued=None):
+        # Draws one invoice at the end of the bundle and returns its total in
+        # cents.
+        issued = issued or datetime.now()
+        invoice_number = invoice_number or invoice_renderer.default_invoice_number(issued)
+        customer_info = customer_info or {}
+        if self._canvas is not None and self.max_pages is not None \
+                and self.pages_in_part() >= self.max_pages:
+            self._finish_part()
+        if self._canvas is None:
+            self._start_part()
+        c = self._canvas
+        first_page = c.getPageNumber()
+        key = f"invoice{self._part_invoices}"
+        self._part_invoices += 1
+        c.bookmarkPage(key, fit="XYZ", left=0, top=self.template.height)
+        title = str(invoice_number)
+        if customer_info.get('name'):
+            title += f" - {customer_info['name']}"
+        c.addOutlineEntry(title, key, level=0)
+        total_cents = invoice_renderer.draw_invoice(
+            c, self.template, customer_info, items, invoice_number, issued)
+        c.showPage()
+        self.entries.append((self.parts[-1], invoice_number, first_page, total_cents))
+        return total_cents
+
+    def close(self):
+        # Writes the open part; returns the filenames of all parts.
+        if self._canvas is not None:
+            self._finish_part()
+        return list(self.parts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._canvas is not None:
+            # Parts already written are kept; the one with the failed
+            # invoice is dropped rather than saved half drawn
+            self._canvas = None
+            dropped = self.parts.pop()
+            self.entries = [e for e in self.entries if e[0] != dropped]
+        return False
+
+@tracing.traced('bundle.render_bundle')
+def render_bundle(filename, company_settings, invoices, max_pages=None):
+    """Render ``invoices`` into one PDF (or size-capped parts) and return
+    ``(parts, entries)``.
+
+    ``invoices`` is an iterable of dicts with ``customer``, ``items`` and
+    optional ``invoice_number`` and ``issued``, as read by batch_invoices;
+    it is consumed one invoice at a time. ``entries`` lists
+    ``(part filename, invoice_number, first page, total_cents)`` per invoice.
+    """
+    with BundleWriter(filename, company_settings, max_pages) as writer:
+        for record in invoices:
+            writer.add(record.get('customer'), record['items'],
+                       record.get('invoice_number'), record.get('issued'))
+    return writer.parts, writer.entries
@@ -0,0 +1,81 @@
+import os
+import threading
+from datetime import datetime
+from products_db import transaction
+import tracing
+
+# Invoice numbers come from a sequence row in the shared SQLite database.
+# reserve() takes the next block of values inside BEGIN IMMEDIATE, so two
+# threads, processes or app instances on the same database can never be
+# handed the same value. A NumberAllocator hands values out one at a time
+# from blocks reserved that way: the GUI reserves one at a time so numbers
+# stay consecutive, batch workers reserve larger blocks so they rarely touch
+# the database. Values left in a block when its process exits are skipped.
+#
+# Numbers are formatted with str.format; {seq} is the sequence value and
+# {issued} the invoice datetime, e.g. "INV-{issued:%Y}-{seq:05d}".
+
+SEQUENCE = 'invoice'
+DEFAULT_FORMAT = "INV-{issued:%Y%m%d}-{seq:06d}"
+
+@tracing.traced('invoice_numbers.init_numbers')
+def init_numbers():
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS invoice_sequences (
+                name TEXT PRIMARY KEY,
+                next_value INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+
+@tracing.traced('invoice_numbers.reserve')
+def reserve(count=1, sequence=SEQUENCE):
+    # Returns the first of count consecutive values nobody else will get.
+    if count < 1:
+        raise ValueError("count must be at least 1")
+    with transaction(immediate=True) as conn:
+        row = conn.execute(
+            "SELECT next_value FROM invoice_sequences WHERE name=?", (sequence,)).fetchone()
+        first = row[0] if row else 1
+        conn.execute('''
+            INSERT INTO invoice_sequences (name, next_value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET next_value=excluded.next_value
+        ''', (sequence, first + count))
+    return first
+
+def format_number(fmt, seq, issued=None):
+    return fmt.format(seq=seq, issued=issued or datetime.now())
+
+def check_format(fmt):
+    # A usable format must include {seq}, or every number would be the same.
+    # Any error formatting it ('{seq[0]}', '{seq.x}', '{issued:%Q}') makes it
+    # unusable too.
+    try:
+        return format_number(fmt, 1) != format_number(fmt, 2)
+    except Exception:
+        return False
+
+class NumberAllocator:
+    def __init__(self, block_size=1, fmt=DEFAULT_FORMAT, sequence=SEQUENCE):
+        self.block_size = block_size
+        self.fmt = fmt or DEFAULT_FORMAT
+        self.sequence = sequence
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._next = self._end = 0
+
+    def next_value(self):
+        with self._lock:
+            # A forked child must not reuse the block its parent holds
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._next = self._end = 0
+            if self._next >= self._end:
+                self._next = reserve(self.block_size, self.sequence)
+                self._end = self._next + self.block_size
+            value = self._next
+            self._next += 1
+        return value
+
+    def next_number(self, issued=None):
+        return format_number(self.fmt, self.next_value(), issued)
@@ -0,0 +1,312 @@
+import hashlib
+import json
+import os
+import re
+from datetime import datetime
+import reportlab
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+from reportlab.platypus import Table, TableStyle
+from invoice_template import get_template
+import logo_cache
+import tracing
+from line_items import (LineItems, format_cents, format_price, format_quantity,
+                        parse_decimal, line_total_cents)
+
+# Qt-free PDF layout shared by the GUI and the batch renderer.
+
+# Part of every render_cache key; bump it whenever a change here or in
+# invoice_template changes what the same invoice renders to.
+LAYOUT_VERSION = 1
+
+TABLE_COL_WIDTHS = [3*inch, 1.2*inch, 1.2*inch, 1.2*inch]
+
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+    ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 1), (-1, -1), 10),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('TOPPADDING', (0, 1), (-1, -1), 12),
+])
+
+def default_output_dir():
+    return os.path.expanduser("~/Documents/invoices")
+
+def default_invoice_number(now=None):
+    return (now or datetime.now()).strftime("INV-%Y%m%d-%H%M")
+
+def invoice_filename(output_dir, invoice_number):
+    # Characters other than letters, digits and ._- become '_', so different
+    # numbers (A/1 and A_1) can map to the same name; callers writing a new
+    # invoice use render_new_invoice(), which never overwrites a file
+    safe = re.sub(r'[^A-Za-z0-9._-]', '_', str(invoice_number))
+    return os.path.join(output_dir, f"invoice_{safe}.pdf")
+
+def write_new_file(filename, data):
+    # Writes data to filename, or to the first free filename_1, filename_2,
+    # ... if it exists, and returns the name used. Each name is claimed with
+    # an exclusive create, so concurrent writers (threads or processes)
+    # never end up sharing one.
+    base, ext = os.path.splitext(filename)
+    suffix = 1
+    while True:
+        try:
+            f = open(filename, 'xb')
+        except FileExistsError:
+            filename = f"{base}_{suffix}{ext}"
+            suffix += 1
+            continue
+        try:
+            with f:
+                f.write(data)
+        except BaseException:
+            os.remove(filename)
+            raise
+        return filename
+
+TABLE_HEADER = ["Item", "Quantity", "Price", "Total"]
+
+def table_row(name, price, quantity, total_cents):
+    # Names stay on one line so every item row has the same height
+    return [
+        " ".join(str(name).splitlines()),
+        format_quantity(quantity),
+        f"${format_price(price)}",
+        f"${format_cents(total_cents)}"
+    ]
+
+def iter_table_rows(items):
+    # Yields (cells, total_cents) per billable line without materializing the
+    # whole invoice, so generators of line items stream straight onto pages.
+    if isinstance(items, LineItems):
+        for line in items.billable():
+            yield table_row(line.name, line.price, line.quantity, line.total_cents), line.total_cents
+        return
+    for name, price, quantity in items:
+        price, quantity = parse_decimal(price), parse_decimal(quantity)
+        total_cents = line_total_cents(price, quantity)
+        if total_cents is not None:
+            yield table_row(name or "", price, quantity, total_cents), total_cents
+
+def build_table_data(items):
+    data = [TABLE_HEADER]
+    total_cents = 0
+    for cells, line_cents in iter_table_rows(items):
+        data.append(cells)
+        total_cents += line_cents
+    return data, total_cents
+
+def draw_continuation_header(c, invoice_number, width, height):
+    c.setFont("Helvetica-Bold", 12)
+    c.setFillColor(colors.black)
+    c.drawString(50, height - 50, f"Invoice {invoice_number} (continued)")
+
+# Item table pagination. The table starts under the Bill To box on the first
+# page and under a one-line header on later pages, and never runs below
+# TABLE_BOTTOM. Pages that continue carry a subtotal row forward.
+FIRST_PAGE_TABLE_TOP = 320
+CONTINUATION_TABLE_TOP = 70
+TABLE_BOTTOM = 60
+TOTAL_GAP = 20
+
+_row_heights = None
+
+def table_row_heights(c):
+    # (header height, item row height), measured once; rows never wrap.
+    global _row_heights
+    if _row_heights is None:
+        width, height = letter
+        header = Table([TABLE_HEADER], colWidths=TABLE_COL_WIDTHS)
+        header.setStyle(TABLE_STYLE)
+        _, header_h = header.wrapOn(c, width, height)
+        both = Table([TABLE_HEADER, ["X", "1.0", "$1.00", "$1.00"]], colWidths=TABLE_COL_WIDTHS)
+        both.setStyle(TABLE_STYLE)
+        _, both_h = both.wrapOn(c, width, height)
+        _row_heights = (header_h, both_h - header_h)
+    return _row_heights
+
+def draw_item_pages(c, template, items, invoice_number, width, height):
+    # Draws the items table across as many pages as needed, pulling rows from
+    # the iterator one page at a time, then the invoice total. The first page
+    # header must already be drawn. Returns the total in cents.
+    header_h, row_h = table_row_heights(c)
+    rows = iter_table_rows(items)
+    pending = next(rows, None)
+    total_cents = 0
+    page = 1
+    top = height - FIRST_PAGE_TABLE_TOP
+    while True:
+        data = [TABLE_HEADER]
+        bold_rows = []
+        if page > 1:
+            bold_rows.append(len(data))
+            data.append(["Subtotal brought forward", "", "", f"${format_cents(total_cents)}"])
+        # One row's height is always kept free, for either the carried-forward
+        # subtotal or the invoice total
+        capacity = max(1, int((top - TABLE_BOTTOM - header_h) // row_h) - len(data))
+        while pending is not None and len(data) - 1 - (page > 1) < capacity:
+            cells, line_cents = pending
+            data.append(cells)
+            total_cents += line_cents
+            pending = next(rows, None)
+        more = pending is not None
+        if more:
+            bold_rows.append(len(data))
+            data.append(["Subtotal carried forward", "", "", f"${format_cents(total_cents)}"])
+
+        with tracing.span('render.table.page'):
+            table = Table(data, colWidths=TABLE_COL_WIDTHS)
+            table.setStyle(TABLE_STYLE)
+            for row in bold_rows:
+                table.setStyle([('FONTNAME', (0, row), (-1, row), 'Helvetica-Bold')])
+            _, table_h = table.wrapOn(c, width, height)
+            table.drawOn(c, 50, top - table_h)
+
+        if not more:
+            # Add total
+            c.setFont("Helvetica-Bold", 12)
+            c.drawString(400, top - table_h - TOTAL_GAP, "Total:")
+            c.drawString(500, top - table_h - TOTAL_GAP, f"${format_cents(total_cents)}")
+            template.draw_footer(c, page if page > 1 else None)
+            return total_cents
+        template.draw_footer(c, page)
+        c.showPage()
+        page += 1
+        draw_continuation_header(c, invoice_number, width, height)
+        top = height - CONTINUATION_TABLE_TOP
+
+def draw_invoice(c, template, customer_info, items, invoice_number, issued, progress=None):
+    # Draws one invoice from the current page of c onwards, leaving its last
+    # page open. Returns the total in cents.
+    progress = progress or (lambda stage: None)
+    width, height = template.width, template.height
+    progress('header')
+    with tracing.span('render.header'):
+        template.draw_first_page(c, customer_info, invoice_number, issued)
+
+    progress('table')
+    with tracing.span('render.table'):
+        return draw_item_pages(c, template, items, invoice_number, width, height)
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+@tracing.traced('render.digest')
+def invoice_digest(company_settings, customer_info, items, invoice_number, issued):
+    # Returns (render_cache key, total_cents). The key hashes what the PDF
+    # shows: the table cells as drawn (so "2" and "2.00" are the same
+    # invoice), the header fields, the company block and the logo's content,
+    # plus the layout and ReportLab versions.
+    logo_path = company_settings.get('logo_path')
+    try:
+        logo = logo_cache.file_digest(logo_path) if logo_path else None
+    except OSError:
+        logo = None
+    customer_info = customer_info or {}
+    h = hashlib.sha256(_canonical({
+        'layout': LAYOUT_VERSION,
+        'reportlab': reportlab.Version,
+        'company': [company_settings.get('company_name', 'Your Company Name'),
+                    company_settings.get('company_email', 'company@example.com'),
+                    company_settings.get('company_address', 'Company Address')],
+        'logo': logo,
+        'customer': [customer_info.get(field) or "" for field in ('name', 'email', 'address')],
+        'number': str(invoice_number),
+        'issued': issued.strftime('%Y-%m-%d'),
+    }))
+    total_cents = 0
+    for cells, line_cents in iter_table_rows(items):
+        h.update(_canonical(cells))
+        total_cents += line_cents
+    return h.hexdigest(), total_cents
+
+@tracing.traced('render.invoice_bytes')
+def render_invoice_bytes(company_settings, customer_info, items, invoice_number=None, issued=None,
+                         progress=None, template=None, cache=None):
+    """Render one invoice in memory and return ``(pdf, total_cents)``, where
+    ``pdf`` is the whole document as ``bytes``.
+
+    ``items`` is a LineItems or an iterable of ``(name, price, quantity)``;
+    price and quantity may be numbers or the raw text typed into the GUI.
+    Iterables are consumed lazily, a page at a time, so very long invoices
+    are drawn in bounded memory. ``progress``, if given, is called with the
+    name of each stage as it starts. ``template`` defaults to the compiled
+    template for ``company_settings``.
+
+    With a ``cache`` (a render_cache.RenderCache), an invoice identical to
+    one rendered before is read from it instead of being drawn again.
+    ``items`` is then iterated twice, so it must not be a one-shot iterator.
+    """
+    progress = progress or (lambda stage: None)
+    issued = issued or datetime.now()
+    invoice_number = invoice_number or default_invoice_number(issued)
+    if cache is not None:
+        key, total_cents = invoice_digest(company_settings, customer_info, items, invoice_number, issued)
+        pdf = cache.get(key)
+        if pdf is not None:
+            return pdf, total_cents
+    template = template or get_template(company_settings)
+    # No file behind the canvas: getpdfdata() hands back the document that
+    # save() would have written
+    c = canvas.Canvas(None, pagesize=letter)
+    total_cents = draw_invoice(c, template, customer_info, items, invoice_number, issued, progress)
+
+    progress('save')
+    with tracing.span('render.save'):
+        pdf = c.getpdfdata()
+    if cache is not None:
+        cache.put(key, pdf)
+    return pdf, total_cents
+
+def write_invoice(out, company_settings, customer_info, items, invoice_number=None, issued=None,
+                  progress=None, template=None, cache=None):
+    # Writes the PDF to the binary file-like out (a socket file, an archive
+    # member, a BytesIO, ...) and returns the total in cents.
+    pdf, total_cents = render_invoice_bytes(company_settings, customer_info, items, invoice_number,
+                                            issued, progress, template, cache)
+    with tracing.span('render.write'):
+        out.write(pdf)
+    return total_cents
+
+@tracing.traced('render.invoice')
+def render_invoice(filename, company_settings, customer_info, items,
+                   invoice_number=None, issued=None, progress=None, template=None, cache=None):
+    """Write one invoice PDF to ``filename`` (a path, or a binary file-like
+    object) and return the total in cents.
+
+    A thin wrapper around render_invoice_bytes(), which takes the same
+    arguments.
+    """
+    if hasattr(filename, 'write'):
+        return write_invoice(filename, company_settings, customer_info, items, invoice_number,
+                             issued, progress, template, cache)
+    # Rendered before the file is opened, so a failed render leaves no file
+    pdf, total_cents = render_invoice_bytes(company_settings, customer_info, items, invoice_number,
+                                            issued, progress, template, cache)
+    with tracing.span('render.write'):
+        with open(filename, 'wb') as f:
+            f.write(pdf)
+    return total_cents
+
+@tracing.traced('render.invoice')
+def render_new_invoice(filename, company_settings, customer_info, items,
+                       invoice_number=None, issued=None, progress=None, template=None, cache=None):
+    """Like render_invoice(), but never overwrites an existing file: the PDF
+    goes to ``filename`` or the first free ``filename_1``, ``filename_2``, ...
+    Returns ``(filename used, total_cents)``.
+    """
+    pdf, total_cents = render_invoice_bytes(company_settings, customer_info, items, invoice_number,
+                                            issued, progress, template, cache)
+    with tracing.span('render.write'):
+        filename = write_new_file(filename, pdf)
+    return filename, total_cents
@@ -0,0 +1,162 @@
+import os
+from datetime import datetime
+from products_db import get_connection, transaction
+from line_items import LineItems, parse_decimal, line_total_cents
+import tracing
+
+# History of generated invoices, stored next to products in the same SQLite
+# database. Each invoice and its lines are written in one transaction.
+# Listings are keyset-paged newest first over (issued_at, invoice_id), with
+# indexes for the customer, date and invoice number filters, so every page
+# is a short index range scan however many invoices there are.
+
+INVOICE_FIELDS = ('invoice_id', 'invoice_number', 'issued_at', 'customer_name',
+                  'customer_email', 'customer_address', 'total_cents', 'pdf_path')
+LINE_FIELDS = ('line_no', 'name', 'price', 'quantity', 'total_cents')
+PAGE_SIZE = 50
+
+_SELECT_INVOICES = f"SELECT {', '.join(INVOICE_FIELDS)} FROM invoices"
+
+@tracing.traced('invoice_store.init_store')
+def init_store():
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS invoices (
+                invoice_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                invoice_number TEXT NOT NULL,
+                issued_at TEXT NOT NULL,
+                customer_name TEXT NOT NULL DEFAULT '',
+                customer_email TEXT NOT NULL DEFAULT '',
+                customer_address TEXT NOT NULL DEFAULT '',
+                total_cents INTEGER NOT NULL,
+                pdf_path TEXT
+            )
+        ''')
+        # Prices and quantities are kept as exact decimal text
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS invoice_lines (
+                invoice_id INTEGER NOT NULL REFERENCES invoices(invoice_id) ON DELETE CASCADE,
+                line_no INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                price TEXT NOT NULL,
+                quantity TEXT NOT NULL,
+                total_cents INTEGER NOT NULL,
+                PRIMARY KEY (invoice_id, line_no)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_invoices_issued ON invoices(issued_at, invoice_id)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_invoices_customer "
+            "ON invoices(customer_name COLLATE NOCASE, issued_at, invoice_id)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_invoices_number ON invoices(invoice_number)")
+
+def format_issued(issued):
+    return issued.isoformat(sep=' ', timespec='seconds')
+
+def _line_rows(invoice_id, items):
+    # Billable lines only, the same ones the PDF shows
+    if isinstance(items, LineItems):
+        lines = ((l.name, l.price, l.quantity, l.total_cents) for l in items.billable())
+    else:
+        lines = ((name or "", price, quantity, line_total_cents(price, quantity))
+                 for name, price, quantity in
+                 ((name, parse_decimal(price), parse_decimal(quantity)) for name, price, quantity in items))
+    line_no = 0
+    for name, price, quantity, total_cents in lines:
+        if total_cents is None:
+            continue
+        line_no += 1
+        yield (invoice_id, line_no, name, str(price), str(quantity), total_cents)
+
+class DuplicateInvoice(Exception):
+    pass
+
+@tracing.traced('invoice_store.record_new_invoice')
+def record_new_invoice(invoice_number, issued, customer_info, items, total_cents,
+                       pdf_path=None, write_pdf=None):
+    # Records an invoice whose number must not be in the history yet. The
+    # check, write_pdf() (if given, it writes the PDF and returns its path)
+    # and the insert all happen under the database write lock, so two
+    # writers can never both record a number. Raises DuplicateInvoice if it
+    # is taken. Returns (invoice_id, pdf_path).
+    with transaction(immediate=True) as conn:
+        if conn.execute("SELECT 1 FROM invoices WHERE invoice_number = ? LIMIT 1",
+                        (invoice_number,)).fetchone():
+            raise DuplicateInvoice(f"invoice {invoice_number} is already recorded")
+        if write_pdf is None:
+            return save_invoice(invoice_number, issued, customer_info, items, total_cents, pdf_path), pdf_path
+        pdf_path = write_pdf()
+        try:
+            invoice_id = save_invoice(invoice_number, issued, customer_info, items, total_cents, pdf_path)
+        except BaseException:
+            os.remove(pdf_path)
+            raise
+    return invoice_id, pdf_path
+
+@tracing.traced('invoice_store.save_invoice')
+def save_invoice(invoice_number, issued, customer_info, items, total_cents, pdf_path=None):
+    # items: a LineItems or an iterable of (name, price, quantity); lines are
+    # streamed into executemany, so long invoices are never copied first.
+    customer_info = customer_info or {}
+    with transaction() as conn:
+        invoice_id = conn.execute('''
+            INSERT INTO invoices (invoice_number, issued_at, customer_name, customer_email,
+                                  customer_address, total_cents, pdf_path)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (invoice_number, format_issued(issued), customer_info.get('name') or '',
+              customer_info.get('email') or '', customer_info.get('address') or '',
+              total_cents, pdf_path)).lastrowid
+        conn.executemany('''
+            INSERT INTO invoice_lines (invoice_id, line_no, name, price, quantity, total_cents)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', _line_rows(invoice_id, items))
+    return invoice_id
+
+@tracing.traced('invoice_store.list_invoices')
+def list_invoices(customer=None, date_from=None, date_to=None, before=None, limit=PAGE_SIZE):
+    # Newest first. customer matches the name case-insensitively; date_from
+    # and date_to (datetimes or 'YYYY-MM-DD' strings) bound issued_at as
+    # [date_from, date_to). Pass the (issued_at, invoice_id) of the last row
+    # of a page as before= to get the next one.
+    where, params = [], []
+    if customer is not None:
+        where.append("customer_name = ? COLLATE NOCASE")
+        params.append(customer)
+    if date_from is not None:
+        where.append("issued_at >= ?")
+        params.append(format_issued(date_from) if isinstance(date_from, datetime) else date_from)
+    if date_to is not None:
+        where.append("issued_at < ?")
+        params.append(format_issued(date_to) if isinstance(date_to, datetime) else date_to)
+    if before is not None:
+        where.append("(issued_at, invoice_id) < (?, ?)")
+        params.extend(before)
+    sql = _SELECT_INVOICES
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY issued_at DESC, invoice_id DESC LIMIT ?"
+    params.append(limit)
+    return get_connection().execute(sql, params).fetchall()
+
+def page_cursor(row):
+    # The before= value that continues a listing after this row
+    return (row[2], row[0])
+
+@tracing.traced('invoice_store.find_by_number')
+def find_by_number(invoice_number):
+    return get_connection().execute(
+        _SELECT_INVOICES + " WHERE invoice_number = ? ORDER BY invoice_id",
+        (invoice_number,)).fetchall()
+
+@tracing.traced('invoice_store.get_invoice')
+def get_invoice(invoice_id):
+    return get_connection().execute(
+        _SELECT_INVOICES + " WHERE invoice_id = ?", (invoice_id,)).fetchone()
+
+@tracing.traced('invoice_store.get_invoice_lines')
+def get_invoice_lines(invoice_id):
+    return get_connection().execute(
+        f"SELECT {', '.join(LINE_FIELDS)} FROM invoice_lines WHERE invoice_id = ? ORDER BY line_no",
+        (invoice_id,)).fetchall()
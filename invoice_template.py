@@ -0,0 +1,224 @@
+import copy
+import hashlib
+import logging
+import threading
+import zlib
+import reportlab
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase import pdfdoc
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+import logo_cache
+import tracing
+
+# The parts of an invoice that only depend on the company settings (logo,
+# company block, the "INVOICE" title, field labels, the Bill To box and the
+# footer) are compiled once per settings version into a list of canvas calls.
+# Each PDF replays them into a form XObject the first time they are needed
+# and places the form with doForm afterwards, so multi-page invoices store
+# the footer once and per-invoice rendering only draws the variable fields.
+#
+# The logo is also encoded into a PDF image XObject just once per template.
+# canvas.drawImage would redo that (deflate plus ASCII85) for every document,
+# and it is by far the most expensive part of rendering a one-page invoice.
+# The cached copy is plain binary deflate, a fifth smaller than ASCII85.
+# Doing that means reaching into ReportLab internals (the canvas's document
+# and XObject bookkeeping, the image's soft mask), which are only used with
+# the ReportLab versions below; any other version gets plain drawImage.
+
+SHARED_LOGO_VERSIONS = ('3.', '4.')
+
+FOOTER_TEXT = "Thank you for your business!"
+NUMBER_LABEL = "Invoice Number: "
+DATE_LABEL = "Date: "
+MAX_TEMPLATES = 16
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_templates = {}
+
+def _can_share_logo():
+    return (reportlab.Version.startswith(SHARED_LOGO_VERSIONS)
+            and all(hasattr(canvas.Canvas, name) for name in ('_setXObjects', 'hasForm'))
+            and hasattr(pdfdoc.PDFImageXObject, '_checkTransparency'))
+
+SHARE_LOGO = _can_share_logo()
+
+def fingerprint(company_settings):
+    logo_path = company_settings.get('logo_path')
+    try:
+        logo_key = logo_cache.cache_key(logo_path) if logo_path else None
+    except OSError:
+        logo_key = (logo_path, None)
+    return (
+        company_settings.get('company_name', 'Your Company Name'),
+        company_settings.get('company_email', 'company@example.com'),
+        company_settings.get('company_address', 'Company Address'),
+        logo_key,
+    )
+
+class InvoiceTemplate:
+    def __init__(self, company_settings, pagesize=letter):
+        self.fingerprint = fingerprint(company_settings)
+        self.width, self.height = pagesize
+        digest = hashlib.sha1(repr((self.fingerprint, pagesize)).encode('utf-8')).hexdigest()[:12]
+        self.first_page_form = f"InvoiceFirstPage{digest}"
+        self.footer_form = f"InvoiceFooter{digest}"
+        self.logo_reader = None
+        self.logo_image = None
+        self.first_page_ops = self._compile_first_page(company_settings)
+        self.footer_ops = self._compile_footer()
+        # Where the variable fields go, next to their labels
+        self.number_x = 50 + stringWidth(NUMBER_LABEL, "Helvetica", 12)
+        self.date_x = 50 + stringWidth(DATE_LABEL, "Helvetica", 12)
+
+    def _compile_logo(self, logo_path):
+        height = self.height
+        if logo_path:
+            try:
+                # Decoded once per file version and shared by every render
+                logo = logo_cache.get_logo(logo_path)
+                self.logo_reader = logo.reader
+                if SHARE_LOGO:
+                    self.logo_image = encode_image(logo.reader)
+                return [('logo', (50, height - 120, logo.draw_width, logo.draw_height), {})]
+            except Exception as e:
+                logger.warning("Error adding logo %s: %s", logo_path, e)
+                placeholder = "Logo Error"
+        else:
+            placeholder = "No Logo"
+        return [
+            ('rect', (50, height - 120, 100, 50), {}),
+            ('setFont', ("Helvetica", 8), {}),
+            ('drawString', (70, height - 100, placeholder), {}),
+        ]
+
+    def _compile_first_page(self, company_settings):
+        height = self.height
+        company_name, company_email, company_address, _ = self.fingerprint
+        ops = self._compile_logo(company_settings.get('logo_path'))
+        company_y = height - 120
+        ops += [
+            # Company info
+            ('setFont', ("Helvetica-Bold", 12), {}),
+            ('drawString', (200, company_y, company_name), {}),
+            ('setFont', ("Helvetica", 10), {}),
+            ('drawString', (200, company_y - 15, company_email), {}),
+            ('drawString', (200, company_y - 30, company_address), {}),
+            # Invoice title and field labels
+            ('setFont', ("Helvetica-Bold", 24), {}),
+            ('drawString', (50, height - 180, "INVOICE"), {}),
+            ('setFont', ("Helvetica", 12), {}),
+            ('drawString', (50, height - 200, NUMBER_LABEL), {}),
+            ('drawString', (50, height - 220, DATE_LABEL), {}),
+            # Customer box
+            ('setStrokeColor', (colors.lightgrey,), {}),
+            ('rect', (50, height - 300, 250, 60), {}),
+            ('setFont', ("Helvetica-Bold", 10), {}),
+            ('drawString', (60, height - 250, "Bill To:"), {}),
+        ]
+        return ops
+
+    def _compile_footer(self):
+        x = self.width / 2 - stringWidth(FOOTER_TEXT, "Helvetica", 8) / 2
+        return [
+            ('setFont', ("Helvetica", 8), {}),
+            ('setFillColor', (colors.grey,), {}),
+            ('drawString', (x, 30, FOOTER_TEXT), {}),
+        ]
+
+    def _draw_logo(self, c, x, y, width, height):
+        if self.logo_image is None:
+            c.drawImage(self.logo_reader, x, y, width, height, mask='auto')
+            return
+        # What canvas.drawImage does, minus re-encoding the image data
+        image = self.logo_image
+        doc = c._doc
+        reg_name = doc.getXObjectName(image.name)
+        if doc.idToObject.get(reg_name) is None:
+            image = copy.copy(image)
+            c._setXObjects(image)
+            doc.Reference(image, reg_name)
+            doc.addForm(image.name, image)
+            smask = getattr(image, '_smask', None)
+            if smask is not None:
+                del image._smask
+                smask = copy.copy(smask)
+                c._setXObjects(smask)
+                image.smask = doc.Reference(smask, doc.getXObjectName(smask.name))
+        c._currentPageHasImages = 1
+        c.saveState()
+        c.translate(x, y)
+        c.scale(width, height)
+        c._code.append(f"/{reg_name} Do")
+        c.restoreState()
+        c._formsinuse.append(image.name)
+
+    def _place(self, c, name, ops):
+        if not c.hasForm(name):
+            c.beginForm(name)
+            for method, args, kwargs in ops:
+                if method == 'logo':
+                    self._draw_logo(c, *args)
+                else:
+                    getattr(c, method)(*args, **kwargs)
+            c.endForm()
+        c.doForm(name)
+
+    def draw_first_page(self, c, customer_info, invoice_number, issued):
+        height = self.height
+        self._place(c, self.first_page_form, self.first_page_ops)
+        c.setFont("Helvetica", 12)
+        c.drawString(self.number_x, height - 200, str(invoice_number))
+        c.drawString(self.date_x, height - 220, issued.strftime('%B %d, %Y'))
+        c.setFont("Helvetica", 10)
+        c.drawString(60, height - 265, customer_info.get('name') or "")
+        c.drawString(60, height - 280, customer_info.get('email') or "")
+        c.drawString(60, height - 295, customer_info.get('address') or "")
+
+    def draw_footer(self, c, page=None):
+        self._place(c, self.footer_form, self.footer_ops)
+        if page is not None:
+            c.setFont("Helvetica", 8)
+            c.setFillColor(colors.grey)
+            c.drawRightString(self.width - 50, 30, f"Page {page}")
+            c.setFillColor(colors.black)
+
+def encode_image(reader):
+    # The image XObject canvas.drawImage(reader, ..., mask='auto') would embed,
+    # encoded up front. It is copied, never modified, into each document.
+    rawdata = reader.getRGBData()
+    alpha = reader._dataA
+    mdata = alpha.getRGBData() if alpha else b'auto'
+    name = hashlib.md5(rawdata + mdata).hexdigest()
+    image = pdfdoc.PDFImageXObject(name, reader, mask='auto')
+    _deflate(image, rawdata)
+    smask = getattr(image, '_smask', None)
+    if smask is not None:
+        _deflate(smask, alpha.getRGBData())
+    return image
+
+def _deflate(xobject, rawdata):
+    if 'ASCII85Decode' in xobject._filters:
+        xobject.streamContent = zlib.compress(rawdata, 9)
+        xobject._filters = ('FlateDecode',)
+
+def get_template(company_settings):
+    # Compiled once per settings version (including the logo file's version)
+    key = fingerprint(company_settings)
+    with _lock:
+        template = _templates.get(key)
+    if template is None:
+        with tracing.span('render.template.compile'):
+            template = InvoiceTemplate(company_settings)
+        with _lock:
+            if len(_templates) >= MAX_TEMPLATES:
+                _templates.clear()
+            template = _templates.setdefault(key, template)
+    return template
+
+def clear():
+    with _lock:
+        _templates.clear()
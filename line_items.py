@@ -0,0 +1,158 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Exact money for invoice lines. Prices and quantities are kept as Decimal,
+# each line total is rounded once to whole cents, and the invoice total is an
+# integer number of cents kept up to date by deltas as single cells change.
+# The GUI total, the PDF and the draft autosave all read from the same
+# LineItems.
+
+# Prices and quantities of 10**16 or more are not numbers anyone bills, and
+# letting them through would overflow the Decimal context ('1e999999' in
+# both cells) or build enormous integers.
+MAX_EXPONENT = 15
+
+def parse_decimal(value):
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        number = Decimal(text)
+    except InvalidOperation:
+        return None
+    if not number.is_finite() or number.adjusted() > MAX_EXPONENT:
+        return None
+    return number
+
+def line_total_cents(price, quantity):
+    if price is None or quantity is None:
+        return None
+    return int((price * quantity * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+def format_cents(cents):
+    sign = "-" if cents < 0 else ""
+    whole, frac = divmod(abs(cents), 100)
+    return f"{sign}{whole}.{frac:02d}"
+
+def format_price(price):
+    return format_cents(int((price * 100).to_integral_value(rounding=ROUND_HALF_UP)))
+
+def format_quantity(quantity):
+    # Same text the invoice table has always shown (str of a float, e.g. "2.0").
+    return str(float(quantity))
+
+class LineItem:
+    __slots__ = ('name', 'price', 'quantity', 'total_cents')
+
+    def __init__(self, name="", price=None, quantity=None):
+        self.name = name or ""
+        self.price = price
+        self.quantity = quantity
+        self.total_cents = line_total_cents(price, quantity)
+
+class LineItems:
+    def __init__(self):
+        self._lines = {}
+        # (key, 'price'|'quantity') -> typed text that str() of the parsed
+        # value would not give back, so a restored draft shows it unchanged
+        self._text = {}
+        self._next_key = 0
+        self.total_cents = 0
+
+    @classmethod
+    def from_rows(cls, rows):
+        # rows: iterable of (name, price, quantity) as text or numbers
+        items = cls()
+        for name, price, quantity in rows:
+            key = items.add(name)
+            items.set_price(key, price)
+            items.set_quantity(key, quantity)
+        return items
+
+    def copy(self):
+        # Detached snapshot, e.g. to hand to a render thread.
+        items = LineItems()
+        for key, line in self._lines.items():
+            items._lines[key] = LineItem(line.name, line.price, line.quantity)
+        items._text = dict(self._text)
+        items._next_key = self._next_key
+        items.total_cents = self.total_cents
+        return items
+
+    def __len__(self):
+        return len(self._lines)
+
+    def keys(self):
+        return list(self._lines)
+
+    def add(self, name=""):
+        key = self._next_key
+        self._next_key += 1
+        self._lines[key] = LineItem(name)
+        return key
+
+    def remove(self, key):
+        line = self._lines.pop(key, None)
+        if line is not None and line.total_cents is not None:
+            self.total_cents -= line.total_cents
+        self._text.pop((key, 'price'), None)
+        self._text.pop((key, 'quantity'), None)
+
+    def clear(self):
+        self._lines.clear()
+        self._text.clear()
+        self.total_cents = 0
+
+    def _recompute(self, line):
+        old = line.total_cents
+        line.total_cents = line_total_cents(line.price, line.quantity)
+        self.total_cents += (line.total_cents or 0) - (old or 0)
+
+    def set_name(self, key, name):
+        self._lines[key].name = name or ""
+
+    def _keep_text(self, key, field, value, number):
+        text = None if value is None else str(value)
+        if text and (number is None or str(number) != text):
+            self._text[(key, field)] = text
+        elif self._text:
+            self._text.pop((key, field), None)
+
+    def set_price(self, key, value):
+        line = self._lines[key]
+        line.price = parse_decimal(value)
+        self._keep_text(key, 'price', value, line.price)
+        self._recompute(line)
+
+    def set_quantity(self, key, value):
+        line = self._lines[key]
+        line.quantity = parse_decimal(value)
+        self._keep_text(key, 'quantity', value, line.quantity)
+        self._recompute(line)
+
+    def get(self, key):
+        return self._lines[key]
+
+    def text(self, key):
+        # (name, price text, quantity text) as the item row should show them
+        line = self._lines[key]
+        return (line.name,
+                self._text.get((key, 'price'), "" if line.price is None else str(line.price)),
+                self._text.get((key, 'quantity'), "" if line.quantity is None else str(line.quantity)))
+
+    def rows(self):
+        # Plain (name, price text, quantity text) rows, e.g. for saving a
+        # draft; LineItems.from_rows(items.rows()) gives the same lines back.
+        return [self.text(key) for key in self._lines]
+
+    def lines(self):
+        return iter(self._lines.values())
+
+    def billable(self):
+        # Lines with both a valid price and quantity; these make up the total.
+        return (line for line in self._lines.values() if line.total_cents is not None)
+
+    @property
+    def total(self):
+        return Decimal(self.total_cents).scaleb(-2)
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import threading
+import tracing
+
+# Decoded company logos shared across renders, keyed by (path, mtime, size)
+# so editing or replacing the file is picked up on the next render.
+#
+# The logo box on the invoice is at most 100x50pt, so images much larger
+# than that are downsampled once to LOGO_PIXELS_PER_POINT (288 dpi); this is
+# what makes repeated renders cheap, since ReportLab hashes and compresses
+# the full pixel data of every image it embeds.
+
+LOGO_BOX = (100, 50)
+LOGO_PIXELS_PER_POINT = 4
+
+class LogoAsset:
+    __slots__ = ('path', 'reader', 'draw_width', 'draw_height', 'pixel_size')
+
+    def __init__(self, path, reader, draw_width, draw_height, pixel_size):
+        self.path = path
+        self.reader = reader
+        self.draw_width = draw_width
+        self.draw_height = draw_height
+        self.pixel_size = pixel_size
+
+_lock = threading.Lock()
+_assets = {}
+_previews = {}
+_digests = {}
+
+def cache_key(path):
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+def draw_size(pixel_width, pixel_height):
+    # Same fitting rule the invoice has always used for the 100x50 box.
+    aspect = pixel_width / pixel_height
+    if aspect > 2:  # wider than 2:1
+        return LOGO_BOX[0], LOGO_BOX[1]
+    return int(LOGO_BOX[1] * aspect), LOGO_BOX[1]
+
+@tracing.traced('logo.decode')
+def _load(path):
+    # PIL and ReportLab are only needed once something is rendered
+    from PIL import Image as PILImage
+    from reportlab.lib.utils import ImageReader
+    image = PILImage.open(path)
+    image.load()
+    draw_width, draw_height = draw_size(*image.size)
+    max_size = (draw_width * LOGO_PIXELS_PER_POINT, draw_height * LOGO_PIXELS_PER_POINT)
+    if image.width > max_size[0] or image.height > max_size[1]:
+        image = image.resize(max_size, PILImage.LANCZOS)
+    reader = ImageReader(image)
+    # Decode now, once, rather than on the first (possibly concurrent) render
+    reader.getRGBData()
+    return LogoAsset(path, reader, draw_width, draw_height, image.size)
+
+def get_logo(path):
+    # Raises OSError (or a PIL error) if the file is missing or unreadable.
+    key = cache_key(path)
+    with _lock:
+        asset = _assets.get(key)
+        if asset is None:
+            asset = _load(path)
+            # Only the current version of each file is worth keeping
+            for old in [k for k in _assets if k[0] == key[0]]:
+                del _assets[old]
+            _assets[key] = asset
+    return asset
+
+def file_digest(path):
+    # sha256 of the file's bytes, hashed once per version of the file; used
+    # where the logo's content matters rather than its path (render_cache).
+    key = cache_key(path)
+    with _lock:
+        digest = _digests.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with _lock:
+            for old in [k for k in _digests if k[0] == key[0]]:
+                del _digests[old]
+            _digests[key] = digest
+    return digest
+
+def get_preview(path, width, height, factory):
+    # Cached GUI preview (e.g. a scaled QPixmap) built by factory(path, width,
+    # height); kept here so the GUI and the renderer share one invalidation rule.
+    key = cache_key(path) + (width, height)
+    with _lock:
+        preview = _previews.get(key)
+    if preview is None:
+        preview = factory(path, width, height)
+        with _lock:
+            for old in [k for k in _previews if k[0] == key[0]]:
+                del _previews[old]
+            _previews[key] = preview
+    return preview
+
+def clear():
+    with _lock:
+        _assets.clear()
+        _previews.clear()
+        _digests.clear()
@@ -0,0 +1,243 @@
+from PyQt6.QtCore import (Qt, QAbstractTableModel, QAbstractListModel, QAbstractProxyModel,
+                          QModelIndex, pyqtSignal)
+import products_db
+import product_search
+import tracing
+
+PRICE_ROLE = Qt.ItemDataRole.UserRole + 1
+PRODUCT_ID_ROLE = Qt.ItemDataRole.UserRole + 2
+
+class ProductTableModel(QAbstractTableModel):
+    # Pages products in from SQLite as the view scrolls (canFetchMore/fetchMore),
+    # so opening the dialog costs one page no matter how big the catalog is.
+    # Edits are written straight back with products_db.update_product.
+    PAGE_SIZE = 200
+    HEADERS = ("ID", "Name", "Description", "Price")
+
+    editRejected = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows = []
+        self._exhausted = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        value = self._rows[index.row()][index.column()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            if index.column() == 0:
+                return f"#{value}"
+            if index.column() == 3:
+                return f"${value:.2f}"
+            return value or ""
+        if role == Qt.ItemDataRole.EditRole:
+            return str(value) if index.column() == 3 else (value or "")
+        if role == Qt.ItemDataRole.TextAlignmentRole and index.column() == 3:
+            return int(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+        return None
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.isValid() and index.column() > 0:
+            flags |= Qt.ItemFlag.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid() or role != Qt.ItemDataRole.EditRole:
+            return False
+        row = list(self._rows[index.row()])
+        column = index.column()
+        if column == 1:
+            value = value.strip()
+            if not value:
+                self.editRejected.emit("Product name is required.")
+                return False
+        elif column == 3:
+            try:
+                value = float(value)
+            except ValueError:
+                self.editRejected.emit("Please enter a valid price.")
+                return False
+        row[column] = value
+        products_db.update_product(*row)
+        self._rows[index.row()] = tuple(row)
+        self.dataChanged.emit(index, index)
+        return True
+
+    def product_at(self, row):
+        return self._rows[row]
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    @tracing.traced('ui.product_table.fetch_more')
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        after_id = self._rows[-1][0] if self._rows else 0
+        page = products_db.get_products_page(after_id, self.PAGE_SIZE)
+        if len(page) < self.PAGE_SIZE:
+            self._exhausted = True
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(page) - 1)
+            self._rows.extend(page)
+            self.endInsertRows()
+
+    @tracing.traced('ui.product_table.refresh')
+    def refresh(self):
+        self.beginResetModel()
+        self._rows = []
+        self._exhausted = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def update_row(self, row, product):
+        self._rows[row] = tuple(product)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.HEADERS) - 1))
+
+class ProductListModel(QAbstractListModel):
+    # One model over products_db.catalog shared by every invoice row's combo
+    # box and completer. It holds the catalog's snapshot tuple rather than a
+    # copy, and applies catalog changes as row inserts/dataChanged so the
+    # rows keep their current selection.
+    catalogChanged = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows = ()
+        self._row_of = None
+        self._pending = False
+        self.catalogChanged.connect(self.sync, Qt.ConnectionType.QueuedConnection)
+        products_db.catalog.add_listener(self._schedule_sync)
+
+    def _schedule_sync(self):
+        # May be called from any thread; the queued signal coalesces a burst
+        # of catalog writes into one sync on the model's thread.
+        if not self._pending:
+            self._pending = True
+            self.catalogChanged.emit()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        pid, name, desc, price = self._rows[index.row()]
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return f"#{pid}: {name}"
+        if role == PRICE_ROLE:
+            return price
+        if role == PRODUCT_ID_ROLE:
+            return pid
+        return None
+
+    def product_at(self, row):
+        if 0 <= row < len(self._rows):
+            return self._rows[row]
+        return None
+
+    def row_of(self, product_id):
+        if self._row_of is None:
+            self._row_of = {product[0]: row for row, product in enumerate(self._rows)}
+        return self._row_of.get(product_id)
+
+    @tracing.traced('ui.product_list.sync')
+    def sync(self):
+        self._pending = False
+        old = self._rows
+        new = products_db.catalog.products()
+        if new is old:
+            return
+        self._row_of = None
+        # Products are only ever added or edited, so the old rows are normally
+        # a prefix (by id) of the new ones; anything else falls back to a reset.
+        if len(new) < len(old) or any(o[0] != n[0] for o, n in zip(old, new)):
+            self.beginResetModel()
+            self._rows = new
+            self.endResetModel()
+            return
+        changed = [i for i, (o, n) in enumerate(zip(old, new)) if o != n]
+        if len(new) > len(old):
+            self.beginInsertRows(QModelIndex(), len(old), len(new) - 1)
+            self._rows = new
+            self.endInsertRows()
+        else:
+            self._rows = new
+        if changed:
+            self.dataChanged.emit(self.index(changed[0]), self.index(changed[-1]))
+
+class ProductSuggestionModel(QAbstractProxyModel):
+    # Ranked product_search results for the text being typed, exposed as a
+    # proxy over the shared ProductListModel so that a completer pick maps
+    # straight back to the combo box's own row.
+    def __init__(self, source, parent=None):
+        super().__init__(parent)
+        self._source_rows = []
+        self.setSourceModel(source)
+        source.modelReset.connect(self.clear)
+
+    @tracing.traced('ui.suggestions.set_query')
+    def set_query(self, text):
+        source = self.sourceModel()
+        rows = [source.row_of(product[0]) for product in product_search.search(text)]
+        self.beginResetModel()
+        self._source_rows = [row for row in rows if row is not None]
+        self.endResetModel()
+
+    def clear(self):
+        self.beginResetModel()
+        self._source_rows = []
+        self.endResetModel()
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or column != 0 or not 0 <= row < len(self._source_rows):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._source_rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 1
+
+    def mapToSource(self, proxy_index):
+        if not proxy_index.isValid():
+            return QModelIndex()
+        return self.sourceModel().index(self._source_rows[proxy_index.row()], 0)
+
+    def mapFromSource(self, source_index):
+        if source_index.isValid() and source_index.row() in self._source_rows:
+            return self.index(self._source_rows.index(source_index.row()), 0)
+        return QModelIndex()
+
+_shared_product_model = None
+_shared_suggestion_model = None
+
+def shared_product_model():
+    global _shared_product_model
+    if _shared_product_model is None:
+        _shared_product_model = ProductListModel()
+        _shared_product_model.sync()
+    return _shared_product_model
+
+def shared_suggestion_model():
+    global _shared_suggestion_model
+    if _shared_suggestion_model is None:
+        _shared_suggestion_model = ProductSuggestionModel(shared_product_model())
+    return _shared_suggestion_model
@@ -0,0 +1,56 @@
+import products_db
+import text_search
+import tracing
+
+# Product lookup for typed item entry:
+#  - find_exact(): O(1) case-insensitive match on "name" or "#id: name",
+#    served from a dict built once per catalog snapshot;
+#  - search(): ranked prefix/substring suggestions over name and description
+#    from a text_search.TextIndex.
+
+SEARCH_LIMIT = 20
+
+_index = text_search.TextIndex(
+    'products', 'product_id', ('product_id', 'name', 'description', 'price'),
+    ('name', 'description'))
+
+_exact_source = None
+_exact_map = {}
+
+@tracing.traced('product_search.ensure_index')
+def ensure_index():
+    # Returns 'trigram', 'unicode61' or None (no FTS5 in this SQLite build).
+    with products_db.transaction() as conn:
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_products_name_nocase ON products(name COLLATE NOCASE)")
+    return _index.ensure()
+
+def _exact_lookup_map():
+    global _exact_source, _exact_map
+    products = products_db.catalog.products()
+    if products is not _exact_source:
+        exact = {}
+        for product in products:
+            pid, name = product[0], product[1]
+            exact.setdefault(f"#{pid}: {name}".lower(), product)
+            exact.setdefault(name.lower(), product)
+        _exact_source, _exact_map = products, exact
+    return _exact_map
+
+@tracing.traced('product_search.find_exact')
+def find_exact(text):
+    return _exact_lookup_map().get(text.strip().lower())
+
+@tracing.traced('product_search.search')
+def search(text, limit=SEARCH_LIMIT):
+    # Ranked: exact name, then name prefix (alphabetical), then other
+    # name/description substring matches. Every step is an index probe
+    # bounded by ``limit``, so latency does not grow with the catalog.
+    text = text.strip()
+    if text.startswith('#') and ':' in text:
+        text = text.split(':', 1)[1].strip()
+    if not text:
+        return []
+    if _index.db != products_db.get_db_path():
+        ensure_index()
+    return _index.search(text, limit)
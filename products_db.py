@@ -1,63 +1,426 @@
+import argparse
+import csv
+import json
+import math
 import sqlite3
 import os
+import sys
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+import tracing
+
+# One long-lived connection per thread (and per process, so forked batch
+# workers never reuse their parent's handle), closed when the thread's
+# locals are released: when the thread ends or, on Qt pool threads, after
+# each task. Connections run in autocommit mode; writes go through
+# transaction() so each one is a single explicit BEGIN/COMMIT.
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+STATEMENT_CACHE_SIZE = 256
+BUSY_TIMEOUT = 30
+
+_db_path = None
+_generation = 0
+_local = threading.local()
+_connections_lock = threading.Lock()
+_connections = weakref.WeakSet()
 
 def get_db_path():
-    db_dir = os.path.expanduser("~/Documents/invoices")
-    os.makedirs(db_dir, exist_ok=True)
-    return os.path.join(db_dir, "products.db")
+    global _db_path
+    if _db_path is None:
+        db_dir = os.path.expanduser("~/Documents/invoices")
+        os.makedirs(db_dir, exist_ok=True)
+        _db_path = os.path.join(db_dir, "products.db")
+    return _db_path
+
+def set_db_path(path):
+    # Point every later call at another database file (tests, batch jobs).
+    global _db_path
+    close_connections()
+    _db_path = path
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                           check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+class _ThreadConnection:
+    # Only its thread's _local refers to this, so when that goes the
+    # finalizer closes the connection.
+    def __init__(self, conn, key):
+        self.conn = conn
+        self.key = key
+        weakref.finalize(self, _close_quietly, conn)
+
+def get_connection():
+    key = (get_db_path(), os.getpid(), _generation)
+    held = getattr(_local, 'held', None)
+    if held is not None and held.key == key:
+        return held.conn
+    held = _ThreadConnection(_connect(key[0]), key)
+    _local.held = held
+    with _connections_lock:
+        _connections.add(held)
+    return held.conn
+
+def close_connections():
+    global _generation
+    with _connections_lock:
+        _generation += 1
+        held = list(_connections)
+        _connections.clear()
+    for connection in held:
+        _close_quietly(connection.conn)
+    catalog.invalidate()
+
+@contextmanager
+def transaction(immediate=False):
+    # Nested use joins the outer transaction.
+    conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+class ProductCatalog:
+    # Process-wide in-memory copy of the products table. add_product and
+    # update_product patch it in place; writes from other connections or
+    # processes are noticed through product_changes.version, which triggers
+    # bump on every change to products (and nothing else, unlike PRAGMA
+    # data_version, which every invoice or number reservation changes too),
+    # so a cache hit is a one-row read.
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._rows = None
+        self._snapshot = None
+        self._version = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        # callback() runs after the cached rows change or are invalidated.
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _notify(self):
+        for callback in list(self._listeners):
+            callback()
+
+    @tracing.traced('products_db.catalog.load')
+    def _load(self, conn, version):
+        reloaded = self._rows is not None
+        rows = conn.execute(
+            'SELECT product_id, name, description, price FROM products ORDER BY product_id').fetchall()
+        self._rows = {row[0]: row for row in rows}
+        self._snapshot = None
+        self._version = version
+        if reloaded:
+            self._notify()
+
+    def _ensure_fresh(self):
+        conn = get_connection()
+        # Read before the rows, so a write landing in between only costs
+        # another reload
+        version = _change_version(conn)
+        if self._rows is None or self._version != version:
+            self._load(conn, version)
+
+    def products(self):
+        with self._lock:
+            self._ensure_fresh()
+            if self._snapshot is None:
+                self._snapshot = tuple(self._rows.values())
+            return self._snapshot
+
+    def get(self, product_id):
+        with self._lock:
+            self._ensure_fresh()
+            return self._rows.get(product_id)
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = None
+            self._snapshot = None
+            self._version = None
+        self._notify()
 
+    def _patch(self, row, version):
+        # version: product_changes.version right after this write; if the
+        # cache was current just before it, it still is
+        with self._lock:
+            if self._rows is not None:
+                self._rows[row[0]] = row
+                self._snapshot = None
+                if self._version == version - 1:
+                    self._version = version
+        self._notify()
+
+catalog = ProductCatalog()
+
+def _change_version(conn):
+    return conn.execute("SELECT version FROM product_changes").fetchone()[0]
+
+@tracing.traced('products_db.init_db')
 def init_db():
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            product_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            price REAL NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS products (
+                product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                description TEXT,
+                price REAL NOT NULL
+            )
+        ''')
+        # sku identifies products synced from an external price list
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(products)")]
+        if 'sku' not in columns:
+            conn.execute("ALTER TABLE products ADD COLUMN sku TEXT")
+        conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products(sku) WHERE sku IS NOT NULL")
+        # Bumped by every change to products, for the catalog cache
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS product_changes (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        ''')
+        conn.execute("INSERT OR IGNORE INTO product_changes (id, version) VALUES (1, 0)")
+        _create_change_triggers(conn)
+
+_CHANGE_EVENTS = ('insert', 'update', 'delete')
+
+def _create_change_triggers(conn):
+    for event in _CHANGE_EVENTS:
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS products_changes_{event} AFTER {event.upper()} ON products
+            BEGIN
+                UPDATE product_changes SET version = version + 1;
+            END
+        ''')
 
+@tracing.traced('products_db.add_product')
 def add_product(name, description, price):
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO products (name, description, price)
-        VALUES (?, ?, ?)
-    ''', (name, description, price))
-    conn.commit()
-    product_id = c.lastrowid
-    conn.close()
+    with transaction() as conn:
+        c = conn.execute('''
+            INSERT INTO products (name, description, price)
+            VALUES (?, ?, ?)
+        ''', (name, description, price))
+        product_id = c.lastrowid
+        version = _change_version(conn)
+    catalog._patch((product_id, name, description, price), version)
     return product_id
 
+@tracing.traced('products_db.get_products')
 def get_products():
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT product_id, name, description, price FROM products')
-    products = c.fetchall()
-    conn.close()
-    return products
+    return list(catalog.products())
 
+@tracing.traced('products_db.get_products_page')
+def get_products_page(after_id=0, limit=200):
+    # Keyset paging: the primary key index makes every page O(limit).
+    return get_connection().execute(
+        'SELECT product_id, name, description, price FROM products '
+        'WHERE product_id > ? ORDER BY product_id LIMIT ?', (after_id, limit)).fetchall()
+
+@tracing.traced('products_db.get_product')
 def get_product(product_id):
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT product_id, name, description, price FROM products WHERE product_id=?', (product_id,))
-    product = c.fetchone()
-    conn.close()
-    return product
+    return get_connection().execute(
+        'SELECT product_id, name, description, price FROM products WHERE product_id=?',
+        (product_id,)).fetchone()
 
+@tracing.traced('products_db.update_product')
 def update_product(product_id, name, description, price):
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('''
-        UPDATE products SET name=?, description=?, price=? WHERE product_id=?
-    ''', (name, description, price, product_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        c = conn.execute('''
+            UPDATE products SET name=?, description=?, price=? WHERE product_id=?
+        ''', (name, description, price, product_id))
+        updated = c.rowcount
+        version = _change_version(conn)
+    if updated:
+        catalog._patch((product_id, name, description, price), version)
+
+# Bulk import/export. Input is streamed and written in batches of
+# IMPORT_BATCH_SIZE rows, each batch one transaction with executemany.
+# Rows are matched on sku when present, then on product_id, otherwise inserted.
+
+IMPORT_BATCH_SIZE = 5000
+EXPORT_FIELDS = ('product_id', 'sku', 'name', 'description', 'price')
+
+_UPSERT_BY_SKU = '''
+    INSERT INTO products (sku, name, description, price) VALUES (?, ?, ?, ?)
+    ON CONFLICT(sku) WHERE sku IS NOT NULL DO UPDATE SET
+        name=excluded.name, description=excluded.description, price=excluded.price
+'''
+_UPSERT_BY_ID = '''
+    INSERT INTO products (product_id, name, description, price) VALUES (?, ?, ?, ?)
+    ON CONFLICT(product_id) DO UPDATE SET
+        name=excluded.name, description=excluded.description, price=excluded.price
+'''
+_INSERT = '''
+    INSERT INTO products (name, description, price) VALUES (?, ?, ?)
+'''
+
+def read_product_file(path):
+    if path.lower().endswith('.csv'):
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+@tracing.traced('products_db.flush_import')
+def _flush_import(by_sku, by_id, plain):
+    with transaction() as conn:
+        # One version bump per batch rather than one per row; the triggers
+        # are back before anyone else can see the batch
+        for event in _CHANGE_EVENTS:
+            conn.execute(f"DROP TRIGGER IF EXISTS products_changes_{event}")
+        if by_sku:
+            conn.executemany(_UPSERT_BY_SKU, by_sku)
+        if by_id:
+            conn.executemany(_UPSERT_BY_ID, by_id)
+        if plain:
+            conn.executemany(_INSERT, plain)
+        conn.execute("UPDATE product_changes SET version = version + 1")
+        _create_change_triggers(conn)
+
+def _text(value):
+    return '' if value is None else str(value)
+
+@tracing.traced('products_db.import_products')
+def import_products(rows, batch_size=IMPORT_BATCH_SIZE):
+    start = time.perf_counter()
+    imported = skipped = 0
+    by_sku, by_id, plain = [], [], []
+    try:
+        for row in rows:
+            # Like customer imports, rows that cannot be stored (not an
+            # object, no name, a price that is not a finite number or a
+            # product_id that is not an integer) are skipped, not fatal
+            try:
+                if not isinstance(row, dict):
+                    raise ValueError(row)
+                name = _text(row.get('name')).strip()
+                price = float(row.get('price'))
+                product_id = row.get('product_id') or None
+                if product_id is not None:
+                    product_id = int(product_id)
+            except (TypeError, ValueError):
+                name = None
+            if not name or not math.isfinite(price):
+                skipped += 1
+                continue
+            description = _text(row.get('description'))
+            sku = _text(row.get('sku')) or None
+            if sku:
+                by_sku.append((sku, name, description, price))
+            elif product_id:
+                by_id.append((product_id, name, description, price))
+            else:
+                plain.append((name, description, price))
+            imported += 1
+            if len(by_sku) + len(by_id) + len(plain) >= batch_size:
+                _flush_import(by_sku, by_id, plain)
+                by_sku, by_id, plain = [], [], []
+        if by_sku or by_id or plain:
+            _flush_import(by_sku, by_id, plain)
+    finally:
+        catalog.invalidate()
+    elapsed = time.perf_counter() - start
+    return {
+        'imported': imported,
+        'skipped': skipped,
+        'elapsed_s': elapsed,
+        'rows_per_s': imported / elapsed if elapsed > 0 else 0.0,
+    }
+
+def iter_products(batch_size=IMPORT_BATCH_SIZE):
+    # Stream rows with fetchmany so the table is never loaded whole.
+    cursor = get_connection().execute(
+        'SELECT product_id, sku, name, description, price FROM products ORDER BY product_id')
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+@tracing.traced('products_db.export_products')
+def export_products(f, fmt='csv'):
+    start = time.perf_counter()
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_FIELDS)
+        for row in iter_products():
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in iter_products():
+            f.write(json.dumps(dict(zip(EXPORT_FIELDS, row))) + "\n")
+            count += 1
+    elapsed = time.perf_counter() - start
+    return {
+        'exported': count,
+        'elapsed_s': elapsed,
+        'rows_per_s': count / elapsed if elapsed > 0 else 0.0,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import or export the product catalog.")
+    parser.add_argument('--db', help="database file (default: ~/Documents/invoices/products.db)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    import_cmd = sub.add_parser('import', help="upsert products from a CSV or JSONL file")
+    import_cmd.add_argument('path')
+    import_cmd.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    export_cmd = sub.add_parser('export', help="write all products as CSV or JSONL")
+    export_cmd.add_argument('path', help="output file, or - for stdout")
+    export_cmd.add_argument('--format', choices=('csv', 'jsonl'),
+                            help="default: taken from the file extension, else csv")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        set_db_path(args.db)
+    init_db()
+    if args.command == 'import':
+        stats = import_products(read_product_file(args.path), batch_size=args.batch_size)
+        print(f"Imported {stats['imported']} products ({stats['skipped']} skipped) in "
+              f"{stats['elapsed_s']:.2f}s, {stats['rows_per_s']:.0f} rows/s", file=sys.stderr)
+    else:
+        fmt = args.format or ('jsonl' if args.path.lower().endswith('.jsonl') else 'csv')
+        if args.path == '-':
+            stats = export_products(sys.stdout, fmt)
+        else:
+            with open(args.path, 'w', encoding='utf-8', newline='') as f:
+                stats = export_products(f, fmt)
+        print(f"Exported {stats['exported']} products in {stats['elapsed_s']:.2f}s, "
+              f"{stats['rows_per_s']:.0f} rows/s", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
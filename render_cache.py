@@ -0,0 +1,119 @@
+import os
+import tempfile
+import threading
+import tracing
+
+# Content-addressed store for rendered PDFs: the key is a hash of everything
+# the document shows (see invoice_renderer.invoice_digest), so an identical
+# request is answered by copying bytes instead of running ReportLab again.
+#
+# Entries are plain files, <dir>/<key[:2]>/<key>.pdf, written to a temporary
+# name and renamed into place, so several processes (batch workers, render
+# service workers) can share one directory. Reads refresh an entry's mtime;
+# once the directory grows past max_bytes the least recently used entries
+# are deleted until it is back under LOW_WATER of the limit.
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+LOW_WATER = 0.8
+
+def default_cache_dir():
+    return os.path.join(os.path.expanduser("~/Documents/invoices"), ".render_cache")
+
+class RenderCache:
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        # Other processes write here too; this is only this process's view,
+        # corrected by the scan each eviction does
+        self._size = sum(size for _, _, size in self._entries())
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.pdf")
+
+    def _entries(self):
+        # (mtime, path, size) of every entry
+        entries = []
+        with os.scandir(self.directory) as shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as files:
+                    for entry in files:
+                        if entry.name.endswith('.pdf'):
+                            try:
+                                st = entry.stat()
+                            except OSError:
+                                continue
+                            entries.append((st.st_mtime_ns, entry.path, st.st_size))
+        return entries
+
+    @tracing.traced('render_cache.get')
+    def get(self, key):
+        # The cached bytes, or None.
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            # Missing, or evicted by another process between open and utime
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    @tracing.traced('render_cache.put')
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._size += len(data)
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    @tracing.traced('render_cache.evict')
+    def evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        target = int(self.max_bytes * LOW_WATER)
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        with self._lock:
+            self._size = total
+
+    def size(self):
+        return self._size
+
+    def clear(self):
+        for _, path, _ in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._size = 0
@@ -0,0 +1,451 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import batch_invoices
+import invoice_numbers
+import invoice_renderer
+import invoice_store
+import products_db
+import render_cache
+import schema
+
+# Local render service for other tools: python render_service.py --port 8765
+#
+#   POST /invoices              invoice JSON in, PDF bytes out
+#   POST /invoices?output=path  PDF written to the output directory and
+#                               recorded in the invoice history; JSON out
+#                               (409 if its invoice_number already is)
+#   GET  /health                status, queue depth and worker count
+#   GET  /metrics               Prometheus text format
+#
+# The request body is one invoice as in batch_invoices' JSONL input:
+#   {"customer": {...}, "items": [{"name", "price", "quantity"}, ...],
+#    "invoice_number": optional}
+#
+# Requests wait on a bounded queue served by a pool of render processes.
+# When the queue is full the service answers 503 with Retry-After at once,
+# rather than letting callers pile up. With --cache-dir, a request repeating
+# an earlier one (same invoice_number and contents) is answered from the
+# render cache. Binds to localhost (or a Unix socket
+# with --unix) and has no authentication; it is not meant to be exposed.
+
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE_SIZE = 64
+MAX_BODY = 16 * 1024 * 1024
+MAX_HEADER = 64 * 1024
+RETRY_AFTER = 1
+# Render latency histogram bounds in seconds, as Prometheus expects
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict',
+    413: 'Payload Too Large', 431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+class BadRequest(Exception):
+    pass
+
+# Render worker processes
+
+_worker_settings = {}
+_worker_output_dir = None
+_worker_numbers = None
+_worker_cache = None
+
+def _init_worker(settings, output_dir, db_path, number_format, cache_dir=None,
+                 cache_size=render_cache.DEFAULT_MAX_BYTES):
+    global _worker_settings, _worker_output_dir, _worker_numbers, _worker_cache
+    _worker_settings = settings
+    _worker_output_dir = output_dir
+    if db_path != products_db.get_db_path():
+        products_db.set_db_path(db_path)
+    _worker_numbers = invoice_numbers.NumberAllocator(fmt=number_format)
+    _worker_cache = render_cache.RenderCache(cache_dir, cache_size) if cache_dir else None
+
+def render_request(record, store):
+    # Returns (invoice_number, total_cents, pdf bytes or the stored path,
+    # whether it came from the render cache).
+    invoice_number = record.get('invoice_number') or _worker_numbers.next_number()
+    hits = _worker_cache.hits if _worker_cache else 0
+    if not store:
+        result, total = invoice_renderer.render_invoice_bytes(
+            _worker_settings, record['customer'], record['items'], invoice_number=invoice_number,
+            cache=_worker_cache)
+    else:
+        issued = datetime.now()
+        pdf, total = invoice_renderer.render_invoice_bytes(
+            _worker_settings, record['customer'], record['items'], invoice_number=invoice_number,
+            issued=issued, cache=_worker_cache)
+        # Refuses numbers already in the history (DuplicateInvoice, a 409),
+        # atomically with recording this one
+        filename = invoice_renderer.invoice_filename(_worker_output_dir, invoice_number)
+        _, result = invoice_store.record_new_invoice(
+            invoice_number, issued, record['customer'], record['items'], total,
+            write_pdf=lambda: invoice_renderer.write_new_file(filename, pdf))
+    cached = bool(_worker_cache) and _worker_cache.hits > hits
+    return invoice_number, total, result, cached
+
+def _is_scalar(value):
+    return value is None or isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+def parse_invoice(body):
+    try:
+        data = json.loads(body)
+    except ValueError as e:
+        raise BadRequest(f"invalid JSON: {e}")
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list):
+        raise BadRequest("expected an object with an items list")
+    customer = data.get('customer') or {}
+    if not isinstance(customer, dict):
+        raise BadRequest("customer must be an object")
+    for field in ('name', 'email', 'address'):
+        if not isinstance(customer.get(field) or '', str):
+            raise BadRequest(f"customer {field} must be a string")
+    for item in data['items']:
+        if not isinstance(item, dict) and not (isinstance(item, list) and len(item) == 3):
+            raise BadRequest("each item needs a name, price and quantity")
+    record = batch_invoices.make_record(data)
+    for name, price, quantity in record['items']:
+        if not isinstance(name or '', str) or not _is_scalar(price) or not _is_scalar(quantity):
+            raise BadRequest("item names must be strings, prices and quantities strings or numbers")
+    number = record['invoice_number']
+    if number is not None:
+        if not _is_scalar(number) or isinstance(number, float):
+            raise BadRequest("invoice_number must be a string")
+        record['invoice_number'] = str(number)
+    return record
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.requests = {}
+        self.rendered = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cache_hits = 0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_count = 0
+        self.latency_sum = 0.0
+
+    def request(self, path, status):
+        key = (path, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+    def render_time(self, seconds):
+        self.latency_count += 1
+        self.latency_sum += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.latency_buckets[i] += 1
+
+    def format(self, queued, in_flight, workers, queue_size):
+        lines = [
+            "# TYPE invoice_service_requests_total counter",
+            *(f'invoice_service_requests_total{{path="{path}",status="{status}"}} {count}'
+              for (path, status), count in sorted(self.requests.items())),
+            "# TYPE invoice_service_rendered_total counter",
+            f"invoice_service_rendered_total {self.rendered}",
+            "# TYPE invoice_service_failed_total counter",
+            f"invoice_service_failed_total {self.failed}",
+            "# TYPE invoice_service_rejected_total counter",
+            f"invoice_service_rejected_total {self.rejected}",
+            "# TYPE invoice_service_cache_hits_total counter",
+            f"invoice_service_cache_hits_total {self.cache_hits}",
+            "# TYPE invoice_service_queue_depth gauge",
+            f"invoice_service_queue_depth {queued}",
+            "# TYPE invoice_service_queue_capacity gauge",
+            f"invoice_service_queue_capacity {queue_size}",
+            "# TYPE invoice_service_in_flight gauge",
+            f"invoice_service_in_flight {in_flight}",
+            "# TYPE invoice_service_workers gauge",
+            f"invoice_service_workers {workers}",
+            "# TYPE invoice_service_uptime_seconds gauge",
+            f"invoice_service_uptime_seconds {time.time() - self.started:.3f}",
+            "# TYPE invoice_service_render_seconds histogram",
+            *(f'invoice_service_render_seconds_bucket{{le="{bound:g}"}} {count}'
+              for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets)),
+            f'invoice_service_render_seconds_bucket{{le="+Inf"}} {self.latency_count}',
+            f"invoice_service_render_seconds_sum {self.latency_sum:.6f}",
+            f"invoice_service_render_seconds_count {self.latency_count}",
+        ]
+        return "\n".join(lines) + "\n"
+
+class RenderService:
+    def __init__(self, settings, output_dir, workers=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 number_format=None, cache_dir=None, cache_size=render_cache.DEFAULT_MAX_BYTES):
+        self.settings = settings
+        self.output_dir = output_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.number_format = (number_format or settings.get('invoice_number_format')
+                              or invoice_numbers.DEFAULT_FORMAT)
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.metrics = Metrics()
+        self.queue = asyncio.Queue(queue_size)
+        self.in_flight = 0
+        self._pool = None
+        self._tasks = []
+
+    async def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        schema.ensure_schema()
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker,
+            initargs=(self.settings, self.output_dir, products_db.get_db_path(), self.number_format,
+                      self.cache_dir, self.cache_size))
+        # One consumer per process, so the queue (not the executor's own
+        # unbounded backlog) is where requests wait
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while not self.queue.empty():
+            _, _, future = self.queue.get_nowait()
+            if not future.done():
+                future.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            record, store, future = await self.queue.get()
+            if future.done():
+                # The client gave up while it was queued
+                continue
+            self.in_flight += 1
+            start = time.perf_counter()
+            try:
+                *result, cached = await loop.run_in_executor(self._pool, render_request, record, store)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                self.metrics.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.metrics.rendered += 1
+                self.metrics.cache_hits += cached
+                self.metrics.render_time(time.perf_counter() - start)
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.in_flight -= 1
+
+    def health(self):
+        return {
+            'status': 'ok' if self._tasks else 'stopped',
+            'queued': self.queue.qsize(),
+            'queue_size': self.queue_size,
+            'in_flight': self.in_flight,
+            'workers': self.workers,
+        }
+
+    async def handle(self, method, target, body):
+        # Returns (status, content type, body bytes, extra headers).
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        if path == '/health':
+            if method != 'GET':
+                return _error(405, "use GET")
+            return _json(200, self.health())
+        if path == '/metrics':
+            if method != 'GET':
+                return _error(405, "use GET")
+            text = self.metrics.format(self.queue.qsize(), self.in_flight, self.workers, self.queue_size)
+            return 200, 'text/plain; version=0.0.4', text.encode('utf-8'), {}
+        if path != '/invoices':
+            return _error(404, f"no such endpoint: {path}")
+        if method != 'POST':
+            return _error(405, "use POST")
+
+        output = parse_qs(url.query).get('output', ['pdf'])[0]
+        if output not in ('pdf', 'path'):
+            return _error(400, "output must be pdf or path")
+        try:
+            record = parse_invoice(body)
+        except BadRequest as e:
+            return _error(400, str(e))
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((record, output == 'path', future))
+        except asyncio.QueueFull:
+            self.metrics.rejected += 1
+            status, content_type, payload, headers = _error(503, "render queue is full")
+            headers['Retry-After'] = str(RETRY_AFTER)
+            return status, content_type, payload, headers
+        try:
+            invoice_number, total_cents, result = await future
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except invoice_store.DuplicateInvoice as e:
+            return _error(409, str(e))
+        except Exception as e:
+            return _error(500, f"render failed: {e}")
+        if output == 'path':
+            return _json(200, {'invoice_number': invoice_number, 'total_cents': total_cents,
+                               'path': result})
+        return 200, 'application/pdf', result, {
+            'X-Invoice-Number': str(invoice_number),
+            'X-Invoice-Total-Cents': str(total_cents),
+        }
+
+    async def serve_connection(self, reader, writer):
+        # Minimal HTTP/1.1 with keep-alive; one request at a time per
+        # connection, which is all local clients need
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                except BadRequest as e:
+                    status = 431 if 'header' in str(e) else 413 if 'large' in str(e) else 400
+                    await _write_response(writer, *_error(status, str(e)), keep_alive=False)
+                    break
+                method, target, headers, body = request
+                response = await self.handle(method, target, body)
+                self.metrics.request(urlsplit(target).path, response[0])
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await _write_response(writer, *response, keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            # A bug, not a bad request; the client still gets an answer
+            try:
+                await _write_response(writer, *_error(500, f"internal error: {e}"), keep_alive=False)
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+def _json(status, data):
+    return status, 'application/json', json.dumps(data).encode('utf-8'), {}
+
+def _error(status, message):
+    return _json(status, {'error': message})
+
+async def _read_request(reader):
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.LimitOverrunError:
+        raise BadRequest("request header too large")
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, _ = lines[0].split(' ', 2)
+    except ValueError:
+        raise BadRequest("malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise BadRequest("invalid Content-Length")
+    if length < 0:
+        raise BadRequest("invalid Content-Length")
+    if length > MAX_BODY:
+        raise BadRequest("request body too large")
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target, headers, body
+
+async def _write_response(writer, status, content_type, payload, headers, keep_alive=True):
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(payload)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    head += [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + payload)
+    await writer.drain()
+
+async def serve(service, host='127.0.0.1', port=DEFAULT_PORT, unix_path=None, ready=None):
+    # Runs until cancelled (or SIGINT/SIGTERM when run from main).
+    await service.start()
+    if unix_path:
+        server = await asyncio.start_unix_server(service.serve_connection, unix_path, limit=MAX_HEADER)
+    else:
+        server = await asyncio.start_server(service.serve_connection, host, port, limit=MAX_HEADER)
+    if ready is not None:
+        ready(server)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+        if unix_path and os.path.exists(unix_path):
+            os.unlink(unix_path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve invoice rendering over local HTTP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', metavar='PATH', help="listen on a Unix socket instead of TCP")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help="render processes (default: CPU count)")
+    parser.add_argument('-q', '--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="requests that may wait for a worker before new ones get 503 "
+                             "(default: %(default)s)")
+    parser.add_argument('-o', '--output-dir', default=invoice_renderer.default_output_dir(),
+                        help="where ?output=path invoices are written")
+    parser.add_argument('-s', '--settings', default='company_settings.json',
+                        help="company settings JSON (default: company_settings.json)")
+    parser.add_argument('--db', help="database for invoice numbers and history "
+                                     "(default: ~/Documents/invoices/products.db)")
+    parser.add_argument('--number-format', help="invoice number format (default: from the settings)")
+    parser.add_argument('--cache-dir', nargs='?', const=render_cache.default_cache_dir(),
+                        help="serve repeated invoices from a render cache in this directory "
+                             "(default with no value: " + render_cache.default_cache_dir() + ")")
+    parser.add_argument('--cache-size', type=int, default=render_cache.DEFAULT_MAX_BYTES // 2**20,
+                        help="render cache size limit in MB (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.queue_size < 1:
+        parser.error("--queue-size must be at least 1")
+    if args.number_format and not invoice_numbers.check_format(args.number_format):
+        parser.error("--number-format must contain {seq}")
+    if args.db:
+        products_db.set_db_path(args.db)
+    service = RenderService(batch_invoices.load_settings(args.settings), args.output_dir,
+                            workers=args.workers, queue_size=args.queue_size,
+                            number_format=args.number_format, cache_dir=args.cache_dir,
+                            cache_size=args.cache_size * 2**20)
+
+    def announce(server):
+        where = args.unix or f"http://{args.host}:{server.sockets[0].getsockname()[1]}"
+        workers = f"{service.workers} worker{'s' if service.workers > 1 else ''}"
+        print(f"Serving invoices on {where} with {workers}", flush=True)
+
+    async def run():
+        task = asyncio.create_task(serve(service, args.host, args.port, args.unix, announce))
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, task.cancel)
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+from datetime import datetime
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+import invoice_store
+import tracing
+
+class RenderSignals(QObject):
+    progress = pyqtSignal(int, str)
+    finished = pyqtSignal(int, str, object)
+    failed = pyqtSignal(int, str)
+
+class RenderTask(QRunnable):
+    # Renders one invoice on a QThreadPool thread. Everything it needs is
+    # snapshotted up front so the user can keep editing (or click Generate
+    # again) while it runs; results come back through queued signals. Once
+    # the PDF is written the invoice is recorded in the invoice store.
+    def __init__(self, job_id, output_dir, company_settings, customer_info, line_items, numbers):
+        super().__init__()
+        self.job_id = job_id
+        self.output_dir = output_dir
+        self.company_settings = dict(company_settings)
+        self.customer_info = dict(customer_info)
+        self.line_items = line_items.copy()
+        self.numbers = numbers
+        self.issued = datetime.now()
+        self.signals = RenderSignals()
+
+    def run(self):
+        try:
+            # Imported here so app startup never pays for loading ReportLab
+            import invoice_renderer
+            # The number (and so the file name) is allocated here, off the GUI
+            # thread, since it may have to wait on another writer's lock
+            with tracing.span('render.allocate_number'):
+                invoice_number = self.numbers.next_number(self.issued)
+            filename, total_cents = invoice_renderer.render_new_invoice(
+                invoice_renderer.invoice_filename(self.output_dir, invoice_number),
+                self.company_settings, self.customer_info, self.line_items,
+                invoice_number=invoice_number, issued=self.issued,
+                progress=lambda stage: self.signals.progress.emit(self.job_id, stage))
+            self.signals.progress.emit(self.job_id, 'record')
+            invoice_store.save_invoice(invoice_number, self.issued, self.customer_info,
+                                       self.line_items, total_cents, filename)
+        except Exception as e:
+            self.signals.failed.emit(self.job_id, str(e))
+        else:
+            self.signals.finished.emit(self.job_id, filename, total_cents)
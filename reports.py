@@ -0,0 +1,285 @@
+import argparse
+import csv
+import re
+import sys
+import time
+from datetime import date, datetime
+import products_db
+from products_db import transaction
+import invoice_store
+from line_items import format_cents
+import tracing
+
+# Revenue reports over the invoice history (see invoice_store): by product,
+# by customer and by month, each for an optional [date_from, date_to) period.
+#
+# The customer and month reports aggregate the invoices table through
+# covering indexes, so they read index pages only. Grouping every stored
+# line by its product name is too slow past a million lines whatever the
+# index, so lines are also rolled up per (month, product) into
+# report_product_months, kept current by triggers as invoices are saved or
+# deleted. A period is then answered from the rollup for its whole months
+# plus the raw lines of at most two partial months at its ends.
+
+_SCHEMA = (
+    "CREATE INDEX IF NOT EXISTS idx_invoices_report ON invoices(issued_at, customer_name, total_cents)",
+    "CREATE INDEX IF NOT EXISTS idx_invoices_customer_totals "
+    "ON invoices(customer_name COLLATE NOCASE, total_cents)",
+    '''CREATE TABLE IF NOT EXISTS report_product_months (
+           month TEXT NOT NULL,
+           name TEXT NOT NULL,
+           lines INTEGER NOT NULL,
+           units REAL NOT NULL,
+           revenue_cents INTEGER NOT NULL,
+           PRIMARY KEY (month, name)
+       ) WITHOUT ROWID''',
+    '''CREATE TRIGGER IF NOT EXISTS report_lines_ai AFTER INSERT ON invoice_lines BEGIN
+           INSERT INTO report_product_months (month, name, lines, units, revenue_cents)
+           VALUES ((SELECT substr(issued_at, 1, 7) FROM invoices WHERE invoice_id = new.invoice_id),
+                   new.name, 1, CAST(new.quantity AS REAL), new.total_cents)
+           ON CONFLICT(month, name) DO UPDATE SET
+               lines = lines + 1, units = units + excluded.units,
+               revenue_cents = revenue_cents + excluded.revenue_cents;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS report_lines_ad AFTER DELETE ON invoice_lines BEGIN
+           UPDATE report_product_months SET
+               lines = lines - 1, units = units - CAST(old.quantity AS REAL),
+               revenue_cents = revenue_cents - old.total_cents
+           WHERE month = (SELECT substr(issued_at, 1, 7) FROM invoices WHERE invoice_id = old.invoice_id)
+             AND name = old.name;
+       END''',
+    # ON DELETE CASCADE removes lines after their invoice, when the month
+    # can no longer be looked up, so they are deleted first
+    '''CREATE TRIGGER IF NOT EXISTS report_invoices_bd BEFORE DELETE ON invoices BEGIN
+           DELETE FROM invoice_lines WHERE invoice_id = old.invoice_id;
+       END''',
+)
+
+_BACKFILL = '''
+    INSERT INTO report_product_months (month, name, lines, units, revenue_cents)
+    SELECT substr(i.issued_at, 1, 7), l.name, COUNT(*), SUM(CAST(l.quantity AS REAL)), SUM(l.total_cents)
+    FROM invoice_lines l JOIN invoices i ON i.invoice_id = l.invoice_id
+    GROUP BY 1, 2
+'''
+
+@tracing.traced('reports.init_reports')
+def init_reports():
+    # Needs invoice_store.init_store() first. Rolls up any lines already
+    # stored when the rollup table is first created.
+    with transaction() as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='report_product_months'").fetchone()
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        if not exists:
+            conn.execute(_BACKFILL)
+
+def _bound(value):
+    # date, datetime or 'YYYY-MM-DD[ HH:MM:SS]' -> text comparable with issued_at
+    if isinstance(value, datetime):
+        return invoice_store.format_issued(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+def _month_start(bound):
+    return bound[:7] + "-01"
+
+def _at_month_start(bound):
+    return bound in (_month_start(bound), _month_start(bound) + " 00:00:00")
+
+def _next_month(month_start):
+    year, month = int(month_start[:4]), int(month_start[5:7])
+    return f"{year + month // 12:04d}-{month % 12 + 1:02d}-01"
+
+def _period_where(date_from, date_to, column='issued_at'):
+    where, params = [], []
+    if date_from is not None:
+        where.append(f"{column} >= ?")
+        params.append(date_from)
+    if date_to is not None:
+        where.append(f"{column} < ?")
+        params.append(date_to)
+    return (" WHERE " + " AND ".join(where) if where else ""), params
+
+def _product_sources(date_from, date_to):
+    # Splits the period into whole months (read from the rollup) and raw
+    # [from, to) ranges of issued_at at its ends; returns (sql, params)
+    # parts to UNION ALL.
+    full_from = None if date_from is None else (
+        _month_start(date_from) if _at_month_start(date_from) else _next_month(_month_start(date_from)))
+    full_to = None if date_to is None else _month_start(date_to)
+    raw = []
+    if full_from is not None and full_to is not None and full_from >= full_to:
+        raw.append((date_from, date_to))
+        months = None
+    else:
+        months = (full_from and full_from[:7], full_to and full_to[:7])
+        if date_from is not None and not _at_month_start(date_from):
+            raw.append((date_from, full_from))
+        if date_to is not None and not _at_month_start(date_to):
+            raw.append((full_to, date_to))
+    parts = []
+    if months is not None:
+        where, params = _period_where(*months, column='month')
+        parts.append(("SELECT name, lines, units, revenue_cents FROM report_product_months" + where, params))
+    for lo, hi in raw:
+        parts.append(("SELECT l.name AS name, 1 AS lines, CAST(l.quantity AS REAL) AS units, "
+                      "l.total_cents AS revenue_cents FROM invoices i "
+                      "JOIN invoice_lines l ON l.invoice_id = i.invoice_id "
+                      "WHERE i.issued_at >= ? AND i.issued_at < ?", [lo, hi]))
+    return parts
+
+def _limit(sql, params, limit):
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+@tracing.traced('reports.revenue_by_product')
+def revenue_by_product(date_from=None, date_to=None, limit=None):
+    # [(product name, lines, units, revenue_cents)], highest revenue first.
+    parts = _product_sources(_bound(date_from), _bound(date_to))
+    sql = ("SELECT name, SUM(lines), SUM(units), SUM(revenue_cents) FROM ("
+           + " UNION ALL ".join(part for part, _ in parts)
+           + ") GROUP BY name HAVING SUM(lines) > 0 ORDER BY 4 DESC, name")
+    params = [p for _, part_params in parts for p in part_params]
+    return products_db.get_connection().execute(*_limit(sql, params, limit)).fetchall()
+
+@tracing.traced('reports.revenue_by_customer')
+def revenue_by_customer(date_from=None, date_to=None, limit=None):
+    # [(customer name, invoices, revenue_cents)], highest revenue first;
+    # names differing only in case are one customer.
+    where, params = _period_where(_bound(date_from), _bound(date_to))
+    sql = ("SELECT customer_name, COUNT(*), SUM(total_cents) FROM invoices" + where
+           + " GROUP BY customer_name COLLATE NOCASE ORDER BY 3 DESC, 1")
+    return products_db.get_connection().execute(*_limit(sql, params, limit)).fetchall()
+
+@tracing.traced('reports.revenue_by_month')
+def revenue_by_month(date_from=None, date_to=None, limit=None):
+    # [('YYYY-MM', invoices, revenue_cents)], oldest month first.
+    where, params = _period_where(_bound(date_from), _bound(date_to))
+    sql = ("SELECT substr(issued_at, 1, 7) AS month, COUNT(*), SUM(total_cents) FROM invoices" + where
+           + " GROUP BY month ORDER BY month")
+    return products_db.get_connection().execute(*_limit(sql, params, limit)).fetchall()
+
+def format_units(units):
+    return str(int(units)) if float(units).is_integer() else f"{units:.3f}".rstrip('0')
+
+# name -> (query, title, column headers, row formatter)
+REPORTS = {
+    'products': (revenue_by_product, "Revenue by Product", ("Product", "Lines", "Units", "Revenue"),
+                 lambda r: [r[0], str(r[1]), format_units(r[2]), format_cents(r[3])]),
+    'customers': (revenue_by_customer, "Revenue by Customer", ("Customer", "Invoices", "Revenue"),
+                  lambda r: [r[0] or "(no customer)", str(r[1]), format_cents(r[2])]),
+    'months': (revenue_by_month, "Revenue by Month", ("Month", "Invoices", "Revenue"),
+               lambda r: [r[0], str(r[1]), format_cents(r[2])]),
+}
+
+def parse_period(text):
+    # 'YYYY', 'YYYYQn' or 'YYYY-MM' -> (first day, first day after)
+    match = re.fullmatch(r'(\d{4})(?:[Qq]([1-4])|-(\d{2}))?', text.strip())
+    if not match:
+        raise ValueError(f"expected YYYY, YYYYQn or YYYY-MM: {text!r}")
+    year = int(match.group(1))
+    if match.group(2):
+        first = 3 * int(match.group(2)) - 2
+        return date(year, first, 1), date(year + first // 10, (first + 2) % 12 + 1, 1)
+    if match.group(3):
+        month = int(match.group(3))
+        if not 1 <= month <= 12:
+            raise ValueError(f"no such month: {text!r}")
+        return date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+def describe_period(date_from, date_to):
+    if date_from is None and date_to is None:
+        return "All invoices"
+    if date_to is None:
+        return f"From {_bound(date_from)}"
+    if date_from is None:
+        return f"Before {_bound(date_to)}"
+    return f"{_bound(date_from)} to {_bound(date_to)} (exclusive)"
+
+def write_csv(f, report, rows):
+    _, _, headers, cells = REPORTS[report]
+    writer = csv.writer(f)
+    writer.writerow(headers)
+    for row in rows:
+        writer.writerow(cells(row))
+
+@tracing.traced('reports.write_pdf')
+def write_pdf(out, report, rows, date_from=None, date_to=None, company_settings=None):
+    # out: a path or a binary file-like object. ReportLab is only loaded
+    # when a PDF is asked for.
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
+    from invoice_renderer import TABLE_STYLE
+    _, title, headers, cells = REPORTS[report]
+    styles = getSampleStyleSheet()
+    company = (company_settings or {}).get('company_name')
+    story = [Paragraph(title, styles['Title']),
+             Paragraph(" - ".join(filter(None, (company, describe_period(date_from, date_to)))),
+                       styles['Normal']),
+             Spacer(1, 12)]
+    table = Table([list(headers)] + [cells(row) for row in rows], repeatRows=1)
+    table.setStyle(TABLE_STYLE)
+    table.setStyle([('ALIGN', (1, 1), (-1, -1), 'RIGHT'), ('ALIGN', (0, 1), (0, -1), 'LEFT'),
+                    ('TOPPADDING', (0, 1), (-1, -1), 3),
+                    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.whitesmoke])])
+    story.append(table)
+    doc = SimpleDocTemplate(out, pagesize=letter, title=title)
+    doc.build(story)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Revenue reports over the stored invoice history.")
+    parser.add_argument('report', choices=sorted(REPORTS))
+    parser.add_argument('--db', help="database file (default: ~/Documents/invoices/products.db)")
+    period = parser.add_mutually_exclusive_group()
+    period.add_argument('--period', help="YYYY, YYYYQn (quarter) or YYYY-MM")
+    period.add_argument('--from', dest='date_from', help="first day, YYYY-MM-DD")
+    parser.add_argument('--to', dest='date_to', help="day after the last, YYYY-MM-DD")
+    parser.add_argument('-n', '--limit', type=int, help="top N rows only")
+    parser.add_argument('-o', '--output', default='-',
+                        help="CSV or PDF file (by extension), or - for CSV on stdout")
+    parser.add_argument('-s', '--settings', default='company_settings.json',
+                        help="company settings JSON, for the PDF heading")
+    args = parser.parse_args(argv)
+
+    date_from, date_to = args.date_from, args.date_to
+    try:
+        if args.period:
+            if date_to:
+                parser.error("--to cannot be combined with --period")
+            date_from, date_to = parse_period(args.period)
+        for bound in (date_from, date_to):
+            if isinstance(bound, str):
+                date.fromisoformat(bound)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.db:
+        products_db.set_db_path(args.db)
+    # Imported here, as schema imports this module
+    import schema
+    schema.ensure_schema()
+
+    query = REPORTS[args.report][0]
+    start = time.perf_counter()
+    rows = query(date_from, date_to, args.limit)
+    elapsed = time.perf_counter() - start
+    if args.output == '-':
+        write_csv(sys.stdout, args.report, rows)
+    elif args.output.lower().endswith('.pdf'):
+        import batch_invoices
+        write_pdf(args.output, args.report, rows, date_from, date_to,
+                  batch_invoices.load_settings(args.settings))
+    else:
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            write_csv(f, args.report, rows)
+    print(f"{len(rows)} rows in {1000 * elapsed:.0f} ms", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
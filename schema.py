@@ -0,0 +1,36 @@
+import products_db
+import product_search
+import invoice_store
+import invoice_numbers
+import customers_db
+import reports
+import invoice_archive
+import tracing
+
+# Schema setup for the shared SQLite database. The DDL in the modules below
+# is idempotent but not free (it takes the write lock and, for the search
+# index, may rebuild it), so the version it produces is stored in
+# PRAGMA user_version and startup skips it while that still matches.
+#
+# Bump SCHEMA_VERSION whenever a table, index or column is added below.
+
+SCHEMA_VERSION = 5
+
+def schema_version():
+    return products_db.get_connection().execute("PRAGMA user_version").fetchone()[0]
+
+@tracing.traced('schema.ensure_schema')
+def ensure_schema(force=False):
+    # Returns True if the schema had to be (re)created.
+    if not force and schema_version() >= SCHEMA_VERSION:
+        return False
+    products_db.init_db()
+    product_search.ensure_index()
+    invoice_store.init_store()
+    reports.init_reports()
+    invoice_numbers.init_numbers()
+    customers_db.init_customers()
+    invoice_archive.init_archive()
+    with products_db.transaction() as conn:
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION:d}")
+    return True
@@ -0,0 +1,123 @@
+import unittest
+import unittest.mock
+import io
+import json
+import os
+import tempfile
+import batch_invoices
+import products_db
+import invoice_store
+
+class TestBatchInvoices(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        products_db.set_db_path(os.path.join(self.tmp.name, "products.db"))
+        self.addCleanup(products_db.set_db_path, None)
+
+    def test_read_csv_groups_rows(self):
+        path = os.path.join(self.tmp.name, "invoices.csv")
+        with open(path, 'w') as f:
+            f.write("invoice_id,customer_name,customer_email,customer_address,item_name,price,quantity\n")
+            f.write("1,Ann,ann@example.com,1 Road,Widget,10,2\n")
+            f.write("1,Ann,ann@example.com,1 Road,Gadget,5,1\n")
+            f.write("2,Bob,bob@example.com,2 Road,Widget,10,1\n")
+        records = list(batch_invoices.read_jobs(path))
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]['customer']['name'], 'Ann')
+        self.assertEqual(records[0]['items'], [("Widget", "10", "2"), ("Gadget", "5", "1")])
+
+    def test_run_batch(self):
+        path = os.path.join(self.tmp.name, "invoices.jsonl")
+        with open(path, 'w') as f:
+            for i in range(3):
+                f.write(json.dumps({
+                    'customer': {'name': f'Customer {i}', 'email': '', 'address': ''},
+                    'items': [{'name': 'Widget', 'price': 10, 'quantity': i + 1}],
+                }) + "\n")
+        out_dir = os.path.join(self.tmp.name, "out")
+        results, elapsed = batch_invoices.run_batch(batch_invoices.read_jobs(path), out_dir, {}, workers=2)
+        stats, failed = batch_invoices.summarize(results, elapsed)
+        self.assertEqual(failed, [])
+        self.assertEqual(stats['rendered'], 3)
+        self.assertEqual(sorted(r[2] for r in results), [1000, 2000, 3000])
+        self.assertEqual(len(os.listdir(out_dir)), 3)
+
+    def test_run_batch_numbers_are_unique(self):
+        records = [{'customer': {}, 'items': [("Widget", "1", "1")]} for _ in range(10)]
+        records[3]['invoice_number'] = "CUSTOM-1"
+        out_dir = os.path.join(self.tmp.name, "out")
+        results, _ = batch_invoices.run_batch(records, out_dir, {}, workers=2, chunksize=2,
+                                              number_format="B-{seq}")
+        self.assertEqual(len({r[1] for r in results}), 10)
+        names = sorted(os.listdir(out_dir))
+        self.assertIn("invoice_CUSTOM-1.pdf", names)
+        self.assertEqual(len(names), 10)
+
+    def test_batch_and_bundle_are_recorded(self):
+        records = [{'customer': {'name': f'C{i}'}, 'items': [("Widget", "1", str(i + 1))]}
+                   for i in range(2)]
+        records.append({'customer': {'name': 'Own'}, 'items': [("Widget", "1", "1")],
+                        'invoice_number': "OWN-1"})
+        out_dir = os.path.join(self.tmp.name, "out")
+        results, _ = batch_invoices.run_batch(records, out_dir, {}, workers=2, chunksize=1)
+        results += batch_invoices.run_batch(records[2:], out_dir, {}, workers=1)[0]
+        bundle = os.path.join(self.tmp.name, "month.pdf")
+        results += batch_invoices.run_bundle(records[:1], bundle, {})[0]
+        history = invoice_store.list_invoices()
+        self.assertEqual(len(history), 4)
+        self.assertEqual(sorted((row[7], row[6]) for row in history),
+                         sorted((r[1], r[2]) for r in results[:3] + results[4:]))
+        self.assertEqual(len(invoice_store.find_by_number("OWN-1")), 1)
+
+    def test_run_batch_never_overwrites(self):
+        records = [{'customer': {}, 'items': [("Widget", "1", "1")], 'invoice_number': number}
+                   for number in ("A/1", "A_1")]
+        out_dir = os.path.join(self.tmp.name, "out")
+        for _ in range(2):
+            results, _ = batch_invoices.run_batch(records, out_dir, {}, workers=1)
+        self.assertEqual(sorted(os.listdir(out_dir)), ["invoice_A_1.pdf", "invoice_A_1_1.pdf"])
+        self.assertEqual(len({r[1] for r in results}), 2)
+
+    def test_concurrent_workers_never_share_a_file(self):
+        records = [{'customer': {}, 'items': [("Widget", "1", "1")], 'invoice_number': f"X{sep}{i // 2}"}
+                   for i, sep in zip(range(60), "/_" * 30)]
+        out_dir = os.path.join(self.tmp.name, "out")
+        results, _ = batch_invoices.run_batch(records, out_dir, {}, workers=4, chunksize=1)
+        self.assertEqual([r[4] for r in results], [None] * 60)
+        self.assertEqual(len(os.listdir(out_dir)), 60)
+        self.assertEqual(len({r[1] for r in results}), 60)
+
+    def test_failed_bundle_part_is_not_recorded(self):
+        records = [{'customer': {'name': f'C{i}'}, 'items': [("Widget", "1", "1")]} for i in range(4)]
+        records[3]['customer'] = {'name': {'bad': 1}}
+        bundle = os.path.join(self.tmp.name, "month.pdf")
+        results, _ = batch_invoices.run_bundle(records, bundle, {}, max_pages=2)
+        part1, part2 = (os.path.join(self.tmp.name, f"month_00{i}.pdf") for i in (1, 2))
+        self.assertTrue(os.path.exists(part1))
+        self.assertFalse(os.path.exists(part2))
+        self.assertEqual([(r[1], r[4] is None) for r in results],
+                         [(part1, True), (part1, True), (part2, False), (part2, False)])
+        self.assertEqual(sorted(row[7] for row in invoice_store.list_invoices()), [part1, part1])
+
+        path = os.path.join(self.tmp.name, "invoices.jsonl")
+        with open(path, 'w') as f:
+            f.write(json.dumps({'customer': {'name': {'bad': 1}}, 'items': []}) + "\n")
+        stderr = io.StringIO()
+        with unittest.mock.patch('sys.stderr', stderr), unittest.mock.patch('sys.stdout', io.StringIO()):
+            self.assertEqual(batch_invoices.main([path, '--bundle', bundle, '-s', os.devnull]), 1)
+        self.assertIn("Invoice 0 failed", stderr.getvalue())
+
+    def test_main_bundle(self):
+        path = os.path.join(self.tmp.name, "invoices.jsonl")
+        with open(path, 'w') as f:
+            for i in range(3):
+                f.write(json.dumps({'customer': {'name': f'Customer {i}'},
+                                    'items': [{'name': 'Widget', 'price': 10, 'quantity': 1}]}) + "\n")
+        bundle = os.path.join(self.tmp.name, "month.pdf")
+        self.assertEqual(batch_invoices.main([path, '--bundle', bundle, '-s', os.devnull]), 0)
+        with open(bundle, 'rb') as f:
+            self.assertEqual(f.read().count(b'/Type /Page\n'), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import os
+import tempfile
+import products_db
+import customers_db
+
+class TestCustomersDb(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        products_db.set_db_path(os.path.join(self.tmp.name, "products.db"))
+        customers_db.init_customers()
+
+    def tearDown(self):
+        products_db.set_db_path(None)
+        self.tmp.cleanup()
+
+    def test_save_customer_upserts_on_name_and_email(self):
+        cid = customers_db.save_customer({'name': 'Acme Ltd', 'email': 'ap@acme.test', 'address': '1 Road'})
+        again = customers_db.save_customer({'name': ' ACME LTD', 'email': 'AP@acme.test', 'address': '2 Road'})
+        self.assertEqual(cid, again)
+        self.assertEqual(customers_db.get_customer(cid), (cid, 'Acme Ltd', 'ap@acme.test', '2 Road'))
+        self.assertIsNone(customers_db.save_customer({'name': '  ', 'email': 'x@y'}))
+
+    def test_search_ranks_exact_then_prefix_then_substring(self):
+        for name, email, address in (("Northwind Traders", "nw@example.com", "5 Harbour St"),
+                                     ("North", "north@example.com", "1 Pole Rd"),
+                                     ("Southern Northwind", "s@example.com", "9 Bay Rd")):
+            customers_db.save_customer({'name': name, 'email': email, 'address': address})
+        names = [c[1] for c in customers_db.search("north")]
+        self.assertEqual(names[:2], ["North", "Northwind Traders"])
+        self.assertIn("Southern Northwind", names)
+        self.assertEqual([c[1] for c in customers_db.search("harbour")], ["Northwind Traders"])
+        self.assertEqual(len(customers_db.search("north", limit=1)), 1)
+        self.assertEqual(customers_db.search("   "), [])
+
+    def test_prefix_search_bounds(self):
+        for name in ("Zoe", "Zoë", "Zo\U0001F600 Cafe", "Zp Ltd", "zo[", "\U0010FFFF Corp"):
+            customers_db.save_customer({'name': name})
+        conn = products_db.get_connection()
+        self.assertEqual(sorted(c[1] for c in customers_db._index.prefix_search(conn, "ZO", 10)),
+                         ["Zoe", "Zoë", "Zo\U0001F600 Cafe", "zo["])
+        self.assertEqual(len(customers_db._index.prefix_search(conn, "Z", 10)), 5)
+        self.assertEqual([c[1] for c in customers_db._index.prefix_search(conn, "\U0010FFFF", 10)],
+                         ["\U0010FFFF Corp"])
+
+    def test_import_coerces_values(self):
+        stats = customers_db.import_customers([{'name': 'X', 'email': 5, 'address': None},
+                                               ["not", "a", "customer"], {'name': 12}])
+        self.assertEqual((stats['imported'], stats['skipped']), (2, 1))
+        self.assertEqual(customers_db.search("X")[0][1:], ('X', '5', ''))
+        self.assertEqual(customers_db.search("12")[0][1], '12')
+
+    def test_import_rebuilds_index_and_keeps_it_in_sync(self):
+        rows = [{'name': f'Customer {i}', 'email': f'c{i}@example.com', 'address': f'{i} Elm St'}
+                for i in range(30)]
+        rows.append({'name': '', 'email': 'nobody@example.com'})
+        stats = customers_db.import_customers(iter(rows), batch_size=7)
+        self.assertEqual((stats['imported'], stats['skipped']), (30, 1))
+        self.assertEqual([c[2] for c in customers_db.search("c17@example")], ['c17@example.com'])
+
+        # Row-by-row path: the index triggers are back after the bulk load
+        customers_db.import_customers([{'name': 'Customer 17', 'email': 'c17@example.com',
+                                        'address': '17 Oak Ave'}])
+        self.assertEqual([c[3] for c in customers_db.search("oak ave")], ['17 Oak Ave'])
+        self.assertEqual(customers_db.search("17 elm"), [])
+        count = products_db.get_connection().execute("SELECT COUNT(*) FROM customers").fetchone()[0]
+        self.assertEqual(count, 30)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,13 @@ import unittest
 from unittest.mock import MagicMock, patch
 from PyQt6.QtWidgets import QApplication, QLineEdit
 import sys
-from invoice_app import InvoiceApp
+import os
+import json
+import tempfile
+import products_db
+import customers_db
+from invoice_app import InvoiceApp, CustomerDialog
+from product_models import shared_product_model
 
 class TestInvoiceApp(unittest.TestCase):
     @classmethod
@@ -11,7 +17,37 @@ class TestInvoiceApp(unittest.TestCase):
         cls.app = QApplication(sys.argv)
 
     def setUp(self):
+        # Never touch the developer's own draft, database or invoices folder
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        products_db.set_db_path(os.path.join(self.tmp.name, 'products.db'))
+        self.addCleanup(self.restore_db_path)
+        self.draft_file = os.path.join(self.tmp.name, 'invoice_draft.json')
+        self.out_dir = os.path.join(self.tmp.name, 'invoices')
+        for target, value in (('invoice_app.DRAFT_FILE', self.draft_file),
+                              ('invoice_renderer.default_output_dir', lambda: self.out_dir)):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
         self.invoice_app = InvoiceApp()
+        self.addCleanup(self.invoice_app.render_pool.waitForDone)
+
+    @classmethod
+    def tearDownClass(cls):
+        # Later modules switch databases too; the shared product model must
+        # not sync from the default one when they do
+        products_db.catalog.remove_listener(shared_product_model()._schedule_sync)
+
+    def restore_db_path(self):
+        # Product model syncs still queued, or queued by switching databases,
+        # would otherwise run after the test, on the default database
+        QApplication.processEvents()
+        sync = shared_product_model()._schedule_sync
+        products_db.catalog.remove_listener(sync)
+        try:
+            products_db.set_db_path(None)
+        finally:
+            products_db.catalog.add_listener(sync)
 
     def test_add_item_row(self):
         # Test adding an item row
@@ -66,14 +102,69 @@ class TestInvoiceApp(unittest.TestCase):
         self.invoice_app.add_item_row()
         item_index = len(self.invoice_app.items) - 1
         name, price, qty = self.invoice_app.items[item_index]
-        name.setText("Test Item")
+        name.setCurrentText("Test Item")
         price.setText("10")
         qty.setText("2")
 
-        with patch('invoice_app.QMessageBox') as mock_msg:
+        with patch('invoice_app.QMessageBox') as mock_msg, \
+                patch('invoice_app.QDesktopServices') as mock_open:
             self.invoice_app.generate_invoice()
+            # Rendering runs on the pool; wait for it and deliver its signals
+            self.invoice_app.render_pool.waitForDone()
+            QApplication.processEvents()
             # Check that success message was shown
             mock_msg.information.assert_called_once()
+            mock_open.openUrl.assert_called_once()
+        self.assertEqual(len(os.listdir(self.out_dir)), 1)
+
+    def test_draft_round_trip(self):
+        self.invoice_app.customer_info = {'name': 'Draft Customer', 'email': '', 'address': ''}
+        self.invoice_app.add_item_row()
+        name, price, qty = self.invoice_app.items[-1]
+        name.setCurrentText("Draft Item")
+        price.setText("2.50")
+        qty.setText("4")
+        self.invoice_app.save_draft()
+
+        restored = InvoiceApp()
+        restored.finish_startup()
+        self.assertEqual(restored.customer_info['name'], 'Draft Customer')
+        self.assertEqual(restored.line_items.rows(), self.invoice_app.line_items.rows())
+        name, price, qty = restored.items[-1]
+        self.assertEqual((name.currentText(), price.text(), qty.text()), ("Draft Item", "2.50", "4"))
+        self.assertEqual(restored.total_label.text(), "10.00")
+
+        restored.new_invoice()
+        self.assertFalse(os.path.exists(self.draft_file))
+
+    def test_malformed_draft_is_ignored(self):
+        for draft in ({'customer': None, 'items': [["Item", "1"]]},
+                      {'customer': None, 'items': [["Item", 1, "2"]]},
+                      {'customer': 'Someone', 'items': []},
+                      {'items': {'name': 'Item'}},
+                      ["Item", "1", "2"]):
+            with open(self.draft_file, 'w') as f:
+                json.dump(draft, f)
+            restored = InvoiceApp()
+            with self.assertLogs('invoice_app', 'WARNING'):
+                restored.finish_startup()
+            self.assertIsNone(restored.customer_info)
+            self.assertEqual(restored.line_items.rows(), [("", "", "")])
+
+    def test_customer_dialog_autocomplete(self):
+        customers_db.init_customers()
+        customers_db.save_customer({'name': 'Globex', 'email': 'ar@globex.test',
+                                    'address': '7 Cypress Creek'})
+        dialog = CustomerDialog(self.invoice_app, {'name': 'Glo', 'email': '', 'address': ''})
+        self.assertEqual(dialog.customer_name.text(), 'Glo')
+        dialog.customer_name.textEdited.emit('Glo')
+        self.assertTrue(dialog.lookup_timer.isActive())
+        dialog.lookup_customers()
+        self.assertEqual(dialog.suggestions.rowCount(), 1)
+        dialog.fill_from_suggestion(dialog.suggestions.index(0))
+        self.assertEqual(dialog.get_customer_info(), {
+            'name': 'Globex', 'email': 'ar@globex.test', 'address': '7 Cypress Creek'})
+        dialog.deleteLater()
 
 if __name__ == '__main__':
     unittest.main()
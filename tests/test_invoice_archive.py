@@ -0,0 +1,114 @@
+import unittest
+import os
+import tempfile
+import time
+from datetime import datetime
+from unittest.mock import patch
+import products_db
+import invoice_store
+import invoice_archive
+
+def fake_pdf(i, size=3000):
+    return b"%PDF-1.4\n" + bytes((i * 7 + n) % 251 for n in range(size))
+
+class TestInvoiceArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        products_db.set_db_path(os.path.join(self.tmp.name, "products.db"))
+        products_db.init_db()
+        invoice_store.init_store()
+        invoice_archive.init_archive()
+        self.archive_dir = os.path.join(self.tmp.name, "archive")
+        self.loose_dir = os.path.join(self.tmp.name, "invoices")
+        os.makedirs(self.loose_dir)
+
+    def tearDown(self):
+        invoice_archive.close_maps()
+        products_db.set_db_path(None)
+        self.tmp.cleanup()
+
+    def write_loose(self, name, data, age_days):
+        path = os.path.join(self.loose_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        mtime = time.time() - age_days * 86400
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_pack_loose_files_and_look_them_up(self):
+        known = self.write_loose("invoice_INV-7.pdf", fake_pdf(7), 200)
+        invoice_store.save_invoice("INV-7", datetime(2025, 1, 2, 3, 4, 5), {'name': 'Ann'},
+                                   [("Widget", "1", "1")], 100, known)
+        self.write_loose("invoice_20240101_120000.pdf", fake_pdf(1), 300)
+        recent = self.write_loose("invoice_INV-9.pdf", fake_pdf(9), 1)
+
+        stats = invoice_archive.pack_directory(self.loose_dir, self.archive_dir, older_than_days=90)
+        self.assertEqual((stats['archived'], stats['removed']), (2, 2))
+        self.assertEqual(os.listdir(self.loose_dir), [os.path.basename(recent)])
+
+        [entry] = invoice_archive.find_by_number("INV-7")
+        self.assertEqual(entry[1:5], ("INV-7", "2025-01-02 03:04:05", "Ann", "invoice_INV-7.pdf"))
+        # The history now refers to the archived copy, not the deleted file
+        pdf_path = invoice_store.find_by_number("INV-7")[0][7]
+        self.assertEqual(invoice_archive.archived_entry_id(pdf_path), entry[0])
+        self.assertIsNone(invoice_archive.archived_entry_id(recent))
+        self.assertEqual(invoice_archive.find_by_customer("ann"), [entry])
+        self.assertEqual(invoice_archive.read_pdf(entry, self.archive_dir, verify=True), fake_pdf(7))
+        [legacy] = invoice_archive.find_by_number("20240101_120000")
+        self.assertEqual(legacy[2], "2024-01-01 12:00:00")
+        out = invoice_archive.extract(legacy[0], os.path.join(self.tmp.name, "out.pdf"), self.archive_dir)
+        with open(out, 'rb') as f:
+            self.assertEqual(f.read(), fake_pdf(1))
+
+        # Packing a kept file again stores nothing new
+        self.write_loose("invoice_INV-9.pdf", fake_pdf(9), 100)
+        invoice_store.save_invoice("INV-9", datetime(2025, 1, 3), {'name': 'Bo'}, [], 0, recent)
+        for _ in range(2):
+            invoice_archive.pack_directory(self.loose_dir, self.archive_dir, keep=True)
+        self.assertEqual(len(invoice_archive.find_by_number("INV-9")), 1)
+        self.assertEqual(invoice_store.find_by_number("INV-9")[0][7], recent)
+
+    def test_batch_repeats_stored_once(self):
+        issued = datetime(2025, 1, 1)
+        ids = invoice_archive.archive_pdfs(
+            [(fake_pdf(1), "INV-1", issued, "Ann", None), (fake_pdf(1), "INV-1", issued, "Ann", None),
+             (fake_pdf(2), "INV-1", issued, "Ann", None)], self.archive_dir)
+        self.assertEqual(ids[0], ids[1])
+        self.assertNotEqual(ids[0], ids[2])
+        self.assertEqual(len(invoice_archive.find_by_number("INV-1")), 2)
+        segment = invoice_archive.segment_path(self.archive_dir, 1)
+        self.assertLess(os.path.getsize(segment), 3 * len(fake_pdf(1)))
+
+    def test_writer_picks_segment_on_first_append(self):
+        writer = invoice_archive._SegmentWriter(self.archive_dir)
+        # Another writer starts segment 2 before this one takes the lock
+        open(invoice_archive.segment_path(self.archive_dir, 2), 'wb').close()
+        try:
+            self.assertEqual(writer.append({}, b"data")[0], 2)
+        finally:
+            writer.close()
+
+    def test_segments_roll_and_compact(self):
+        with patch('invoice_archive.SEGMENT_MAX_BYTES', 10000):
+            ids = invoice_archive.archive_pdfs(
+                [(fake_pdf(i), f"INV-{i}", datetime(2025, 1, 1 + i), "Bob", None) for i in range(10)],
+                self.archive_dir)
+            segments = invoice_archive.list_segments(self.archive_dir)
+            self.assertEqual(len(segments), 4)
+            for i, entry_id in enumerate(ids):
+                self.assertEqual(invoice_archive.read_pdf(entry_id, self.archive_dir), fake_pdf(i))
+
+            invoice_archive.remove(ids[:5])
+            stats = invoice_archive.compact(self.archive_dir)
+        self.assertEqual(stats['compacted'], 2)
+        self.assertNotIn(segments[0], invoice_archive.list_segments(self.archive_dir))
+        self.assertEqual(invoice_archive.find_by_number("INV-0"), [])
+        page = invoice_archive.find_by_customer("Bob", limit=3)
+        self.assertEqual([row[1] for row in page], ["INV-9", "INV-8", "INV-7"])
+        rest = invoice_archive.find_by_customer("Bob", before=invoice_archive.page_cursor(page[-1]))
+        self.assertEqual([row[1] for row in rest], ["INV-6", "INV-5"])
+        for i in range(5, 10):
+            self.assertEqual(invoice_archive.read_pdf(ids[i], self.archive_dir, verify=True), fake_pdf(i))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import os
+import tempfile
+from PIL import Image as PILImage
+import invoice_renderer
+import invoice_template
+import invoice_bundle
+
+class TestInvoiceBundle(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(invoice_template.clear)
+        self.settings = {'logo_path': os.path.join(self.tmp.name, "logo.png")}
+        # Noise does not compress, so the logo dominates a separate PDF's size
+        PILImage.effect_noise((400, 200), 64).convert("RGB").save(self.settings['logo_path'])
+
+    def read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def test_bundle_shares_resources(self):
+        records = [{'customer': {'name': f'Customer {i}'}, 'items': [("Widget", "1", str(i + 1))],
+                    'invoice_number': f"INV-{i}"} for i in range(5)]
+        records[2]['items'] = [(f"Usage {i}", "0.01", "1") for i in range(100)]
+        filename = os.path.join(self.tmp.name, "bundle.pdf")
+        parts, entries = invoice_bundle.render_bundle(filename, self.settings, records)
+        self.assertEqual(parts, [filename])
+        self.assertEqual([(e[1], e[3]) for e in entries],
+                         [("INV-0", 100), ("INV-1", 200), ("INV-2", 100), ("INV-3", 400), ("INV-4", 500)])
+        pdf = self.read(filename)
+        pages = pdf.count(b'/Type /Page\n')
+        self.assertEqual([e[2] for e in entries], [1, 2, 3, pages - 1, pages])
+        self.assertEqual(pdf.count(b'/Subtype /Image'), 1)
+        self.assertEqual(pdf.count(b'/Dest'), 5)
+
+        separate = 0
+        for record in records:
+            single = os.path.join(self.tmp.name, f"{record['invoice_number']}.pdf")
+            invoice_renderer.render_invoice(single, self.settings, record['customer'], record['items'],
+                                           invoice_number=record['invoice_number'])
+            separate += len(self.read(single))
+        self.assertLess(len(pdf), separate / 2)
+
+    def test_max_pages_splits_between_invoices(self):
+        records = [{'customer': {}, 'items': [("Widget", "1", "1")]} for _ in range(7)]
+        filename = os.path.join(self.tmp.name, "bundle.pdf")
+        parts, entries = invoice_bundle.render_bundle(filename, {}, records, max_pages=3)
+        self.assertEqual([os.path.basename(p) for p in parts],
+                         ["bundle_001.pdf", "bundle_002.pdf", "bundle_003.pdf"])
+        self.assertEqual([self.read(p).count(b'/Type /Page\n') for p in parts], [3, 3, 1])
+        self.assertEqual([e[2] for e in entries], [1, 2, 3, 1, 2, 3, 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import products_db
+import invoice_numbers
+
+def _reserve_many(db_path):
+    products_db.set_db_path(db_path)
+    return [invoice_numbers.reserve(3) for _ in range(20)]
+
+class TestInvoiceNumbers(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "products.db")
+        products_db.set_db_path(self.db_path)
+        invoice_numbers.init_numbers()
+
+    def tearDown(self):
+        products_db.set_db_path(None)
+        self.tmp.cleanup()
+
+    def test_reserve_blocks(self):
+        self.assertEqual(invoice_numbers.reserve(10), 1)
+        self.assertEqual(invoice_numbers.reserve(), 11)
+        self.assertEqual(invoice_numbers.reserve(sequence='credit'), 1)
+
+    def test_allocator_unique_across_threads(self):
+        allocator = invoice_numbers.NumberAllocator(block_size=4)
+        values = []
+        def work():
+            for _ in range(50):
+                values.append(allocator.next_value())
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(values), list(range(1, 401)))
+
+    def test_reserve_unique_across_processes(self):
+        with ProcessPoolExecutor(max_workers=3) as pool:
+            blocks = [b for result in pool.map(_reserve_many, [self.db_path] * 3) for b in result]
+        self.assertEqual(sorted(blocks), list(range(1, 180, 3)))
+
+    def test_format(self):
+        allocator = invoice_numbers.NumberAllocator(fmt="INV-{issued:%Y}-{seq:04d}")
+        self.assertEqual(allocator.next_number(datetime(2024, 3, 1)), "INV-2024-0001")
+        self.assertTrue(invoice_numbers.check_format(invoice_numbers.DEFAULT_FORMAT))
+        self.assertFalse(invoice_numbers.check_format("INV-{issued:%Y}"))
+        self.assertFalse(invoice_numbers.check_format("INV-{number}"))
+        self.assertFalse(invoice_numbers.check_format("INV-{seq[0]}"))
+
+if __name__ == '__main__':
+    unittest.main()
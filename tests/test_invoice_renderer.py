@@ -0,0 +1,55 @@
+import unittest
+import io
+import os
+import tempfile
+import invoice_renderer
+
+class TestInvoiceRenderer(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_render_invoice(self):
+        filename = os.path.join(self.tmp.name, "invoice.pdf")
+        customer = {'name': 'Test Customer', 'email': 'test@example.com', 'address': '123 Test St'}
+        items = [("Widget", "10", "2"), ("Gadget", 2.5, 4), ("", "1", "1"), ("Bad", "x", "1")]
+        total_cents = invoice_renderer.render_invoice(filename, {}, customer, items)
+        self.assertEqual(total_cents, 3100)
+        with open(filename, 'rb') as f:
+            self.assertTrue(f.read(4) == b'%PDF')
+
+    def test_long_invoice_paginates(self):
+        filename = os.path.join(self.tmp.name, "long.pdf")
+        items = ((f"Usage {i}", "0.01", "1") for i in range(500))
+        total_cents = invoice_renderer.render_invoice(filename, {}, {}, items, invoice_number="INV-1")
+        self.assertEqual(total_cents, 500)
+        with open(filename, 'rb') as f:
+            pdf = f.read()
+        pages = pdf.count(b'/Type /Page\n')
+        self.assertGreater(pages, 10)
+
+    def test_render_in_memory(self):
+        items = [("Widget", "10", "2"), ("Gadget", 2.5, 4)]
+        pdf, total_cents = invoice_renderer.render_invoice_bytes({}, {'name': 'Ann'}, items, "INV-7")
+        self.assertEqual(total_cents, 3000)
+        self.assertTrue(pdf.startswith(b'%PDF') and pdf.rstrip().endswith(b'%%EOF'))
+        out = io.BytesIO()
+        self.assertEqual(invoice_renderer.write_invoice(out, {}, {}, items), 3000)
+        self.assertTrue(out.getvalue().startswith(b'%PDF'))
+
+    def test_failed_render_leaves_no_file(self):
+        def items():
+            yield ("Widget", "1", "1")
+            raise RuntimeError("source failed")
+        filename = os.path.join(self.tmp.name, "broken.pdf")
+        with self.assertRaises(RuntimeError):
+            invoice_renderer.render_invoice(filename, {}, {}, items())
+        self.assertFalse(os.path.exists(filename))
+
+    def test_build_table_data_skips_incomplete_lines(self):
+        data, total_cents = invoice_renderer.build_table_data([("A", "1.5", "2"), ("B", "", "1")])
+        self.assertEqual(data[1:], [["A", "2.0", "$1.50", "$3.00"]])
+        self.assertEqual(total_cents, 300)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import os
+import tempfile
+from datetime import datetime, timedelta
+import products_db
+import invoice_store
+from line_items import LineItems
+
+class TestInvoiceStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        products_db.set_db_path(os.path.join(self.tmp.name, "products.db"))
+        products_db.init_db()
+        invoice_store.init_store()
+
+    def tearDown(self):
+        products_db.set_db_path(None)
+        self.tmp.cleanup()
+
+    def test_save_invoice_with_lines(self):
+        items = LineItems.from_rows([("Widget", "1.25", "2"), ("", "", ""), ("Gadget", "3", "1")])
+        invoice_id = invoice_store.save_invoice(
+            "INV-1", datetime(2024, 5, 1, 9, 30), {'name': 'Ann', 'email': 'ann@example.com'},
+            items, items.total_cents, "/tmp/inv.pdf")
+        self.assertEqual(invoice_store.get_invoice(invoice_id),
+                         (invoice_id, "INV-1", "2024-05-01 09:30:00", "Ann", "ann@example.com", "",
+                          550, "/tmp/inv.pdf"))
+        self.assertEqual(invoice_store.get_invoice_lines(invoice_id),
+                         [(1, "Widget", "1.25", "2", 250), (2, "Gadget", "3", "1", 300)])
+        self.assertEqual([r[0] for r in invoice_store.find_by_number("INV-1")], [invoice_id])
+
+    def test_failed_save_leaves_nothing(self):
+        def rows():
+            yield ("Widget", "1", "1")
+            raise RuntimeError("boom")
+        with self.assertRaises(RuntimeError):
+            invoice_store.save_invoice("INV-1", datetime(2024, 5, 1), {}, rows(), 100)
+        self.assertEqual(invoice_store.list_invoices(), [])
+
+    def test_list_invoices_pages_newest_first(self):
+        start = datetime(2024, 1, 1)
+        for i in range(7):
+            customer = {'name': 'Ann' if i % 2 else 'Bob'}
+            invoice_store.save_invoice(f"INV-{i}", start + timedelta(days=i), customer, [], 0)
+        seen = []
+        page = invoice_store.list_invoices(limit=3)
+        while page:
+            seen.extend(r[1] for r in page)
+            page = invoice_store.list_invoices(before=invoice_store.page_cursor(page[-1]), limit=3)
+        self.assertEqual(seen, [f"INV-{i}" for i in range(6, -1, -1)])
+        self.assertEqual([r[1] for r in invoice_store.list_invoices(customer="ann")],
+                         ["INV-5", "INV-3", "INV-1"])
+        self.assertEqual([r[1] for r in invoice_store.list_invoices(
+            date_from="2024-01-02", date_to=datetime(2024, 1, 4))], ["INV-2", "INV-1"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import unittest.mock
+import os
+import tempfile
+from datetime import datetime
+from PIL import Image as PILImage
+import invoice_renderer
+import invoice_template
+
+class TestInvoiceTemplate(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(invoice_template.clear)
+        self.logo = os.path.join(self.tmp.name, "logo.png")
+        PILImage.new("RGBA", (400, 200), (255, 0, 0, 128)).save(self.logo)
+
+    def test_compiled_once_per_settings_version(self):
+        settings = {'company_name': 'Acme', 'logo_path': self.logo}
+        template = invoice_template.get_template(settings)
+        self.assertIs(invoice_template.get_template(dict(settings)), template)
+        self.assertIsNot(invoice_template.get_template(dict(settings, company_name='Other')), template)
+        os.utime(self.logo, ns=(0, 0))
+        self.assertIsNot(invoice_template.get_template(settings), template)
+
+    def test_renders_share_encoded_logo(self):
+        settings = {'logo_path': self.logo}
+        template = invoice_template.get_template(settings)
+        sizes = []
+        for i in range(2):
+            filename = os.path.join(self.tmp.name, f"invoice{i}.pdf")
+            invoice_renderer.render_invoice(filename, settings, {}, [("Widget", "1", "1")],
+                                           invoice_number="INV-1", issued=datetime(2024, 1, 1))
+            with open(filename, 'rb') as f:
+                pdf = f.read()
+            self.assertIn(b'/SMask', pdf)
+            sizes.append(len(pdf))
+        self.assertIs(invoice_template.get_template(settings), template)
+        self.assertEqual(sizes[0], sizes[1])
+
+    def test_plain_draw_image_fallback(self):
+        settings = {'logo_path': self.logo}
+        filename = os.path.join(self.tmp.name, "invoice.pdf")
+        with unittest.mock.patch.object(invoice_template, 'SHARE_LOGO', False):
+            invoice_renderer.render_invoice(filename, settings, {}, [("Widget", "1", "1")])
+        self.assertIsNone(invoice_template.get_template(settings).logo_image)
+        with open(filename, 'rb') as f:
+            pdf = f.read()
+        self.assertEqual(pdf.count(b'/Subtype /Image'), 2)
+        self.assertIn(b'/SMask', pdf)
+
+    def test_unreadable_logo_is_logged(self):
+        with open(self.logo, 'wb') as f:
+            f.write(b'not an image')
+        with self.assertLogs('invoice_template', 'WARNING'):
+            template = invoice_template.get_template({'logo_path': self.logo})
+        self.assertIn(('drawString', (70, template.height - 100, "Logo Error"), {}), template.first_page_ops)
+
+if __name__ == '__main__':
+    unittest.main()
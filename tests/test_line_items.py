@@ -0,0 +1,63 @@
+import unittest
+from decimal import Decimal
+from line_items import LineItems, format_cents
+
+class TestLineItems(unittest.TestCase):
+    def test_running_total_updates_by_delta(self):
+        items = LineItems()
+        a = items.add("A")
+        b = items.add("B")
+        items.set_price(a, "0.10")
+        items.set_quantity(a, "3")
+        items.set_price(b, "19.99")
+        self.assertEqual(items.total_cents, 30)
+        items.set_quantity(b, "2")
+        self.assertEqual(items.total_cents, 30 + 3998)
+        items.set_quantity(a, "abc")
+        self.assertEqual(items.total_cents, 3998)
+        items.remove(b)
+        self.assertEqual(items.total_cents, 0)
+
+    def test_no_float_drift(self):
+        items = LineItems.from_rows([("Item", "0.1", "1")] * 1000)
+        self.assertEqual(items.total_cents, 10000)
+        self.assertEqual(items.total, Decimal("100.00"))
+
+    def test_line_total_rounds_half_up(self):
+        items = LineItems.from_rows([("Item", "0.125", "1")])
+        self.assertEqual(items.total_cents, 13)
+        self.assertEqual(format_cents(-1205), "-12.05")
+
+    def test_rows_round_trip_keeps_typed_text(self):
+        rows = [("A", "19.990", "2"), ("B", "abc", " 3 "), ("", "", ""),
+                ("Wide", "123456789012.5", "1E+3")]
+        items = LineItems.from_rows(rows)
+        self.assertEqual(items.rows(), rows)
+        self.assertEqual(LineItems.from_rows(items.rows()).rows(), rows)
+        lines = list(items.lines())
+        self.assertEqual(lines[0].price, Decimal("19.990"))
+        self.assertIsNone(lines[1].price)
+        self.assertEqual(lines[3].total_cents, 12345678901250000)
+        self.assertEqual(items.total_cents, 3998 + 12345678901250000)
+        self.assertEqual([line.name for line in items.billable()], ["A", "Wide"])
+
+    def test_huge_numbers_are_not_billable(self):
+        items = LineItems.from_rows([("Huge", "1e999999", "1e999999"), ("Max", "9999999999999999", "1"),
+                                     ("NaN", "NaN", "1"), ("A", "1", "1")])
+        self.assertEqual(items.total_cents, 999999999999999900 + 100)
+        self.assertEqual([line.name for line in items.billable()], ["Max", "A"])
+        items.set_price(items.keys()[3], "1e16")
+        self.assertEqual(items.total_cents, 999999999999999900)
+
+    def test_copy_is_detached(self):
+        items = LineItems.from_rows([("A", "1.50", "2"), ("B", "2", "1")])
+        snapshot = items.copy()
+        key = items.keys()[0]
+        items.set_price(key, "3")
+        items.remove(items.keys()[1])
+        self.assertEqual(snapshot.total_cents, 500)
+        self.assertEqual(snapshot.rows(), [("A", "1.50", "2"), ("B", "2", "1")])
+        self.assertEqual(items.total_cents, 600)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+import os
+import tempfile
+from PIL import Image as PILImage
+import logo_cache
+
+class TestLogoCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(logo_cache.clear)
+        self.path = os.path.join(self.tmp.name, "logo.png")
+        PILImage.new("RGB", (1000, 250), "red").save(self.path)
+
+    def test_logo_decoded_once_and_downsampled(self):
+        logo = logo_cache.get_logo(self.path)
+        self.assertIs(logo_cache.get_logo(self.path), logo)
+        self.assertEqual((logo.draw_width, logo.draw_height), (100, 50))
+        self.assertEqual(logo.pixel_size, (400, 200))
+
+    def test_changed_file_is_reloaded(self):
+        logo = logo_cache.get_logo(self.path)
+        PILImage.new("RGB", (50, 50), "blue").save(self.path)
+        os.utime(self.path, ns=(0, 0))
+        reloaded = logo_cache.get_logo(self.path)
+        self.assertIsNot(reloaded, logo)
+        self.assertEqual((reloaded.draw_width, reloaded.draw_height), (50, 50))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import unittest
+import csv
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import products_db
+import product_search
+
+class TestProductsDb(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        products_db.set_db_path(os.path.join(self.tmp.name, "products.db"))
+        products_db.init_db()
+
+    def tearDown(self):
+        products_db.set_db_path(None)
+        self.tmp.cleanup()
+
+    def test_add_get_update_product(self):
+        pid = products_db.add_product("Widget", "A widget", 9.5)
+        self.assertEqual(products_db.get_product(pid), (pid, "Widget", "A widget", 9.5))
+        products_db.update_product(pid, "Widget XL", "Bigger", 12.0)
+        self.assertEqual(products_db.get_products(), [(pid, "Widget XL", "Bigger", 12.0)])
+
+    def test_get_products_page(self):
+        ids = [products_db.add_product(f"P{i}", "", i) for i in range(5)]
+        first = products_db.get_products_page(0, 2)
+        self.assertEqual([p[0] for p in first], ids[:2])
+        rest = products_db.get_products_page(first[-1][0], 10)
+        self.assertEqual([p[0] for p in rest], ids[2:])
+
+    def test_connection_reused_per_thread(self):
+        conn = products_db.get_connection()
+        self.assertIs(products_db.get_connection(), conn)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        other = []
+        t = threading.Thread(target=lambda: other.append(products_db.get_connection()))
+        t.start()
+        t.join()
+        self.assertIsNot(other[0], conn)
+        # The finished thread's connection was closed with it
+        with self.assertRaises(sqlite3.ProgrammingError):
+            other[0].execute("SELECT 1")
+
+    def test_transaction_rolls_back_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with products_db.transaction() as conn:
+                conn.execute("INSERT INTO products (name, description, price) VALUES ('X', '', 1)")
+                raise RuntimeError("boom")
+        self.assertEqual(products_db.get_products(), [])
+
+class TestBulkImportExport(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        products_db.set_db_path(os.path.join(self.tmp.name, "products.db"))
+        products_db.init_db()
+
+    def tearDown(self):
+        products_db.set_db_path(None)
+        self.tmp.cleanup()
+
+    def test_import_upserts_by_sku(self):
+        rows = [{'sku': f'SKU{i}', 'name': f'Item {i}', 'price': str(i)} for i in range(25)]
+        rows.append({'name': '', 'price': '1'})
+        stats = products_db.import_products(iter(rows), batch_size=10)
+        self.assertEqual((stats['imported'], stats['skipped']), (25, 1))
+        products_db.import_products([{'sku': 'SKU3', 'name': 'Renamed', 'price': '9.99'}])
+        products = products_db.get_products()
+        self.assertEqual(len(products), 25)
+        self.assertIn("Renamed", [p[1] for p in products])
+
+    def test_import_skips_unusable_rows(self):
+        rows = [{'name': 'NaN', 'price': 'nan'},
+                {'name': 'Inf', 'price': 'inf'},
+                {'name': 'Bad id', 'price': '1', 'product_id': 'x1'},
+                ['not', 'a', 'row'],
+                {'name': 1234, 'price': 2, 'sku': 99},
+                {'name': 'Good', 'price': '3.5'}]
+        stats = products_db.import_products(rows)
+        self.assertEqual((stats['imported'], stats['skipped']), (2, 4))
+        self.assertEqual(sorted(p[1:] for p in products_db.get_products()),
+                         [('1234', '', 2.0), ('Good', '', 3.5)])
+
+    def test_export_round_trip(self):
+        products_db.add_product("Widget", "Small", 1.25)
+        out = io.StringIO()
+        stats = products_db.export_products(out)
+        self.assertEqual(stats['exported'], 1)
+        exported = list(csv.DictReader(io.StringIO(out.getvalue())))
+        exported[0]['price'] = '2.5'
+        products_db.import_products(exported)
+        self.assertEqual([p[3] for p in products_db.get_products()], [2.5])
+
+class TestProductSearch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        products_db.set_db_path(os.path.join(self.tmp.name, "products.db"))
+        products_db.init_db()
+        product_search.ensure_index()
+
+    def tearDown(self):
+        products_db.set_db_path(None)
+        self.tmp.cleanup()
+
+    def test_find_exact(self):
+        pid = products_db.add_product("Blue Widget", "", 4.0)
+        self.assertEqual(product_search.find_exact("  blue widget ")[0], pid)
+        self.assertEqual(product_search.find_exact(f"#{pid}: BLUE WIDGET")[0], pid)
+        self.assertIsNone(product_search.find_exact("blue"))
+
+    def test_search_ranks_exact_then_prefix_then_substring(self):
+        products_db.add_product("Large Gadget", "", 1.0)
+        products_db.add_product("Gadget Pro", "", 1.0)
+        products_db.add_product("Gadget", "", 1.0)
+        products_db.add_product("Spanner", "fits any gadget", 1.0)
+        names = [p[1] for p in product_search.search("gadget")]
+        self.assertEqual(names[:2], ["Gadget", "Gadget Pro"])
+        self.assertEqual(sorted(names[2:]), ["Large Gadget", "Spanner"])
+        products_db.update_product(1, "Huge Thing", "", 1.0)
+        self.assertNotIn("Large Gadget", [p[1] for p in product_search.search("gadget")])
+
+    def test_prefix_search_bounds(self):
+        for name in ("Zoe", "Zo\U0001F600 Mug", "Zo\uffff Cup", "Zp Pen", "zo[", "\U0010FFFF Tag"):
+            products_db.add_product(name, "", 1.0)
+        names = [p[1] for p in product_search.search("ZO")]
+        self.assertEqual(sorted(names), ["Zoe", "Zo\uffff Cup", "Zo\U0001F600 Mug", "zo["])
+        self.assertEqual([p[1] for p in product_search.search("\U0010FFFF")], ["\U0010FFFF Tag"])
+
+class TestProductCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "products.db")
+        products_db.set_db_path(self.db_path)
+        products_db.init_db()
+
+    def tearDown(self):
+        products_db.set_db_path(None)
+        self.tmp.cleanup()
+
+    def test_catalog_patched_by_writes(self):
+        first = products_db.catalog.products()
+        self.assertEqual(first, ())
+        pid = products_db.add_product("Widget", "", 1.0)
+        self.assertEqual(products_db.catalog.products(), ((pid, "Widget", "", 1.0),))
+        products_db.update_product(pid, "Widget", "", 2.0)
+        self.assertEqual(products_db.catalog.get(pid), (pid, "Widget", "", 2.0))
+        self.assertIs(products_db.catalog.products(), products_db.catalog.products())
+
+    def test_catalog_sees_external_writes(self):
+        products_db.catalog.products()
+        other = sqlite3.connect(self.db_path)
+        other.execute("INSERT INTO products (name, description, price) VALUES ('Gadget', '', 3.0)")
+        other.commit()
+        other.close()
+        self.assertEqual([p[1] for p in products_db.catalog.products()], ["Gadget"])
+
+    def test_catalog_ignores_other_tables(self):
+        import invoice_numbers
+        invoice_numbers.init_numbers()
+        pid = products_db.add_product("Widget", "", 1.0)
+        snapshot = products_db.catalog.products()
+        thread = threading.Thread(target=invoice_numbers.reserve, args=(5,))
+        thread.start()
+        thread.join()
+        self.assertIs(products_db.catalog.products(), snapshot)
+
+        thread = threading.Thread(target=products_db.update_product, args=(pid, "Widget", "", 2.0))
+        thread.start()
+        thread.join()
+        self.assertEqual(products_db.catalog.get(pid)[3], 2.0)
+        snapshot = products_db.catalog.products()
+        # Reading from another thread does not reload it either
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(products_db.catalog.products()))
+        thread.start()
+        thread.join()
+        self.assertIs(seen[0], snapshot)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import os
+import tempfile
+from datetime import datetime
+from PIL import Image as PILImage
+import batch_invoices
+import invoice_renderer
+import products_db
+import render_cache
+
+class TestRenderCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache_dir = os.path.join(self.tmp.name, "cache")
+        products_db.set_db_path(os.path.join(self.tmp.name, "products.db"))
+        self.addCleanup(products_db.set_db_path, None)
+
+    def test_lru_eviction_by_size(self):
+        cache = render_cache.RenderCache(self.cache_dir, max_bytes=1000)
+        for i, key in enumerate(("aa01", "bb02", "cc03")):
+            cache.put(key, bytes(300))
+            # Distinct, ordered access times without sleeping
+            os.utime(cache.path(key), ns=(i * 10**9, i * 10**9))
+        self.assertEqual(cache.get("aa01"), bytes(300))  # now the most recent
+        cache.put("dd04", bytes(300))
+        self.assertIsNone(cache.get("bb02"))
+        self.assertIsNone(cache.get("cc03"))
+        self.assertEqual(cache.get("aa01"), bytes(300))
+        self.assertLessEqual(cache.size(), 1000 * render_cache.LOW_WATER)
+        cache.put("ee05", bytes(2000))  # larger than the whole cache
+        self.assertIsNone(cache.get("ee05"))
+
+    def test_digest_follows_what_the_pdf_shows(self):
+        logo = os.path.join(self.tmp.name, "logo.png")
+        PILImage.new("RGB", (40, 20), "red").save(logo)
+        settings = {'company_name': 'Acme', 'logo_path': logo}
+        issued = datetime(2026, 3, 1, 9, 30)
+        customer = {'name': 'Ann'}
+        key, total = invoice_renderer.invoice_digest(settings, customer, [("A", "2", "1")], "N-1", issued)
+        self.assertEqual(total, 200)
+        same = [
+            invoice_renderer.invoice_digest(dict(settings, invoice_number_format="X-{seq}"),
+                                            {'name': 'Ann', 'email': None}, [("A", "2.00", "1.0")],
+                                            "N-1", datetime(2026, 3, 1, 17, 0)),
+        ]
+        self.assertEqual({k for k, _ in same}, {key})
+        different = [
+            invoice_renderer.invoice_digest(settings, customer, [("A", "2", "1")], "N-2", issued),
+            invoice_renderer.invoice_digest(settings, {'name': 'Bob'}, [("A", "2", "1")], "N-1", issued),
+            invoice_renderer.invoice_digest(settings, customer, [("A", "2", "2")], "N-1", issued),
+            invoice_renderer.invoice_digest(settings, customer, [("A", "2", "1")], "N-1", datetime(2026, 3, 2)),
+        ]
+        PILImage.new("RGB", (40, 20), "blue").save(logo)
+        different.append(invoice_renderer.invoice_digest(settings, customer, [("A", "2", "1")], "N-1", issued))
+        self.assertNotIn(key, {k for k, _ in different})
+
+    def test_render_invoice_serves_repeats_from_cache(self):
+        cache = render_cache.RenderCache(self.cache_dir)
+        first = os.path.join(self.tmp.name, "first.pdf")
+        again = os.path.join(self.tmp.name, "again.pdf")
+        items = [("Widget", "2.50", "2")]
+        issued = datetime(2026, 3, 1)
+        self.assertEqual(invoice_renderer.render_invoice(first, {}, {}, items, "N-1", issued, cache=cache), 500)
+        self.assertEqual(invoice_renderer.render_invoice(again, {}, {}, items, "N-1", issued, cache=cache), 500)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        with open(first, 'rb') as a, open(again, 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_batch_retry_uses_cache(self):
+        records = [{'customer': {'name': f'C{i}'}, 'items': [("Widget", "1", str(i + 1))],
+                    'invoice_number': f"R-{i}"} for i in range(3)]
+        out_dir = os.path.join(self.tmp.name, "out")
+        for _ in range(2):
+            results, _ = batch_invoices.run_batch(records, out_dir, {}, workers=1,
+                                                  cache_dir=self.cache_dir)
+            self.assertEqual([r[2] for r in results], [100, 200, 300])
+        self.assertEqual(batch_invoices._worker_cache.hits, 3)
+
+if __name__ == '__main__':
+    unittest.main()
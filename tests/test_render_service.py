@@ -0,0 +1,128 @@
+import unittest
+import unittest.mock
+import asyncio
+import json
+import os
+import tempfile
+import products_db
+import invoice_store
+import render_service
+
+class TestRenderService(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        products_db.set_db_path(os.path.join(self.tmp.name, "products.db"))
+        self.addCleanup(products_db.set_db_path, None)
+        self.out_dir = os.path.join(self.tmp.name, "out")
+
+    async def test_requests_are_validated_and_queue_is_bounded(self):
+        # Workers are not started, so the first invoice stays queued
+        service = render_service.RenderService({}, self.out_dir, workers=1, queue_size=1)
+        for body in (b'{"items": [["A"]]}', b'{"items": [5]}', b'{"customer": {"name": 5}, "items": []}',
+                     b'{"items": [{"name": ["A"], "price": "1", "quantity": "1"}]}'):
+            status, _, _, _ = await service.handle('POST', '/invoices', body)
+            self.assertEqual(status, 400, body)
+        status, _, _, _ = await service.handle('GET', '/invoices', b'')
+        self.assertEqual(status, 405)
+        status, _, _, _ = await service.handle('GET', '/nowhere', b'')
+        self.assertEqual(status, 404)
+
+        invoice = json.dumps({'items': [["Widget", "1", "1"]]}).encode()
+        queued = asyncio.create_task(service.handle('POST', '/invoices', invoice))
+        await asyncio.sleep(0)
+        status, _, _, headers = await service.handle('POST', '/invoices', invoice)
+        self.assertEqual(status, 503)
+        self.assertEqual(headers['Retry-After'], str(render_service.RETRY_AFTER))
+        self.assertEqual(service.health()['queued'], 1)
+        self.assertIn('invoice_service_rejected_total 1', service.metrics.format(1, 0, 1, 1))
+        queued.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await queued
+
+    async def test_bad_framing_and_internal_errors_get_a_response(self):
+        service = render_service.RenderService({}, self.out_dir, workers=1)
+
+        async def exchange(request):
+            reader = asyncio.StreamReader()
+            reader.feed_data(request)
+            reader.feed_eof()
+            sent = bytearray()
+            writer = unittest.mock.Mock(write=sent.extend, drain=unittest.mock.AsyncMock())
+            await service.serve_connection(reader, writer)
+            writer.close.assert_called_once()
+            return sent.decode('latin-1').split('\r\n', 1)[0]
+
+        self.assertEqual(await exchange(b"POST /invoices HTTP/1.1\r\nContent-Length: -5\r\n\r\n"),
+                         "HTTP/1.1 400 Bad Request")
+        with unittest.mock.patch.object(service, 'handle', side_effect=RuntimeError("boom")):
+            self.assertEqual(await exchange(b"GET /health HTTP/1.1\r\n\r\n"),
+                             "HTTP/1.1 500 Internal Server Error")
+
+    async def test_concurrent_duplicates_are_recorded_once(self):
+        service = render_service.RenderService({}, self.out_dir, workers=4)
+        await service.start()
+        try:
+            invoice = json.dumps({'items': [["Widget", "1", "1"]], 'invoice_number': "SAME-1"}).encode()
+            responses = await asyncio.gather(*(service.handle('POST', '/invoices?output=path', invoice)
+                                               for _ in range(8)))
+        finally:
+            await service.stop()
+        self.assertEqual(sorted(r[0] for r in responses), [200] + [409] * 7)
+        self.assertEqual(len(invoice_store.find_by_number("SAME-1")), 1)
+        self.assertEqual(os.listdir(self.out_dir), ["invoice_SAME-1.pdf"])
+
+    async def test_serves_pdf_and_stored_invoices(self):
+        service = render_service.RenderService({}, self.out_dir, workers=1,
+                                               cache_dir=os.path.join(self.tmp.name, "cache"))
+        servers = []
+        task = asyncio.create_task(render_service.serve(service, port=0, ready=servers.append))
+        while not servers:
+            await asyncio.sleep(0.01)
+        port = servers[0].sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+
+        async def call(method, target, data=None):
+            body = json.dumps(data).encode() if data is not None else b''
+            writer.write(f"{method} {target} HTTP/1.1\r\nHost: localhost\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            head = (await reader.readuntil(b'\r\n\r\n')).decode().split('\r\n')
+            headers = dict(line.split(': ', 1) for line in head[1:] if line)
+            payload = await reader.readexactly(int(headers['Content-Length']))
+            return int(head[0].split()[1]), headers, payload
+
+        try:
+            invoice = {'customer': {'name': 'Ann'},
+                       'items': [{'name': 'Widget', 'price': '2.50', 'quantity': 2}]}
+            status, headers, payload = await call('POST', '/invoices', invoice)
+            self.assertEqual(status, 200)
+            self.assertTrue(payload.startswith(b'%PDF'))
+            self.assertEqual(headers['X-Invoice-Total-Cents'], '500')
+
+            status, _, payload = await call('POST', '/invoices?output=path', invoice)
+            stored = json.loads(payload)
+            self.assertEqual(status, 200)
+            self.assertTrue(os.path.exists(stored['path']))
+            self.assertNotEqual(stored['invoice_number'], headers['X-Invoice-Number'])
+            self.assertEqual(len(invoice_store.find_by_number(stored['invoice_number'])), 1)
+            status, _, _ = await call('POST', '/invoices?output=path',
+                                      dict(invoice, invoice_number=stored['invoice_number']))
+            self.assertEqual(status, 409)
+
+            numbered = dict(invoice, invoice_number="FIXED-1")
+            _, _, first = await call('POST', '/invoices', numbered)
+            _, _, repeat = await call('POST', '/invoices', numbered)
+            self.assertEqual(first, repeat)
+
+            status, _, payload = await call('GET', '/health')
+            self.assertEqual(json.loads(payload)['status'], 'ok')
+            status, _, payload = await call('GET', '/metrics')
+            self.assertIn(b'invoice_service_rendered_total 4', payload)
+            self.assertIn(b'invoice_service_cache_hits_total 1', payload)
+        finally:
+            writer.close()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+import io
+import os
+import random
+import tempfile
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+import products_db
+import invoice_store
+import reports
+from line_items import line_total_cents, parse_decimal
+
+class TestReports(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        products_db.set_db_path(os.path.join(self.tmp.name, "products.db"))
+        products_db.init_db()
+        invoice_store.init_store()
+        self.invoices = {}
+
+    def tearDown(self):
+        products_db.set_db_path(None)
+        self.tmp.cleanup()
+
+    def save(self, issued, customer, items):
+        total = sum(line_total_cents(parse_decimal(p), parse_decimal(q)) for _, p, q in items)
+        invoice_id = invoice_store.save_invoice(f"INV-{len(self.invoices)}", issued, {'name': customer},
+                                                items, total)
+        self.invoices[invoice_id] = (invoice_store.format_issued(issued), customer, items)
+        return invoice_id
+
+    def make_history(self, count, rng):
+        start = datetime(2024, 11, 1)
+        for _ in range(count):
+            issued = start + timedelta(seconds=rng.randrange(180 * 86400))
+            items = [(rng.choice(["Widget", "Gadget", "Gizmo", "Doohickey"]),
+                      f"{rng.randrange(1, 5000) / 100:.2f}", rng.choice(["1", "2", "0.5", "3"]))
+                     for _ in range(rng.randrange(1, 5))]
+            self.save(issued, rng.choice(["Ann", "ann", "Bob", "Cy"]), items)
+
+    def expected_products(self, date_from, date_to):
+        totals = defaultdict(lambda: [0, 0.0, 0])
+        for issued, _, items in self.invoices.values():
+            if (date_from and issued < date_from) or (date_to and issued >= date_to):
+                continue
+            for name, price, quantity in items:
+                row = totals[name]
+                row[0] += 1
+                row[1] += float(quantity)
+                row[2] += line_total_cents(parse_decimal(price), parse_decimal(quantity))
+        return sorted(((name, lines, units, cents) for name, (lines, units, cents) in totals.items()),
+                      key=lambda r: (-r[3], r[0]))
+
+    def test_products_match_raw_lines_for_any_period(self):
+        rng = random.Random(3)
+        self.make_history(60, rng)
+        # Lines stored before the rollup existed are backfilled
+        reports.init_reports()
+        self.make_history(60, rng)
+        periods = [(None, None), ("2025-01-01", "2025-03-01"), ("2024-12-15", "2025-02-10"),
+                   ("2025-01-05", "2025-01-20"), ("2025-02-01", None), (None, "2025-01-17 12:00:00"),
+                   ("2025-01-31 23:00:00", "2025-02-01")]
+        for date_from, date_to in periods:
+            with self.subTest(date_from=date_from, date_to=date_to):
+                rows = reports.revenue_by_product(date_from, date_to)
+                expected = self.expected_products(date_from, date_to)
+                self.assertEqual([(r[0], r[1], r[3]) for r in rows], [(r[0], r[1], r[3]) for r in expected])
+                for row, want in zip(rows, expected):
+                    self.assertAlmostEqual(row[2], want[2])
+
+        # Deleting an invoice takes its lines out of the rollup too
+        conn = products_db.get_connection()
+        with products_db.transaction():
+            for invoice_id in list(self.invoices)[:20]:
+                conn.execute("DELETE FROM invoices WHERE invoice_id = ?", (invoice_id,))
+                del self.invoices[invoice_id]
+        self.assertEqual([(r[0], r[1], r[3]) for r in reports.revenue_by_product()],
+                         [(r[0], r[1], r[3]) for r in self.expected_products(None, None)])
+        self.assertEqual(len(reports.revenue_by_product(limit=2)), 2)
+
+    def test_customer_and_month_reports(self):
+        reports.init_reports()
+        self.save(datetime(2025, 1, 3), "Ann", [("Widget", "10", "1")])
+        self.save(datetime(2025, 1, 30), "ANN", [("Widget", "5", "1")])
+        self.save(datetime(2025, 2, 2), "Bob", [("Gadget", "20", "1")])
+        self.save(datetime(2025, 4, 1), "Cy", [("Gadget", "1", "1")])
+        customers = reports.revenue_by_customer()
+        self.assertEqual([(r[1], r[2]) for r in customers], [(1, 2000), (2, 1500), (1, 100)])
+        self.assertEqual(customers[1][0].lower(), "ann")
+        self.assertEqual(reports.revenue_by_customer(*reports.parse_period("2025Q1"), limit=1)[0][1:],
+                         (1, 2000))
+        self.assertEqual(reports.revenue_by_month(),
+                         [("2025-01", 2, 1500), ("2025-02", 1, 2000), ("2025-04", 1, 100)])
+        self.assertEqual(reports.revenue_by_month(date(2025, 2, 1), datetime(2025, 4, 1)),
+                         [("2025-02", 1, 2000)])
+
+    def test_parse_period(self):
+        self.assertEqual(reports.parse_period("2025Q4"), (date(2025, 10, 1), date(2026, 1, 1)))
+        self.assertEqual(reports.parse_period("2025q2"), (date(2025, 4, 1), date(2025, 7, 1)))
+        self.assertEqual(reports.parse_period("2025-12"), (date(2025, 12, 1), date(2026, 1, 1)))
+        self.assertEqual(reports.parse_period("2025"), (date(2025, 1, 1), date(2026, 1, 1)))
+        with self.assertRaises(ValueError):
+            reports.parse_period("2025Q5")
+
+    def test_csv_and_pdf_output(self):
+        reports.init_reports()
+        self.save(datetime(2025, 1, 3), "Ann", [("Widget", "1.25", "2"), ("Gadget", "3", "0.5")])
+        rows = reports.revenue_by_product()
+        out = io.StringIO()
+        reports.write_csv(out, 'products', rows)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ["Product,Lines,Units,Revenue", "Widget,1,2,2.50", "Gadget,1,0.5,1.50"])
+        pdf = io.BytesIO()
+        reports.write_pdf(pdf, 'products', rows, date(2025, 1, 1), date(2025, 4, 1))
+        self.assertTrue(pdf.getvalue().startswith(b"%PDF"))
+        path = os.path.join(self.tmp.name, "months.csv")
+        self.assertEqual(reports.main(["months", "--db", products_db.get_db_path(),
+                                       "--period", "2025-01", "-o", path]), 0)
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(f.read().splitlines(), ["Month,Invoices,Revenue", "2025-01,1,4.00"])
+
+if __name__ == '__main__':
+    unittest.main()
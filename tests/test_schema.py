@@ -0,0 +1,33 @@
+import unittest
+import os
+import tempfile
+from unittest.mock import patch
+import products_db
+import schema
+
+class TestSchema(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        products_db.set_db_path(os.path.join(self.tmp.name, "products.db"))
+
+    def tearDown(self):
+        products_db.set_db_path(None)
+        self.tmp.cleanup()
+
+    def test_ddl_skipped_once_version_matches(self):
+        self.assertEqual(schema.schema_version(), 0)
+        self.assertTrue(schema.ensure_schema())
+        self.assertEqual(schema.schema_version(), schema.SCHEMA_VERSION)
+        tables = {row[0] for row in products_db.get_connection().execute(
+            "SELECT name FROM sqlite_master WHERE type='table'")}
+        self.assertTrue({'products', 'invoices', 'invoice_lines', 'invoice_sequences', 'customers',
+                          'report_product_months', 'archive_entries'} <= tables)
+
+        with patch('products_db.init_db') as init_db:
+            self.assertFalse(schema.ensure_schema())
+            init_db.assert_not_called()
+            self.assertTrue(schema.ensure_schema(force=True))
+            init_db.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
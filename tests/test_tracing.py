@@ -0,0 +1,45 @@
+import unittest
+import json
+import os
+import tempfile
+import tracing
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.was_enabled = tracing.enabled()
+        tracing.reset()
+
+    def tearDown(self):
+        (tracing.enable if self.was_enabled else tracing.disable)()
+        tracing.reset()
+
+    def test_disabled_records_nothing(self):
+        tracing.disable()
+        double = tracing.traced('test.double')(lambda x: 2 * x)
+        with tracing.span('test.block'):
+            self.assertEqual(double(2), 4)
+        self.assertEqual(tracing.stats(), {})
+
+    def test_spans_histograms_and_chrome_trace(self):
+        tracing.enable()
+        double = tracing.traced('test.double')(lambda x: 2 * x)
+        with tracing.span('test.block'):
+            for i in range(3):
+                double(i)
+        stats = tracing.stats()
+        self.assertEqual(stats['test.double']['count'], 3)
+        self.assertEqual(sum(stats['test.double']['buckets']), 3)
+        self.assertEqual(stats['test.block']['count'], 1)
+        self.assertIn('test.double: 3 calls', tracing.format_histograms())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trace.json')
+            summary_path = tracing.dump(path)
+            with open(path) as f:
+                events = json.load(f)['traceEvents']
+            self.assertTrue(os.path.exists(summary_path))
+        self.assertEqual(sorted(e['name'] for e in events), ['test.block'] + ['test.double'] * 3)
+        self.assertTrue(all(e['ph'] == 'X' and e['dur'] >= 0 for e in events))
+
+if __name__ == '__main__':
+    unittest.main()
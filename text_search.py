@@ -0,0 +1,140 @@
+import sqlite3
+import products_db
+
+# Ranked lookups shared by product_search and customers_db:
+#  - name prefix: range scan on a NOCASE index on the name column;
+#  - substring of any indexed column: FTS5 trigram index kept in sync by
+#    triggers. Builds of SQLite without the trigram tokenizer get a
+#    unicode61 prefix index instead, and builds without FTS5 plain LIKE
+#    scans.
+
+_ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+def prefix_bound(text):
+    # The smallest string greater than every string starting with text under
+    # NOCASE, which folds ASCII letters only (so 'Z' is compared as 'z'), or
+    # None if there is none. Surrogates cannot be stored, so they are skipped.
+    text = text.translate(_ASCII_LOWER)
+    while text:
+        code = ord(text[-1]) + 1
+        if code == 0xD800:
+            code = 0xE000
+        if code <= 0x10FFFF:
+            return text[:-1] + chr(code)
+        text = text[:-1]
+    return None
+
+class TextIndex:
+    # Search over one table. ``fields`` are the result columns and start with
+    # the key and the name; ``columns`` are the ones indexed for substring
+    # matches; ``order`` sorts prefix matches and should match the NOCASE
+    # index the table's owner creates on name.
+
+    def __init__(self, table, key, fields, columns, order='name COLLATE NOCASE'):
+        self.table = table
+        self.key = key
+        self.fields = fields
+        self.columns = columns
+        self.order = order
+        self.fts = f'{table}_fts'
+        self.mode = None
+        self.db = None
+
+    def _triggers(self):
+        fts, cols = self.fts, ', '.join(self.columns)
+        insert = (f"INSERT INTO {fts}(rowid, {cols}) VALUES "
+                  f"(new.{self.key}, {', '.join('new.' + c for c in self.columns)});")
+        delete = (f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES "
+                  f"('delete', old.{self.key}, {', '.join('old.' + c for c in self.columns)});")
+        return (
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {self.table} BEGIN {insert} END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {self.table} BEGIN {delete} END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {self.table} BEGIN "
+            f"{delete} {insert} END",
+        )
+
+    def ensure(self):
+        # Creates the index for the current database if it is missing; returns
+        # 'trigram', 'unicode61' or None (no FTS5 in this SQLite build).
+        self.db = products_db.get_db_path()
+        conn = products_db.get_connection()
+        exists = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (self.fts,)).fetchone()
+        if exists:
+            self.mode = 'trigram' if 'trigram' in exists[0] else 'unicode61'
+            return self.mode
+        for mode, tokenizer in (('trigram', "tokenize='trigram'"), ('unicode61', "prefix='2 3'")):
+            try:
+                with products_db.transaction():
+                    conn.execute(
+                        f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.fts} USING fts5("
+                        f"{', '.join(self.columns)}, content='{self.table}', "
+                        f"content_rowid='{self.key}', {tokenizer})")
+                    self.restore(conn)
+            except sqlite3.OperationalError:
+                continue
+            self.mode = mode
+            return mode
+        self.mode = None
+        return None
+
+    def drop_triggers(self, conn):
+        # For bulk loads: drop the triggers, then restore() once at the end.
+        for event in ('ai', 'ad', 'au'):
+            conn.execute(f"DROP TRIGGER IF EXISTS {self.fts}_{event}")
+
+    def restore(self, conn):
+        for statement in self._triggers():
+            conn.execute(statement)
+        conn.execute(f"INSERT INTO {self.fts}({self.fts}) VALUES ('rebuild')")
+
+    def _fts_query(self, text):
+        terms = [t.replace('"', '""') for t in text.split()]
+        if self.mode == 'trigram':
+            if any(len(t) < 3 for t in terms):
+                return None
+            return " AND ".join(f'"{t}"' for t in terms)
+        return " AND ".join(f'"{t}"*' for t in terms)
+
+    def prefix_search(self, conn, text, limit):
+        fields = ', '.join(self.fields)
+        bound = prefix_bound(text)
+        if bound is None:
+            return conn.execute(
+                f'SELECT {fields} FROM {self.table} WHERE name >= ? COLLATE NOCASE '
+                f'ORDER BY {self.order} LIMIT ?', (text, limit)).fetchall()
+        return conn.execute(
+            f'SELECT {fields} FROM {self.table} '
+            f'WHERE name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE '
+            f'ORDER BY {self.order} LIMIT ?', (text, bound, limit)).fetchall()
+
+    def substring_search(self, conn, text, limit):
+        match = self._fts_query(text) if self.mode else None
+        if match:
+            return conn.execute(
+                f"SELECT {', '.join('t.' + f for f in self.fields)} FROM {self.fts} "
+                f"JOIN {self.table} t ON t.{self.key} = {self.fts}.rowid "
+                f"WHERE {self.fts} MATCH ? LIMIT ?", (match, limit)).fetchall()
+        if self.mode or len(text) < 3:
+            return []
+        pattern = f"%{text}%"
+        return conn.execute(
+            f"SELECT {', '.join(self.fields)} FROM {self.table} "
+            f"WHERE {' OR '.join(c + ' LIKE ?' for c in self.columns)} LIMIT ?",
+            (pattern,) * len(self.columns) + (limit,)).fetchall()
+
+    def search(self, text, limit):
+        # Ranked: exact name, then name prefix, then other substring matches.
+        # Every step is an index probe bounded by ``limit``, so latency does
+        # not grow with the table. text must already be stripped.
+        conn = products_db.get_connection()
+        lowered = text.lower()
+        results = sorted(self.prefix_search(conn, text, limit), key=lambda r: r[1].lower() != lowered)
+        if len(results) < limit:
+            seen = {r[0] for r in results}
+            for row in self.substring_search(conn, text, limit + len(results)):
+                if row[0] not in seen:
+                    results.append(row)
+                    if len(results) >= limit:
+                        break
+        return results
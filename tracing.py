@@ -0,0 +1,178 @@
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Named timing spans for the hot paths (rendering stages, products_db calls,
+# widget building). Disabled, a span is one global check; enabled, each one
+# records a complete event for the Chrome trace viewer (chrome://tracing or
+# https://ui.perfetto.dev) and adds its duration to a per-name histogram.
+#
+# Turn it on with INVOICE_TRACE=<file.json> (or INVOICE_TRACE=1 for a file
+# in the working directory); the trace and a histogram summary are written
+# at exit. The app also has a File > Trace Performance toggle.
+
+ENV_VAR = 'INVOICE_TRACE'
+MAX_EVENTS = 1_000_000
+# Histogram bucket upper bounds in milliseconds; the last bucket is open
+BUCKETS_MS = (0.01, 0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+_enabled = False
+_lock = threading.Lock()
+_events = []
+_stats = {}
+_dropped = 0
+_origin_ns = time.perf_counter_ns()
+
+def enabled():
+    return _enabled
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def reset():
+    global _dropped
+    with _lock:
+        _events.clear()
+        _stats.clear()
+        _dropped = 0
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, self.start, time.perf_counter_ns())
+        return False
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def span(name):
+    # with tracing.span('render.save'): ...
+    return _Span(name) if _enabled else _NULL_SPAN
+
+def traced(name):
+    # Decorator form of span(); the wrapper only checks the flag when off.
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(name, start, time.perf_counter_ns())
+        return wrapper
+    return decorate
+
+def _bucket(duration_ms):
+    for i, bound in enumerate(BUCKETS_MS):
+        if duration_ms <= bound:
+            return i
+    return len(BUCKETS_MS)
+
+def _record(name, start, end):
+    global _dropped
+    duration_ms = (end - start) / 1e6
+    with _lock:
+        if len(_events) < MAX_EVENTS:
+            _events.append((name, threading.get_ident(), start, end - start))
+        else:
+            _dropped += 1
+        stats = _stats.get(name)
+        if stats is None:
+            # count, total ms, min ms, max ms, bucket counts
+            stats = _stats[name] = [0, 0.0, duration_ms, duration_ms, [0] * (len(BUCKETS_MS) + 1)]
+        stats[0] += 1
+        stats[1] += duration_ms
+        stats[2] = min(stats[2], duration_ms)
+        stats[3] = max(stats[3], duration_ms)
+        stats[4][_bucket(duration_ms)] += 1
+
+def stats():
+    # {name: {'count', 'total_ms', 'mean_ms', 'min_ms', 'max_ms', 'buckets'}}
+    with _lock:
+        return {name: {
+            'count': count,
+            'total_ms': total,
+            'mean_ms': total / count,
+            'min_ms': low,
+            'max_ms': high,
+            'buckets': list(buckets),
+        } for name, (count, total, low, high, buckets) in _stats.items()}
+
+def format_histograms():
+    lines = []
+    labels = [f"<={b:g}ms" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]:g}ms"]
+    for name, s in sorted(stats().items(), key=lambda item: -item[1]['total_ms']):
+        lines.append(f"{name}: {s['count']} calls, total {s['total_ms']:.1f} ms, "
+                     f"mean {s['mean_ms']:.3f} ms, min {s['min_ms']:.3f} ms, max {s['max_ms']:.3f} ms")
+        peak = max(s['buckets'])
+        for label, count in zip(labels, s['buckets']):
+            if count:
+                lines.append(f"  {label:>10} {count:>8} {'#' * max(1, round(40 * count / peak))}")
+    if _dropped:
+        lines.append(f"({_dropped} events beyond {MAX_EVENTS} were left out of the trace)")
+    return "\n".join(lines)
+
+def write_chrome_trace(path):
+    pid = os.getpid()
+    with _lock:
+        events = list(_events)
+    trace = {
+        'displayTimeUnit': 'ms',
+        'traceEvents': [{
+            'name': name, 'cat': name.split('.', 1)[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+            'ts': (start - _origin_ns) / 1000, 'dur': duration / 1000,
+        } for name, tid, start, duration in events],
+    }
+    with open(path, 'w') as f:
+        json.dump(trace, f)
+    return path
+
+def dump(path):
+    # Writes the Chrome trace to path and the histograms next to it (.txt).
+    write_chrome_trace(path)
+    summary_path = os.path.splitext(path)[0] + '.txt'
+    with open(summary_path, 'w') as f:
+        f.write(format_histograms() + "\n")
+    return summary_path
+
+def _dump_at_exit(path):
+    if _events:
+        summary_path = dump(path)
+        print(f"Trace written to {path}, histograms to {summary_path}", file=sys.stderr)
+
+def _setup_from_env():
+    value = os.environ.get(ENV_VAR, '').strip()
+    if not value or value == '0':
+        return
+    path = f"invoice_trace_{os.getpid()}.json" if value == '1' else value
+    enable()
+    atexit.register(_dump_at_exit, path)
+
+_setup_from_env()